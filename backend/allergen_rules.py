@@ -0,0 +1,227 @@
+import re
+from collections import namedtuple
+
+from safety import all_categories
+
+# Each category is one bit, so a comment's violations are the OR of its ingredients' masks
+CATEGORY_BITS = {category: 1 << i for i, category in enumerate(all_categories)}
+ALL_MASK = (1 << len(all_categories)) - 1
+
+VEGAN, VEGETARIAN, KOSHER, NUTS, HALAL, DAIRY, GLUTEN = (CATEGORY_BITS[c] for c in all_categories)
+MEAT = VEGAN | VEGETARIAN | KOSHER | HALAL
+PORK = VEGAN | VEGETARIAN | KOSHER | HALAL
+SHELLFISH = VEGAN | VEGETARIAN | KOSHER
+# Fish with fins and scales; "fish", eel, catfish, sturgeon roe and the like count as SHELLFISH
+FISH = VEGAN | VEGETARIAN
+MILK = VEGAN | DAIRY
+# Cheese is often set with animal rennet
+CHEESE = MILK | VEGETARIAN | KOSHER | HALAL
+NEUTRAL = 0
+
+# Ingredient -> every category it can violate. Meat counts against kosher and halal because
+# comments almost never say the meat is certified; anything hedged is left to the model (see
+# HEDGES). Dishes whose contents vary by kitchen belong in COMPOSITE, not here.
+LEXICON = {
+    # meat
+    **dict.fromkeys([
+        "chicken", "beef", "steak", "lamb", "turkey", "duck", "veal", "goat", "mutton", "brisket",
+        "barbacoa", "short rib", "carne asada", "pollo", "birria", "oxtail", "venison", "foie gras",
+        "gelatin", "bone broth", "chicken broth", "beef broth", "fish sauce", "lard",
+    ], MEAT),
+    **dict.fromkeys([
+        "pork", "bacon", "ham", "prosciutto", "pancetta", "chorizo", "carnitas", "al pastor",
+        "pepperoni", "salami", "pork belly", "spam",
+    ], PORK),
+    "char siu": PORK | GLUTEN,
+    **dict.fromkeys([
+        "shrimp", "prawn", "lobster", "crab", "clam", "mussel", "oyster", "scallop", "crawfish",
+        "squid", "octopus", "shellfish", "fish", "eel", "catfish", "roe", "caviar",
+    ], SHELLFISH),
+    "calamari": SHELLFISH | GLUTEN,
+    **dict.fromkeys([
+        "salmon", "tuna", "cod", "tilapia", "halibut", "anchovy", "sardine", "trout", "mackerel",
+    ], FISH),
+    # dairy and other animal products
+    **dict.fromkeys([
+        "milk", "butter", "cream", "sour cream", "yogurt", "ricotta", "paneer", "ghee", "whipped cream",
+        "cream cheese", "buttermilk", "crema", "latte",
+    ], MILK),
+    **dict.fromkeys([
+        "cheese", "queso", "mozzarella", "cheddar", "parmesan", "feta", "cotija", "burrata", "alfredo",
+    ], CHEESE),
+    **dict.fromkeys(["egg", "mayo", "mayonnaise", "aioli", "honey", "meringue"], VEGAN),
+    "custard": MILK,
+    # alcohol; wine also needs a kosher certification and beer is brewed from barley
+    **dict.fromkeys(["rum", "vodka", "sake", "mirin", "bourbon", "tequila"], HALAL),
+    "wine": HALAL | KOSHER,
+    "beer": HALAL | GLUTEN,
+    # gluten
+    **dict.fromkeys([
+        "wheat", "flour", "flour tortilla", "wheat tortilla", "barley", "rye", "seitan", "soy sauce",
+        "couscous", "bulgur",
+    ], GLUTEN),
+    # breading is usually stuck on with egg
+    **dict.fromkeys(["breaded", "battered"], GLUTEN | VEGAN),
+    "beer batter": GLUTEN | HALAL | VEGAN,
+    "naan": GLUTEN | MILK,
+    # nuts; coconut counts as a tree nut on allergen labels
+    **dict.fromkeys([
+        "peanut", "peanut butter", "almond", "cashew", "walnut", "pecan", "pistachio", "hazelnut",
+        "macadamia", "pine nut", "nut", "coconut", "coconut milk", "almond milk",
+    ], NUTS),
+    **dict.fromkeys(["praline", "nutella"], NUTS | MILK),
+    "marzipan": NUTS | VEGAN,
+    "pesto": NUTS | CHEESE,
+    # Ingredients that violate nothing however they are usually prepared, so comments made of
+    # them alone can be settled locally. Generic or often-adulterated words ("sauce", "curry",
+    # "kimchi", "fries", "oat", "salad", ...) are deliberately absent: as unknown words they
+    # keep the comment below full coverage and send it to the model.
+    **dict.fromkeys([
+        "rice", "brown rice", "white rice", "lettuce", "tomato", "salsa", "pico de gallo", "corn",
+        "avocado", "guacamole", "onion", "garlic", "pepper", "jalapeno", "cilantro", "lime", "lemon",
+        "potato", "tofu", "chickpea", "hummus", "lentil", "spinach", "kale", "cucumber", "carrot",
+        "broccoli", "mushroom", "zucchini", "eggplant", "cabbage", "olive oil", "olive", "fruit",
+        "apple", "banana", "mango", "pineapple", "berry", "quinoa", "salt", "soy milk", "edamame",
+        "seaweed", "herb", "basil", "ginger", "sesame",
+    ], NEUTRAL),
+}
+
+# Dishes and doughs whose ingredients vary by kitchen: a cheeseburger may or may not have a
+# brioche bun, ramen broth may be pork or fish, a sandwich holds anything. Comments naming one
+# are never settled as safe for anything; only the model can judge them.
+COMPOSITE = {
+    "burger", "hamburger", "cheeseburger", "gyro", "shawarma", "kebab", "satay", "meatball",
+    "meatloaf", "sausage", "wings", "ribs", "sashimi", "sushi", "bread", "bun", "pasta",
+    "spaghetti", "noodle", "ramen", "udon", "pho", "tempura", "teriyaki", "crouton", "pita",
+    "bagel", "croissant", "dumpling", "crust", "sandwich", "wrap", "biscuit", "cake", "cookie",
+    "pancake", "waffle", "pie", "pretzel", "burrito", "taco", "quesadilla", "grilled cheese",
+    "lasagna", "mac and cheese", "pizza", "omelette", "omelet", "ice cream", "peanut sauce",
+    "stir fry", "fried rice", "soup", "stew", "chili",
+}
+
+# Words that flip or qualify an ingredient ("no cheese", "vegan sausage", "gluten-free bun").
+# Comments containing any of them are never settled by the rules.
+HEDGES = {
+    "no", "not", "without", "free", "vegan", "vegetarian", "plant", "based", "imitation", "faux",
+    "mock", "fake", "substitute", "alternative", "impossible", "beyond", "instead", "optional",
+    "except", "removed", "hold", "kosher", "halal", "certified", "gf", "df",
+}
+
+# Words that carry no ingredient information and do not count against coverage
+FILLER = {
+    "a", "an", "the", "and", "or", "with", "of", "in", "on", "it", "its", "it's", "this", "that",
+    "was", "is", "are", "were", "be", "been", "very", "so", "really", "too", "also", "some",
+    "had", "has", "have", "i", "we", "my", "our", "they", "their", "there", "came", "comes",
+    "topped", "served", "side", "sides", "made", "filled", "stuffed", "loaded", "extra", "lots",
+    "bit", "little", "lot", "plus", "for", "to", "at", "but", "just", "like", "bowl", "plate",
+    "dish", "order", "ordered", "got", "get", "tasted", "taste", "tastes", "flavor", "flavorful",
+    "good", "great", "delicious", "amazing", "tasty", "yummy", "awesome", "excellent", "perfect",
+    "nice", "fresh", "spicy", "hot", "mild", "sweet", "savory", "soft",
+    "tender", "juicy", "grilled", "roasted", "steamed", "sauteed", "smoked",
+    "shredded", "diced", "sliced", "chopped", "mixed", "homemade", "house", "small", "large",
+    "big", "portion", "well", "loved", "love", "liked", "enjoyed", "recommend", "best", "okay",
+    "ok", "pretty", "quite", "definitely", "overall", "price", "worth", "favorite", "them", "all",
+}
+
+RuleVerdict = namedtuple("RuleVerdict", ["settled", "safe_categories", "violations", "confidence", "matched"])
+
+
+def _term_pattern(terms):
+    # Longest terms first so "peanut sauce" wins over "peanut"; allow simple plurals
+    alternatives = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alternatives})(?:e?s)?\b")
+
+
+TERM_PATTERN = _term_pattern(LEXICON)
+COMPOSITE_PATTERN = _term_pattern(COMPOSITE)
+TOKEN_PATTERN = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+
+def _singular(term):
+    if term in LEXICON:
+        return term
+    for suffix in ("es", "s"):
+        if term.endswith(suffix) and term[:-len(suffix)] in LEXICON:
+            return term[:-len(suffix)]
+    return term
+
+
+def tag_mask(tag_list):
+    """
+    Bitmask of the known categories named in a tag list. Unrecognized tags are ignored.
+    """
+    mask = 0
+    for tag in tag_list:
+        mask |= CATEGORY_BITS.get(tag.strip().lower(), 0)
+    return mask
+
+
+def categories_from_mask(mask):
+    return [category for category in all_categories if mask & CATEGORY_BITS[category]]
+
+
+class AllergenRules:
+    """
+    Rule-based pre-classifier that settles comments whose ingredients decide every category.
+
+    A comment is settled when either its ingredients and tags already violate every category,
+    or at least `min_coverage` of its meaningful words are known ingredients, none of them is
+    hedged and it names no COMPOSITE dish. Everything else is left for the model.
+    """
+
+    def __init__(self, min_coverage=1.0):
+        self.min_coverage = min_coverage
+        self.checked = 0
+        self.settled = 0
+
+    def classify(self, comment, tag_list=()):
+        """
+        Returns a RuleVerdict for one (comment, tag_list) pair.
+        """
+        self.checked += 1
+        verdict = self._classify(comment or "", tag_mask(tag_list))
+        if verdict.settled:
+            self.settled += 1
+        return verdict
+
+    def classify_many(self, items):
+        """
+        Classifies an iterable of (comment, tag_list) pairs in one pass.
+        """
+        return [self.classify(comment, tag_list) for comment, tag_list in items]
+
+    def _classify(self, comment, known_mask):
+        text = comment.lower().replace("-", " ")
+        mask = known_mask
+        matched = []
+        matched_tokens = 0
+        for match in TERM_PATTERN.finditer(text):
+            term = _singular(match.group(0))
+            matched.append(term)
+            mask |= LEXICON[term]
+            matched_tokens += match.group(0).count(" ") + 1
+
+        remaining = TOKEN_PATTERN.findall(TERM_PATTERN.sub(" ", text))
+        hedged = any(token in HEDGES for token in TOKEN_PATTERN.findall(text))
+        composite = COMPOSITE_PATTERN.search(text) is not None
+        unknown = sum(1 for token in remaining if token not in FILLER and token not in HEDGES)
+        meaningful = matched_tokens + unknown
+        coverage = matched_tokens / meaningful if meaningful else 0.0
+
+        violations = categories_from_mask(mask)
+        if hedged or not matched:
+            return RuleVerdict(False, None, violations, 0.0 if hedged else coverage, matched)
+        if mask == ALL_MASK:
+            return RuleVerdict(True, [], violations, 1.0, matched)
+        if composite:
+            return RuleVerdict(False, None, violations, 0.0, matched)
+        if coverage >= self.min_coverage:
+            return RuleVerdict(True, categories_from_mask(ALL_MASK & ~mask), violations, round(coverage, 3), matched)
+        return RuleVerdict(False, None, violations, round(coverage, 3), matched)
+
+    def stats(self):
+        return {
+            "checked": self.checked,
+            "settled": self.settled,
+            "avoided_fraction": round(self.settled / self.checked, 3) if self.checked else 0,
+        }
@@ -0,0 +1,364 @@
+# Hermetic load test of the whole backend.
+#
+#   python bench/loadtest.py --concurrency 32 --duration 10 --output results.json
+#   python bench/loadtest.py --scenarios dishes,nearby --compare results.json
+#
+# Starts a throwaway mongod (or uses --mongo-uri), the OpenAI and Places stubs from stubs/ with
+# --openai-latency-ms/--places-latency-ms of injected latency, and `uvicorn main:app`, all on
+# localhost. It seeds restaurants, dishes and reviews through the API, then drives each scenario
+# at the target concurrency for --duration seconds and reports throughput, latency percentiles
+# and error and 429 rates. Needs only the backend's requirements and a `mongod` binary on PATH.
+#
+# --mongo-uri must point at a disposable server: the suite writes to restaurant_allergy.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, BACKEND)
+
+import httpx
+
+from stubs.places_stub import make_place
+
+TOWN = "Pittsburgh"
+CENTER = (40.4406, -79.9959)
+COMMENTS = [
+    "Great burrito bowl, no cheese and they changed gloves for my peanut allergy",
+    "The pad thai has peanuts and fish sauce",
+    "Vegan options were clearly labelled, tofu was crispy",
+    "Cooked in the same fryer as the shrimp, careful if you are allergic to shellfish",
+    "Halal chicken over rice, huge portion",
+    "Gluten free crust tasted fine but they use the same oven",
+    "Dairy free gelato, staff were very knowledgeable",
+    "Kosher deli sandwich, pastrami was excellent",
+]
+
+
+# All load comes from one IP and the stubs have no quota to protect, so lift the rate limits
+# out of the way; otherwise the scenarios that reach them would measure 429s, not the endpoints
+UNLIMITED = {
+    f"RATE_LIMIT_{name}_{setting}": value
+    for name in ("OPENAI", "PLACES", "CLIENT_SAFETY", "CLIENT_SAFETY_BATCH", "CLIENT_PLACES")
+    for setting, value in (("RATE", "1000000"), ("BURST", "1000000"))
+}
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p * len(values)))] if values else None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Timed out waiting for {' '.join(process.args)} on port {port}")
+
+
+class Stack:
+    """
+    The processes under test: mongod (unless --mongo-uri is given), both stubs and the app.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.processes = []
+        self.tempdir = None
+
+    def _start(self, command, port, env=None, log_name=None):
+        log = open(os.path.join(self.tempdir, f"{log_name}.log"), "w")
+        process = subprocess.Popen(command, cwd=BACKEND, env={**os.environ, **(env or {})}, stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(process)
+        wait_for_port(port, process)
+        return f"http://127.0.0.1:{port}"
+
+    def start(self):
+        self.tempdir = tempfile.mkdtemp(prefix="safeplates-bench-")
+        mongo_uri = self.args.mongo_uri
+        if mongo_uri is None:
+            mongod = shutil.which("mongod")
+            if mongod is None:
+                raise RuntimeError("mongod is not on PATH; install MongoDB or pass --mongo-uri")
+            port = free_port()
+            os.makedirs(os.path.join(self.tempdir, "db"))
+            self._start([mongod, "--dbpath", os.path.join(self.tempdir, "db"), "--port", str(port), "--bind_ip", "127.0.0.1",
+                         "--wiredTigerCacheSizeGB", "0.5", "--quiet"], port, log_name="mongod")
+            mongo_uri = f"mongodb://127.0.0.1:{port}"
+
+        uvicorn = [sys.executable, "-m", "uvicorn", "--log-level", "warning"]
+        openai_port, places_port, app_port = free_port(), free_port(), free_port()
+        openai_url = self._start([*uvicorn, "stubs.openai_stub:app", "--port", str(openai_port)], openai_port,
+                                 {"OPENAI_API_KEY": "stub", "STUB_LATENCY_MS": str(self.args.openai_latency_ms)}, "openai_stub")
+        places_url = self._start([*uvicorn, "stubs.places_stub:app", "--port", str(places_port)], places_port,
+                                 {"STUB_LATENCY_MS": str(self.args.places_latency_ms)}, "places_stub")
+        return self._start([*uvicorn, "main:app", "--port", str(app_port), "--workers", str(self.args.workers)], app_port, {
+            "MONGO_URI": mongo_uri,
+            "OPENAI_API_KEY": "stub",
+            "OPENAI_BASE_URL": f"{openai_url}/v1",
+            "GOOGLE_MAPS_API_KEY": "stub",
+            "GOOGLE_PLACES_BASE_URL": f"{places_url}/v1",
+            "SECRET_KEY": "bench-secret",
+            "ALGORITHM": "HS256",
+            "AWS_BUCKET_NAME": "bench",
+            "AWS_ACCESS_KEY_ID": "stub",
+            "AWS_SECRET_ACCESS_KEY": "stub",
+            "BCRYPT_ROUNDS": str(self.args.bcrypt_rounds),
+            **UNLIMITED,
+        }, "app")
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in reversed(self.processes):
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.tempdir and not self.args.keep_logs:
+            shutil.rmtree(self.tempdir, ignore_errors=True)
+        elif self.tempdir:
+            print(f"Logs kept in {self.tempdir}")
+
+
+def check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.method} {response.request.url.path} -> {response.status_code}: {response.text[:200]}")
+    return response
+
+
+async def seed(client, args):
+    """
+    Creates a user, restaurants spread around CENTER, dishes and reviews. Returns the ids the
+    scenarios draw from.
+    """
+    email, password = f"bench-{int(time.time())}@example.com", "bench-password"
+    check(await client.post("/sign_up", json={"name": "Bench", "email": email, "password": password}))
+    token = check(await client.post("/login", json={"email": email, "password": password})).json()["access_token"]
+    auth = {"Authorization": f"Bearer {token}"}
+
+    rng = random.Random(args.seed)
+    restaurants = []
+    for i in range(args.restaurants):
+        latitude = CENTER[0] + rng.uniform(-0.03, 0.03)
+        longitude = CENTER[1] + rng.uniform(-0.03, 0.03)
+        place = make_place(f"seed:{i}", f"Bench Kitchen {i}", latitude, longitude)
+        created = check(await client.post("/restaurants/", json={"google_data": place}, headers=auth)).json()
+        restaurants.append({"id": created["id"], "place_id": place["id"], "name": place["displayName"]["text"]})
+
+    dishes = []
+    for restaurant in restaurants:
+        items = [
+            {"name": f"Dish {j} of {restaurant['name']}", "restaurant_id": restaurant["id"],
+             "allergies": rng.sample(["peanut", "gluten", "dairy", "shellfish"], k=rng.randint(0, 2))}
+            for j in range(args.dishes_per_restaurant)
+        ]
+        results = check(await client.post("/dishes/bulk", json=items)).json()["results"]
+        dishes.extend({"id": result["id"], "restaurant_id": restaurant["id"]} for result in results if "id" in result)
+
+    reviews = [
+        {"dish_id": dish["id"], "restaurant_id": dish["restaurant_id"], "comment": rng.choice(COMMENTS),
+         "restrictions": rng.sample(["vegan", "halal", "kosher"], k=rng.randint(0, 1))}
+        for dish in dishes for _ in range(args.reviews_per_dish)
+    ]
+    for start in range(0, len(reviews), 500):
+        check(await client.post("/reviews/bulk", json=reviews[start:start + 500], headers=auth))
+
+    return {"auth": auth, "email": email, "password": password, "restaurants": restaurants, "dishes": dishes}
+
+
+def scenarios(ctx):
+    """
+    Endpoint families: name -> function returning the next request's (method, url, kwargs).
+    """
+    rng = random.Random(7)
+    restaurant = lambda: rng.choice(ctx["restaurants"])
+    dish = lambda: rng.choice(ctx["dishes"])
+    return {
+        "restaurants": lambda: rng.choice([
+            ("GET", f"/restaurants/{restaurant()['place_id']}", {}),
+            ("GET", f"/restaurants/id/{restaurant()['id']}", {}),
+            ("GET", "/restaurants/?limit=20", {}),
+        ]),
+        "restaurant_detail": lambda: ("GET", f"/restaurants/id/{restaurant()['id']}/detail", {}),
+        "search_db": lambda: ("GET", "/restaurants/search-db/", {"params": {"name": restaurant()["name"][:rng.randint(3, 12)]}}),
+        "places_search": lambda: ("GET", "/restaurants/search/", {"params": {"town": TOWN, "name": rng.choice(["chipotle", "pizza", "thai", "sushi", "deli"])}}),
+        "nearby": lambda: ("GET", "/restaurants/nearby/", {"params": {
+            "lat": CENTER[0] + rng.uniform(-0.02, 0.02), "lng": CENTER[1] + rng.uniform(-0.02, 0.02), "radius": 2000,
+        }}),
+        "dishes": lambda: rng.choice([
+            ("GET", f"/dishes/{dish()['id']}", {}),
+            ("GET", f"/dishes/restaurant/{restaurant()['id']}", {}),
+        ]),
+        "reviews_read": lambda: ("GET", f"/reviews/dish/{dish()['id']}", {}),
+        "reviews_write": lambda: (lambda d: ("POST", "/reviews/", {"headers": ctx["auth"], "json": {
+            "dish_id": d["id"], "restaurant_id": d["restaurant_id"], "comment": rng.choice(COMMENTS), "restrictions": ["vegan"],
+        }}))(dish()),
+        "check_safety": lambda: ("POST", "/check_safety/", {"json": {
+            # A few thousand distinct comments: a mix of cache hits and model calls
+            "comment": f"{rng.choice(COMMENTS)} (visit {rng.randint(1, 500)})", "tag_list": rng.sample(["peanut", "dairy", "vegan"], k=1),
+        }}),
+        "login": lambda: ("POST", "/login", {"json": {"email": ctx["email"], "password": ctx["password"]}}),
+    }
+
+
+async def drive(client, next_request, concurrency, duration, warmup):
+    """
+    Closed-loop load: `concurrency` workers each send a request as soon as the last finishes.
+    429s are counted apart from errors, since they mean a limit rather than the endpoint failed.
+    """
+    latencies, statuses, errors, rate_limited = [], {}, 0, 0
+    recording = False
+
+    async def worker(stop_at):
+        nonlocal errors, rate_limited
+        while time.monotonic() < stop_at:
+            method, url, kwargs = next_request()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = "exception"
+            elapsed = time.perf_counter() - started
+            if recording:
+                latencies.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 429:
+                    rate_limited += 1
+                elif status == "exception" or status >= 400:
+                    errors += 1
+
+    if warmup:
+        await asyncio.gather(*(worker(time.monotonic() + warmup) for _ in range(concurrency)))
+    recording = True
+    started = time.monotonic()
+    await asyncio.gather(*(worker(started + duration) for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "error_rate": round(errors / len(latencies), 4) if latencies else None,
+        "rate_limited_rate": round(rate_limited / len(latencies), 4) if latencies else None,
+        "statuses": statuses,
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 0.50)),
+            "p95": ms(percentile(latencies, 0.95)),
+            "p99": ms(percentile(latencies, 0.99)),
+            "max": ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if not before:
+            continue
+        change = lambda now, then: f"{(now - then) / then * 100:+.1f}%" if now is not None and then else "n/a"
+        print(f"  {name:<18} rps {change(result['throughput_rps'], before['throughput_rps']):>8}"
+              f"   p95 {change(result['latency_ms']['p95'], before['latency_ms']['p95']):>8}"
+              f"   p99 {change(result['latency_ms']['p99'], before['latency_ms']['p99']):>8}")
+
+
+async def run(args, base_url):
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        ctx = await seed(client, args)
+        available = scenarios(ctx)
+        chosen = args.scenarios.split(",") if args.scenarios else list(available)
+        unknown = set(chosen) - set(available)
+        if unknown:
+            raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}. Choose from {', '.join(available)}")
+
+        results = {}
+        for name in chosen:
+            results[name] = await drive(client, available[name], args.concurrency, args.duration, args.warmup)
+            r = results[name]
+            print(f"{name:<18} {r['throughput_rps']:>8} req/s  p50={r['latency_ms']['p50']}ms  p95={r['latency_ms']['p95']}ms  "
+                  f"p99={r['latency_ms']['p99']}ms  errors={r['error_rate']}  429s={r['rate_limited_rate']}")
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hermetic load test of the SafePlates backend")
+    parser.add_argument("--scenarios", help="comma-separated subset of scenarios to run (default: all)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=1.0, help="unrecorded seconds before each scenario")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--restaurants", type=int, default=50)
+    parser.add_argument("--dishes-per-restaurant", type=int, default=10)
+    parser.add_argument("--reviews-per-dish", type=int, default=5)
+    parser.add_argument("--openai-latency-ms", type=float, default=300.0)
+    parser.add_argument("--places-latency-ms", type=float, default=150.0)
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--mongo-uri", help="disposable MongoDB to use instead of starting mongod")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="a previous --output file to compare against")
+    parser.add_argument("--keep-logs", action="store_true", help="keep the temp dir with process logs")
+    args = parser.parse_args()
+
+    stack = Stack(args)
+    try:
+        base_url = stack.start()
+        results = asyncio.run(run(args, base_url))
+    finally:
+        stack.stop()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+# Measures how a burst of logins affects the latency of unrelated requests.
+#
+#   python bench/login_storm.py --logins 200 --rounds 12
+#
+# A probe standing in for any other route fires every --probe-interval ms and records how late
+# it is served while the logins run. "inline" verifies passwords on the event loop the way
+# login used to; "pool" goes through passwords.PasswordHasher.
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from passwords import HasherOverloaded, PasswordHasher, hash_password, verify_password
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else float("nan")
+
+
+async def probe(latencies, interval, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        scheduled = loop.time()
+        await asyncio.sleep(0)  # a trivial handler: just needs the loop to get to it
+        await asyncio.sleep(interval)
+        latencies.append((loop.time() - scheduled - interval) * 1000)
+
+
+async def storm(mode, args, stored_hash):
+    hasher = PasswordHasher(rounds=args.rounds, workers=args.workers, max_waiting=args.max_waiting)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    shed = 0
+
+    async def login():
+        nonlocal shed
+        async with semaphore:
+            if mode == "inline":
+                verify_password("correct horse", stored_hash)
+                await asyncio.sleep(0)
+            else:
+                try:
+                    await hasher.verify("correct horse", stored_hash)
+                except HasherOverloaded:
+                    shed += 1
+
+    latencies, stop = [], asyncio.Event()
+    probe_task = asyncio.create_task(probe(latencies, args.probe_interval / 1000, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(args.logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+    hasher.shutdown()
+
+    return {
+        "mode": mode,
+        "logins": args.logins,
+        "shed": shed,
+        "login_throughput_per_s": round(args.logins / elapsed, 1),
+        "probe_p50_ms": round(statistics.median(latencies), 2) if latencies else None,
+        "probe_p99_ms": round(percentile(latencies, 0.99), 2),
+        "probe_max_ms": round(max(latencies), 2) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Probe latency during a login storm")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-waiting", type=int, default=1000)
+    parser.add_argument("--probe-interval", type=float, default=5.0, help="milliseconds")
+    args = parser.parse_args()
+
+    stored_hash = hash_password("correct horse", args.rounds)
+    for mode in ("inline", "pool"):
+        result = asyncio.run(storm(mode, args, stored_hash))
+        print("  ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
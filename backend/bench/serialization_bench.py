@@ -0,0 +1,106 @@
+# Micro-benchmark of serialization cost per document for each entity type.
+#
+#   python bench/serialization_bench.py --docs 2000 [--output results.json]
+#
+# "encoder" is the old response path (serializer output run through FastAPI's jsonable_encoder,
+# then json.dumps as JSONResponse does); "fast" is the FastJSONResponse path (orjson).
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from fast_json import dumps
+from serializers import dish_serializer, restaurant_serializer, review_serializer
+
+
+def make_restaurant(i):
+    return {
+        "_id": ObjectId(),
+        "name": f"Restaurant {i}",
+        "google_data": {
+            "place_id": f"ChIJ{i:020d}",
+            "rating": 4.2,
+            "priceLevel": "PRICE_LEVEL_INEXPENSIVE",
+            "address": f"{i} Forbes Ave, Pittsburgh, PA 15213, USA",
+            "nationalPhoneNumber": "(412) 555-0100",
+        },
+        "menu": [ObjectId() for _ in range(20)],
+    }
+
+
+def make_dish(i):
+    return {
+        "_id": ObjectId(),
+        "name": f"Dish {i}",
+        "image_url": f"https://example.com/dish-uploads/{i}.jpg",
+        "restaurant_id": ObjectId(),
+        "allergies": ["peanut", "dairy"],
+        "restrictions": ["vegetarian", "halal"],
+        "reviews": [ObjectId() for _ in range(10)],
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+        "stats": {"review_count": 10, "allergies": {"peanut": 4}, "restrictions": {"vegetarian": 7}, "last_reviewed_at": datetime.utcnow()},
+    }
+
+
+def make_review(i):
+    return {
+        "_id": ObjectId(),
+        "user_id": ObjectId(),
+        "dish_id": ObjectId(),
+        "restaurant_id": ObjectId(),
+        "allergies": ["gluten"],
+        "restrictions": ["vegan"],
+        "comment": f"Review number {i}: rice, beans and salsa, really good.",
+        "created_at": datetime.utcnow(),
+    }
+
+
+def per_doc_us(fn, docs, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(docs)
+        best = min(best, time.perf_counter() - started)
+    return round(best / len(docs) * 1e6, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serialization cost per document")
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    entities = {
+        "restaurant": (make_restaurant, restaurant_serializer),
+        "dish": (make_dish, dish_serializer),
+        "review": (make_review, review_serializer),
+    }
+    results = {}
+    for entity, (make, serializer) in entities.items():
+        docs = [make(i) for i in range(args.docs)]
+        results[entity] = {
+            "serializer_us": per_doc_us(lambda ds: [serializer(d) for d in ds], docs, args.repeat),
+            "encoder_us": per_doc_us(
+                lambda ds: json.dumps(jsonable_encoder([serializer(d) for d in ds]), ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                docs, args.repeat,
+            ),
+            "fast_us": per_doc_us(lambda ds: dumps([serializer(d) for d in ds]), docs, args.repeat),
+        }
+        print(entity.ljust(12), "  ".join(f"{key}={value}" for key, value in results[entity].items()))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"docs": args.docs, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from metrics import OPENAI_LATENCY, record_token_usage
+from rate_limits import RateLimited
+from resilience import CircuitOpen, Policy
+from resources import resources
+from safety import (
+    MODEL, OPENAI_DEADLINE, OPENAI_HEDGE_PERCENTILE, OPENAI_RETRIES, build_batch_messages, build_messages, is_connection_error,
+    openai_breaker, parse_batch_response, parse_safe_categories,
+)
+
+
+class ClassificationError(Exception):
+    """Raised when the model could not produce safe categories for an item."""
+
+
+class SafetyClassifier:
+    """
+    Async, micro-batched classification of dishes into the safe categories of safety.py.
+
+    Pending (comment, tag_list) items are collected for up to `batch_window` seconds, or until
+    `batch_size` items are waiting, and are then sent to the model in a single chat completion.
+    At most `max_concurrency` model calls are in flight at once.
+
+    When `rules` (allergen_rules.AllergenRules) are given, comments they can settle locally never
+    reach the model. When a `cache` (verdict_cache.VerdictCache) is given, cached verdicts are
+    returned without touching the model and fresh answers are written back to it.
+
+    When a `limiter` (rate_limits.RateLimiter) is given, every model call takes a token from its
+    "openai" limit first; calls it sheds fail with RateLimited rather than ClassificationError.
+
+    Model calls run under `policy` (resilience.Policy), by default OPENAI_DEADLINE per call with
+    OPENAI_RETRIES retries and the shared OpenAI breaker. While the breaker is open calls fail
+    fast with CircuitOpen.
+
+    Without a `client`, the shared AsyncOpenAI client from resources.py is used, created on the
+    first model call. Point OPENAI_BASE_URL at a local server (see stubs/openai_stub.py) to run
+    it without OpenAI.
+    """
+
+    def __init__(self, client=None, model=MODEL, rules=None, cache=None, limiter=None, policy=None, max_concurrency=4, batch_size=8, batch_window=0.025):
+        self._owns_client = client is not None
+        self.client = client or resources.lazy(lambda: resources.get("openai"))
+        self.model = model
+        self.rules = rules
+        self.cache = cache
+        self.limiter = limiter
+        self.policy = policy or Policy(
+            "openai",
+            timeout=OPENAI_DEADLINE,
+            retries=OPENAI_RETRIES,
+            breaker=openai_breaker,
+            hedge_percentile=OPENAI_HEDGE_PERCENTILE,
+            transient=is_connection_error,
+        )
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending = []
+        self._flush_handle = None
+        self._tasks = set()
+        self._in_flight = 0
+        self._started = time.monotonic()
+        self._latencies = deque(maxlen=1000)
+        self._counters = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "batches": 0,
+            "batched_items": 0,
+            "model_calls": 0,
+        }
+
+    async def classify(self, comment, tag_list):
+        """
+        Returns the list of safe categories for one dish, waiting for its batch to be answered.
+        Raises ClassificationError if the model call fails.
+        """
+        if self.rules is not None:
+            verdict = self.rules.classify(comment, tag_list)
+            if verdict.settled:
+                return verdict.safe_categories
+
+        if self.cache is not None:
+            cached = await self.cache.get(comment, tag_list, self.model)
+            if cached is not None:
+                return cached
+
+        safe_categories = await self._submit(comment, tag_list)
+        if self.cache is not None:
+            await self.cache.set(comment, tag_list, safe_categories, self.model)
+        return safe_categories
+
+    async def classify_each(self, items, concurrency=16, timeout=None):
+        """
+        Classifies many (comment, tag_list) pairs, at most `concurrency` at a time, and yields
+        {"index", "safe_categories" or "error", "elapsed_ms"} for each one as soon as it finishes.
+        Concurrent items share micro-batches, so a large request costs few model calls.
+        """
+        limit = asyncio.Semaphore(concurrency)
+
+        async def run(index, comment, tag_list):
+            async with limit:
+                started = time.perf_counter()
+                result = {"index": index}
+                try:
+                    result["safe_categories"] = await asyncio.wait_for(self.classify(comment, tag_list), timeout)
+                except asyncio.TimeoutError:
+                    result["error"] = "Timed out"
+                except ClassificationError as e:
+                    result["error"] = str(e)
+                except (RateLimited, CircuitOpen) as e:
+                    result["error"] = "Rate limited" if isinstance(e, RateLimited) else "Safety checks are temporarily unavailable"
+                    result["retry_after"] = round(e.retry_after, 1)
+                except Exception as e:
+                    logging.error(f"Error classifying dish {index} of batch: {e}")
+                    result["error"] = "Error processing dietary safety check"
+                result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                return result
+
+        tasks = [asyncio.ensure_future(run(i, comment, tag_list)) for i, (comment, tag_list) in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The client went away or the caller stopped early
+            for task in tasks:
+                task.cancel()
+
+    async def _submit(self, comment, tag_list):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((comment, list(tag_list), future, time.monotonic()))
+        self._counters["submitted"] += 1
+
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        while self._pending:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        items = [(comment, tag_list) for comment, tag_list, _, _ in batch]
+        self._counters["batches"] += 1
+        self._counters["batched_items"] += len(items)
+
+        async with self._semaphore:
+            self._in_flight += 1
+            try:
+                if len(items) == 1:
+                    results = [await self._classify_one(*items[0])]
+                else:
+                    results = await self._classify_many(items)
+            except Exception as e:
+                if not isinstance(e, (RateLimited, CircuitOpen)):
+                    logging.error(f"Error classifying batch of {len(items)} dishes: {e}")
+                    e = ClassificationError(str(e))
+                self._counters["failed"] += len(batch)
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            finally:
+                self._in_flight -= 1
+
+        now = time.monotonic()
+        for (_, _, future, enqueued), result in zip(batch, results):
+            self._counters["completed"] += 1
+            self._latencies.append(now - enqueued)
+            if not future.done():
+                future.set_result(result)
+
+    async def _classify_one(self, comment, tag_list):
+        answer = await self._complete(build_messages(comment, tag_list), max_tokens=150, call="single")
+        return parse_safe_categories(answer)
+
+    async def _classify_many(self, items):
+        answer = await self._complete(build_batch_messages(items), max_tokens=150 * len(items), call="batch")
+        results = parse_batch_response(answer, len(items))
+
+        # Retry individually anything the model skipped or mangled in the batched answer
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            retried = await asyncio.gather(*(self._classify_one(*items[i]) for i in missing))
+            for i, result in zip(missing, retried):
+                results[i] = result
+        return results
+
+    async def _complete(self, messages, max_tokens, call):
+        # Waiting for a rate limit token counts against the call's deadline
+        deadline = self.policy.deadline()
+        if self.limiter is not None:
+            await self.limiter.acquire("openai", deadline=deadline)
+        self._counters["model_calls"] += 1
+        started, outcome = time.perf_counter(), "error"
+        try:
+            response = await self.policy.run(lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=0,
+                n=1,
+            ), deadline)
+            outcome = "ok"
+        finally:
+            OPENAI_LATENCY.observe(time.perf_counter() - started, model=self.model, call=call, outcome=outcome)
+        record_token_usage(self.model, getattr(response, "usage", None))
+        return response.choices[0].message.content or ""
+
+    def stats(self):
+        """
+        Returns throughput and latency statistics for the classifier.
+        """
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+
+        uptime = time.monotonic() - self._started
+        batches = self._counters["batches"]
+        return {
+            **{key: value for key, value in self._counters.items() if key != "batched_items"},
+            "avg_batch_size": round(self._counters["batched_items"] / batches, 2) if batches else 0,
+            "pending": len(self._pending),
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+            "throughput_per_s": round(self._counters["completed"] / uptime, 3) if uptime else 0,
+            "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99)},
+            "rules": self.rules.stats() if self.rules is not None else None,
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "upstream": self.policy.stats(),
+        }
+
+    async def close(self):
+        """
+        Flushes anything still pending and waits for in-flight batches. A client passed in is
+        closed too; the shared one is closed with the other resources.
+        """
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._owns_client:
+            await self.client.close()
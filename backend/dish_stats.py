@@ -0,0 +1,132 @@
+# Per-dish review aggregates, kept on the dish document under "stats":
+#
+#   {"review_count": 12, "allergies": {"peanut": 3}, "restrictions": {"vegan": 9},
+#    "safe_categories": {"vegan": 7}, "last_reviewed_at": ...}
+#
+# create_review/update_review and the review classification job keep them current with $inc. To recompute them from the reviews
+# collection (e.g. for data written before the counters existed):
+#
+#   python dish_stats.py rebuild
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from collections import Counter, defaultdict
+
+from pymongo import UpdateOne
+
+# safe_categories is written onto each review by the background classification job
+TAG_FIELDS = ("allergies", "restrictions", "safe_categories")
+
+
+def tag_key(tag):
+    """
+    Normalizes a tag into a safe Mongo field name: "Nut Allergy" -> "nut allergy", "a.b" -> "a_b".
+    """
+    return str(tag).strip().lower().replace(".", "_").replace("$", "_")
+
+
+def _tag_keys(tags):
+    # A review counts once per normalized tag, however many spellings of it it lists
+    return {tag_key(tag) for tag in tags or [] if str(tag).strip()}
+
+
+def _tag_counts(review):
+    counts = {}
+    for field in TAG_FIELDS:
+        for key in _tag_keys(review.get(field)):
+            counts[f"stats.{field}.{key}"] = 1
+    return counts
+
+
+def review_added_update(review):
+    """
+    Update document applying one new review to its dish's counters.
+    """
+    # version: the dish's ETag (see http_cache.py) covers its safety summary
+    update = {"$inc": {"stats.review_count": 1, "version": 1, **_tag_counts(review)}}
+    if review.get("created_at"):
+        update["$max"] = {"stats.last_reviewed_at": review["created_at"]}
+    return update
+
+
+def review_changed_update(old_review, new_review):
+    """
+    Update document moving a dish's tag counters from a review's old tags to its new ones,
+    or None if the tags did not change.
+    """
+    inc = Counter(_tag_counts(new_review))
+    inc.subtract(_tag_counts(old_review))
+    inc = {field: delta for field, delta in inc.items() if delta}
+    return {"$inc": {**inc, "version": 1}} if inc else None
+
+
+def safety_summary(dish):
+    stats = dish.get("stats") or {}
+    return {
+        "review_count": stats.get("review_count", 0),
+        "allergies": stats.get("allergies", {}),
+        "restrictions": stats.get("restrictions", {}),
+        "safe_categories": stats.get("safe_categories", {}),
+        "last_reviewed_at": stats.get("last_reviewed_at"),
+    }
+
+
+async def rebuild_dish_stats(db, batch_size=1000):
+    """
+    Recomputes every dish's stats from the reviews collection, grouped server-side, and writes
+    them back in unordered bulk batches. Increments made while it runs can be lost, so
+    run it while review writes are paused.
+    """
+    reviews, dishes = db["reviews"], db["dishes"]
+    stats = defaultdict(lambda: {"review_count": 0, **{field: {} for field in TAG_FIELDS}, "last_reviewed_at": None})
+
+    async for row in reviews.aggregate([
+        {"$group": {"_id": "$dish_id", "count": {"$sum": 1}, "last": {"$max": "$created_at"}}},
+    ], allowDiskUse=True):
+        stats[row["_id"]]["review_count"] = row["count"]
+        stats[row["_id"]]["last_reviewed_at"] = row["last"]
+
+    # Reviews are grouped by their raw tag lists, and each list is normalized here with the same
+    # _tag_keys as the incremental updates, so "Peanut" and "peanut " on one review count once
+    for field in TAG_FIELDS:
+        async for row in reviews.aggregate([
+            {"$group": {"_id": {"dish_id": "$dish_id", "tags": {"$ifNull": [f"${field}", []]}}, "count": {"$sum": 1}}},
+        ], allowDiskUse=True):
+            counts = stats[row["_id"]["dish_id"]][field]
+            for key in _tag_keys(row["_id"]["tags"]):
+                counts[key] = counts.get(key, 0) + row["count"]
+
+    operations = [
+        UpdateOne({"_id": dish_id}, {"$set": {"stats": dish_stats}, "$inc": {"version": 1}}) for dish_id, dish_stats in stats.items()
+    ]
+    # Dishes whose reviews have all gone
+    async for dish in dishes.find({"stats.review_count": {"$gt": 0}}, {"_id": 1}):
+        if dish["_id"] not in stats:
+            operations.append(UpdateOne({"_id": dish["_id"]}, {"$unset": {"stats": ""}, "$inc": {"version": 1}}))
+
+    for start in range(0, len(operations), batch_size):
+        await dishes.bulk_write(operations[start:start + batch_size], ordered=False)
+    logging.info(f"Rebuilt stats for {len(operations)} dishes")
+    return len(operations)
+
+
+def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Maintain per-dish review aggregates")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = AsyncIOMotorClient(os.getenv("MONGO_URI"))["restaurant_allergy"]
+    updated = asyncio.run(rebuild_dish_stats(db, batch_size=args.batch_size))
+    print(f"Rebuilt stats for {updated} dishes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
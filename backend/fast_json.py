@@ -0,0 +1,37 @@
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    """
+    orjson encoding that also handles ObjectId. datetimes are encoded natively as ISO 8601.
+    """
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson. Returning one directly from a route also skips
+    FastAPI's jsonable_encoder pass over already-serialized content.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def reads(*fields):
+    """
+    Declares the document fields a serializer reads, exposing them as `serializer.projection`
+    so queries only fetch what the serializer will use.
+    """
+    def decorate(serializer):
+        serializer.projection = {field: 1 for field in fields}
+        return serializer
+    return decorate
@@ -0,0 +1,60 @@
+# Queries for "restaurants near me", served from the 2dsphere index on restaurants.location.
+# Locations are stored as GeoJSON points, which list longitude before latitude.
+import math
+
+EARTH_RADIUS_M = 6378100.0
+MAX_RADIUS_M = 50000.0
+
+
+def point(latitude, longitude):
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("Coordinates out of range")
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+def parse_bbox(bbox):
+    """
+    "min_lng,min_lat,max_lng,max_lat" -> ([min_lng, min_lat], [max_lng, max_lat]). Raises ValueError.
+    """
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(value) for value in bbox.split(","))
+    except (TypeError, ValueError):
+        raise ValueError("bbox must be min_lng,min_lat,max_lng,max_lat")
+    point(min_lat, min_lng)
+    point(max_lat, max_lng)
+    if min_lng >= max_lng or min_lat >= max_lat:
+        raise ValueError("bbox must be min_lng,min_lat,max_lng,max_lat")
+    return [min_lng, min_lat], [max_lng, max_lat]
+
+
+def within_radius_pipeline(latitude, longitude, radius, limit, projection):
+    """
+    Restaurants within `radius` metres, nearest first, each with its `distance_m`.
+    """
+    return [
+        {"$geoNear": {
+            "near": point(latitude, longitude),
+            "distanceField": "distance_m",
+            "maxDistance": min(radius, MAX_RADIUS_M),
+            "spherical": True,
+            "key": "location",
+        }},
+        {"$limit": limit},
+        {"$project": {**projection, "distance_m": 1}},
+    ]
+
+
+def within_bbox_query(bbox):
+    (min_lng, min_lat), (max_lng, max_lat) = parse_bbox(bbox)
+    ring = [[min_lng, min_lat], [max_lng, min_lat], [max_lng, max_lat], [min_lng, max_lat], [min_lng, min_lat]]
+    return {"location": {"$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [ring]}}}}
+
+
+def distance_m(location, latitude, longitude):
+    """
+    Great-circle distance in metres from a GeoJSON point to a coordinate.
+    """
+    lng, lat = location["coordinates"]
+    d_lat, d_lng = math.radians(lat - latitude), math.radians(lng - longitude)
+    a = math.sin(d_lat / 2) ** 2 + math.cos(math.radians(latitude)) * math.cos(math.radians(lat)) * math.sin(d_lng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
@@ -1,54 +1,269 @@
 # google_maps_service.py
-import json
+import asyncio
 import os
 import logging
+import time
 import httpx
-from dotenv import load_dotenv
 
-load_dotenv()
+from metrics import PLACES_LATENCY
+from rate_limits import RateLimited, limiter
+from resilience import CircuitBreaker, Policy
+from resources import require, resources
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+PLACES_BASE_URL = os.getenv("GOOGLE_PLACES_BASE_URL", "https://places.googleapis.com/v1")
+
+# Search results change slowly; empty results are cached for less time in case a place is added
+SEARCH_CACHE_TTL = float(os.getenv("PLACES_SEARCH_CACHE_TTL", "600"))
+EMPTY_SEARCH_CACHE_TTL = float(os.getenv("PLACES_EMPTY_SEARCH_CACHE_TTL", "60"))
+
+_search_cache = TTLCache(maxsize=int(os.getenv("PLACES_SEARCH_CACHE_SIZE", "2048")), ttl=SEARCH_CACHE_TTL)
+# Last good answer per search, served when Google is failing or its breaker is open
+_stale_results = TTLCache(maxsize=int(os.getenv("PLACES_SEARCH_CACHE_SIZE", "2048")), ttl=float(os.getenv("PLACES_STALE_TTL", "86400")))
+_in_flight = {}
+_MISSING = object()
+# Callbacks given every non-empty batch of results fetched from Google, and their running tasks
+_fetched_listeners = []
+_listener_tasks = set()
+
+
+# Every Places call gets PLACES_DEADLINE seconds in total, retries included. Searches and
+# details are reads, so they may be hedged once past PLACES_HEDGE_PERCENTILE (off by default).
+places_policy = Policy(
+    "places",
+    timeout=float(os.getenv("PLACES_DEADLINE", "8")),
+    retries=int(os.getenv("PLACES_RETRIES", "2")),
+    breaker=CircuitBreaker(
+        "places",
+        failure_threshold=int(os.getenv("PLACES_BREAKER_FAILURES", "5")),
+        reset_timeout=float(os.getenv("PLACES_BREAKER_RESET", "30")),
+    ),
+    hedge_percentile=float(os.getenv("PLACES_HEDGE_PERCENTILE")) if os.getenv("PLACES_HEDGE_PERCENTILE") else None,
+    transient=lambda error: isinstance(error, httpx.TransportError),
+)
+
+
+class PlacesUnavailable(Exception):
+    """Raised when a search failed and there is no earlier answer to fall back on."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _create_client():
+    """
+    The long-lived, pooled HTTP client used for every Places call.
+    """
+    return httpx.AsyncClient(
+        base_url=PLACES_BASE_URL,
+        http2=True,
+        timeout=httpx.Timeout(
+            connect=float(os.getenv("PLACES_CONNECT_TIMEOUT", "3")),
+            read=float(os.getenv("PLACES_READ_TIMEOUT", "5")),
+            write=5.0,
+            pool=2.0,
+        ),
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("PLACES_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("PLACES_MAX_KEEPALIVE", "10")),
+            keepalive_expiry=30.0,
+        ),
+    )
+
+
+resources.register("places", _create_client, close=lambda client: client.aclose())
+
+
+def on_fetched(listener):
+    """
+    Registers `async listener(places)`, run in the background with each batch of results that
+    came from Google. Cache hits and stale fallbacks are not passed on.
+    """
+    _fetched_listeners.append(listener)
+
+
+def _notify_fetched(places):
+    for listener in _fetched_listeners:
+        task = asyncio.ensure_future(listener(places))
+        _listener_tasks.add(task)
+        task.add_done_callback(_listener_tasks.discard)
+
+
+def search_cache_stats():
+    return {**_search_cache.stats(), "in_flight": len(_in_flight), "stale_entries": len(_stale_results), "upstream": places_policy.stats()}
+
+
+def _search_key(town: str, name: str):
+    return (" ".join(town.casefold().split()), " ".join(name.casefold().split()))
+
 
-GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
-if not GOOGLE_MAPS_API_KEY:
-    raise ValueError("GOOGLE_MAPS_API_KEY is not set in the environment variables")
-    
 async def search_restaurants_api(town: str, name: str) -> dict:
-    url = 'https://places.googleapis.com/v1/places:searchText'
+    """
+    Text search for restaurants called `name` in `town`, served from a TTL cache when possible.
+    Concurrent identical searches share a single upstream request.
+    """
+    return await _cached(("text", *_search_key(town, name)), lambda: _search_restaurants_upstream(town, name))
+
+
+async def search_nearby_api(latitude: float, longitude: float, radius: float, limit: int = 20):
+    """
+    Restaurants within `radius` metres of a point, cached like text searches. Coordinates are
+    rounded to about 100 m so nearby callers share cache entries.
+    """
+    key = ("nearby", round(latitude, 3), round(longitude, 3), round(radius, -1), limit)
+    return await _cached(key, lambda: _search_nearby_upstream(latitude, longitude, radius, limit))
+
+
+async def _cached(key, upstream):
+    cached = _search_cache.get(key, _MISSING)
+    if cached is not _MISSING:
+        return cached
+
+    request = _in_flight.get(key)
+    if request is None:
+        request = asyncio.ensure_future(upstream())
+        _in_flight[key] = request
+        request.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    try:
+        places = await asyncio.shield(request)
+    except RateLimited:
+        raise
+    except Exception as e:
+        # Failures are not cached so the next search tries again
+        stale = _stale_results.get(key, _MISSING)
+        if stale is not _MISSING:
+            logger.warning(f"Serving stale results for {key}: {e}")
+            return stale
+        logger.error(f"Error searching restaurants: {e!r}")
+        raise PlacesUnavailable("Restaurant search is temporarily unavailable", getattr(e, "retry_after", None)) from e
+
+    if key not in _search_cache:
+        _search_cache.set(key, places, ttl=SEARCH_CACHE_TTL if places else EMPTY_SEARCH_CACHE_TTL)
+        if places:
+            _stale_results.set(key, places)
+            _notify_fetched(places)
+    return places
+
 
+# Fields to display, from Google Maps Places API
+PLACE_FIELDS = ["id", "displayName", "formattedAddress", "nationalPhoneNumber", "servesVegetarianFood", "priceLevel", "rating", "location"]
+FIELD_MASK = ",".join(f"places.{field}" for field in PLACE_FIELDS)
+
+
+async def _timed(endpoint, request):
+    started, outcome = time.perf_counter(), "error"
+    try:
+        response = await request
+        outcome = str(response.status_code)
+        return response
+    finally:
+        PLACES_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, outcome=outcome)
+
+
+async def _post_places(path, data):
+    # The headers for the POST request
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Goog-Api-Key': require("GOOGLE_MAPS_API_KEY"),
+        'X-Goog-FieldMask': FIELD_MASK
+    }
+
+    # Make the asynchronous POST request on the shared connection pool, within our Places quota;
+    # time spent waiting for a token comes out of the call's deadline
+    deadline = places_policy.deadline()
+    await limiter.acquire("places", deadline=deadline)
+    client = resources.get("places")
+
+    async def attempt():
+        response = await _timed(path.split(':')[-1], client.post(path, headers=headers, json=data))
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        return response
+
+    response = await places_policy.run(attempt, deadline)
+
+    # Parse the JSON response
+    data = response.json()
+    if 'places' in data:
+        places = data['places']
+        logger.debug(f"{path} returned {len(places)} places", extra={"payload": places})
+        return places
+    else:
+        logger.debug(f"{path} returned no results")
+        return None
+
+
+async def fetch_place_api(place_id: str):
+    """
+    Current Places details for one place id, or None if Google no longer knows it.
+    Not cached: it is only used to refresh stored records in the background.
+    """
+    deadline = places_policy.deadline()
+    await limiter.acquire("places", deadline=deadline)
+    client = resources.get("places")
+
+    async def attempt():
+        response = await _timed("details", client.get(
+            f'/places/{place_id}',
+            headers={'X-Goog-Api-Key': require("GOOGLE_MAPS_API_KEY"), 'X-Goog-FieldMask': ",".join(PLACE_FIELDS)},
+        ))
+        if response.status_code != 404:
+            response.raise_for_status()
+        return response
+
+    response = await places_policy.run(attempt, deadline)
+    if response.status_code == 404:
+        return None
+    return response.json()
+
+
+async def _search_restaurants_upstream(town: str, name: str):
     # The data to be sent in the POST request
     data = {
         "textQuery": f"{name} in {town}",
         'includedType' : 'restaurant',
         'pageSize': 5
     }
+    return await _post_places('/places:searchText', data)
 
-    # Fields to display, from Google Maps Places API
-    fields = ["id", "displayName", "formattedAddress", "nationalPhoneNumber", "servesVegetarianFood", "priceLevel", "rating"]
-    fields = [f"places.{field}" for field in fields]
-    fields_str = ",".join(fields)
 
-    # The headers for the POST request
-    headers = {
-        'Content-Type': 'application/json',
-        'X-Goog-Api-Key': GOOGLE_MAPS_API_KEY,
-        'X-Goog-FieldMask': fields_str
+async def _search_nearby_upstream(latitude: float, longitude: float, radius: float, limit: int):
+    data = {
+        "includedTypes": ["restaurant"],
+        "maxResultCount": max(1, min(limit, 20)),
+        "rankPreference": "DISTANCE",
+        "locationRestriction": {
+            "circle": {"center": {"latitude": latitude, "longitude": longitude}, "radius": min(radius, 50000.0)}
+        },
     }
+    return await _post_places('/places:searchNearby', data)
 
-    try:
-        # Make the asynchronous POST request
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=data)
-            response.raise_for_status()  # Raise an exception for HTTP errors
-
-        # Parse the JSON response
-        data = response.json()
-        if 'places' in data:
-            places = data['places']
-            print(places)
-            print(json.dumps(places, indent=2))
-            return places
-        else:
-            print('No results:', data['status'])
-            return None
-    except httpx.RequestError as e:
-        print('Error searching restaurants:', e)
+
+def place_record(place: dict):
+    """
+    The name, google_data and location we store for a Places result.
+    """
+    return {
+        "name": (place.get("displayName") or {}).get("text"),
+        "google_data": {
+            "place_id": place.get("id"),
+            "address": place.get("formattedAddress"),
+            "rating": place.get("rating"),
+            "priceLevel": place.get("priceLevel"),
+            "nationalPhoneNumber": place.get("nationalPhoneNumber")
+        },
+        "location": place_location(place),
+    }
+
+
+def place_location(place: dict):
+    """
+    GeoJSON point for a Places result's {"latitude", "longitude"}, or None if it has none.
+    """
+    location = place.get("location") or {}
+    if location.get("latitude") is None or location.get("longitude") is None:
         return None
+    return {"type": "Point", "coordinates": [location["longitude"], location["latitude"]]}
@@ -0,0 +1,126 @@
+# Conditional GETs and an in-process response cache for the restaurant, dish and review reads.
+#
+# Restaurants, dishes and reviews carry a `version` counter that every change to them $inc's
+# (re-fetching an unchanged place from Google leaves it alone), so a document's ETag is just its
+# id and version ("dish.1.<id>.<version>"); a page of documents hashes the ids and versions on it. Requests whose If-None-Match still matches get a 304.
+#
+# Rendered responses are cached under a tag such as ("dish", id) until a write in this process
+# calls invalidate() with that tag. Other workers keep serving their copy, with its old ETag,
+# until it expires after RESPONSE_CACHE_TTL seconds. Browsers are told to revalidate after
+# RESPONSE_MAX_AGE seconds, so with the default of 0 they always ask but mostly get a 304.
+#
+#   RESPONSE_CACHE_SIZE   tags cached per process (10000)
+#   RESPONSE_CACHE_TTL    seconds a cached response is served without reading Mongo (30)
+#   RESPONSE_MAX_AGE      Cache-Control max-age sent to clients (0)
+import hashlib
+
+from fastapi.responses import Response
+
+from fast_json import dumps
+from ttl_cache import TTLCache
+
+# Part of every ETag; bump it when a serializer's output changes so clients don't revalidate
+# a response in the old shape against an unchanged document
+SCHEMA_VERSION = "1"
+
+# Add to a serializer's projection so the ETag can be derived
+VERSION_PROJECTION = {"version": 1}
+
+
+def document_etag(kind, document):
+    return f'"{kind}.{SCHEMA_VERSION}.{document["_id"]}.{document.get("version", 0)}"'
+
+
+def page_etag(kind, documents, next_cursor=None):
+    digest = hashlib.blake2b(digest_size=12)
+    for document in documents:
+        digest.update(f"{document['_id']}.{document.get('version', 0)};".encode())
+    digest.update(str(next_cursor).encode())
+    return f'"{kind}.{SCHEMA_VERSION}.{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Weak comparison, as If-None-Match calls for: W/"x" matches "x".
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "headers")
+
+    def __init__(self, body, etag, headers=None):
+        self.body = body
+        self.etag = etag
+        self.headers = headers or {}
+
+
+class ResponseCache:
+    """
+    Rendered JSON responses keyed by (tag, variant): the tag names the data, e.g. ("dish", id),
+    and the variant the query parameters, e.g. (limit, after) for a page of a list.
+    invalidate(tag) drops every variant at once.
+
+    An alias maps another key for the same data onto its tag, e.g. a restaurant's place id onto
+    ("restaurant", id), so it can be looked up and invalidated by either.
+
+    Take `writes` before reading Mongo and pass it to store(): a response read before a write
+    in this process finished is returned but not cached.
+    """
+
+    def __init__(self, maxsize=10000, ttl=30.0, max_age=0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._aliases = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.cache_control = f"public, max-age={max_age}, must-revalidate"
+        self.writes = 0
+        self.not_modified = 0
+
+    def get(self, tag, variant=None):
+        variants = self._cache.get(tag)
+        return variants.get(variant) if variants is not None else None
+
+    def resolve(self, alias):
+        return self._aliases.get(alias)
+
+    def store(self, tag, content, etag, since, variant=None, headers=None, aliases=()):
+        """
+        Renders `content` and caches it unless something was invalidated since `since`.
+        """
+        entry = CachedResponse(dumps(content), etag, headers)
+        if since == self.writes:
+            variants = self._cache.get(tag)
+            if variants is None:
+                variants = {}
+                self._cache.set(tag, variants)
+            variants[variant] = entry
+            for alias in aliases:
+                self._aliases.set(alias, tag)
+        return entry
+
+    def invalidate(self, *tags):
+        """
+        Drops everything cached under each tag or alias.
+        """
+        self.writes += 1
+        for tag in tags:
+            self._cache.pop(self._aliases.pop(tag, tag))
+
+    def respond(self, request, entry):
+        headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": self.cache_control}
+        if etag_matches(request.headers.get("if-none-match"), entry.etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(entry.body, media_type="application/json", headers=headers)
+
+    def stats(self):
+        return {**self._cache.stats(), "not_modified": self.not_modified}
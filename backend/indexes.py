@@ -0,0 +1,147 @@
+# Index registry for the restaurant_allergy database.
+#
+# Every index a route relies on is declared here and created at startup by ensure_indexes().
+# To check that each route's query is served by an index:
+#
+#   python indexes.py explain
+#
+# which exits non-zero if any query in ROUTE_QUERIES is planned as a COLLSCAN.
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING, GEOSPHERE, IndexModel, UpdateOne
+
+from geo import within_bbox_query
+from search import fold
+
+INDEXES = {
+    "restaurants": [
+        IndexModel([("google_data.place_id", ASCENDING)], name="google_place_id"),
+        IndexModel([("name_key", ASCENDING)], name="name_key"),
+        IndexModel([("search_updated_at", ASCENDING)], name="search_updated_at"),
+        # GET /restaurants/nearby/
+        IndexModel([("location", GEOSPHERE)], name="location_2dsphere"),
+    ],
+    "dishes": [
+        IndexModel([("restaurant_id", ASCENDING), ("name_key", ASCENDING)], name="restaurant_dish_name"),
+        # Keyset pagination of a restaurant's dishes
+        IndexModel([("restaurant_id", ASCENDING), ("_id", ASCENDING)], name="restaurant_id_id"),
+    ],
+    "reviews": [
+        # Keyset pagination of a dish's reviews
+        IndexModel([("dish_id", ASCENDING), ("_id", ASCENDING)], name="dish_id_id"),
+    ],
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+}
+
+# Keyset pages and exports: everything after a continuation cursor, in _id order
+PAGE = {"_id": {"$gt": ObjectId()}}
+BY_ID = [("_id", ASCENDING)]
+
+# (route, collection, filter, sort) for the query each route sends, with placeholder values
+ROUTE_QUERIES = [
+    ("GET /restaurants/{place_id}", "restaurants", {"google_data.place_id": "ChIJ-placeholder"}, None),
+    ("GET /restaurants/id/{restaurant_id}", "restaurants", {"_id": ObjectId()}, None),
+    ("GET /restaurants/search-db/", "restaurants", {"name_key": {"$regex": "^chip"}}, None),
+    ("GET /restaurants/, /export/restaurants", "restaurants", PAGE, BY_ID),
+    ("GET /restaurants/nearby/?lat&lng", "restaurants",
+     {"location": {"$nearSphere": {"$geometry": {"type": "Point", "coordinates": [-79.99, 40.44]}, "$maxDistance": 1500}}}, None),
+    ("GET /restaurants/nearby/?bbox", "restaurants", within_bbox_query("-80.1,40.3,-79.8,40.6"), None),
+    ("search index refresh", "restaurants", {"search_updated_at": {"$gte": datetime.now(timezone.utc)}}, None),
+    ("GET /dishes/{dish_id}", "dishes", {"_id": ObjectId()}, None),
+    ("GET /dishes/search/", "dishes", {"restaurant_id": ObjectId(), "name_key": "burrito bowl"}, None),
+    ("GET /dishes/restaurant/{restaurant_id}", "dishes", {"$and": [{"restaurant_id": ObjectId()}, PAGE]}, BY_ID),
+    ("GET /reviews/{review_id}", "reviews", {"_id": ObjectId()}, None),
+    ("GET /reviews/, /export/reviews", "reviews", PAGE, BY_ID),
+    ("GET /reviews/dish/{dish_id}", "reviews", {"$and": [{"dish_id": ObjectId()}, PAGE]}, BY_ID),
+    ("POST /login, get_current_user", "users", {"email": "someone@example.com"}, None),
+]
+
+
+async def ensure_indexes(db):
+    """
+    Creates every index in INDEXES (a no-op for those that already exist), moves legacy place ids
+    to google_data.place_id and backfills the normalized dish name key the dish search relies on.
+    """
+    for collection, models in INDEXES.items():
+        await db[collection].create_indexes(models)
+
+    # Restaurants created before google_data.place_id became the canonical key stored it as google_data.id
+    migrated = await db["restaurants"].update_many(
+        {"google_data.id": {"$exists": True}, "google_data.place_id": {"$exists": False}},
+        [
+            {"$set": {"google_data.place_id": "$google_data.id", "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}}},
+            {"$unset": "google_data.id"},
+        ],
+    )
+    if migrated.modified_count:
+        logging.info(f"Moved google_data.id to google_data.place_id on {migrated.modified_count} restaurants")
+
+    backfill = [
+        UpdateOne({"_id": dish["_id"]}, {"$set": {"name_key": fold(dish.get("name"))}})
+        async for dish in db["dishes"].find({"name_key": {"$exists": False}}, {"name": 1})
+    ]
+    if backfill:
+        await db["dishes"].bulk_write(backfill, ordered=False)
+        logging.info(f"Backfilled name_key on {len(backfill)} dishes")
+
+
+def _stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+
+def explain_route_queries(db):
+    """
+    Runs explain() on every query in ROUTE_QUERIES with a synchronous pymongo database.
+    Returns a list of (route, collection, stages, ok).
+    """
+    results = []
+    for route, collection, query, sort in ROUTE_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()
+        stages = list(_stages(plan.get("queryPlanner", {}).get("winningPlan", {})))
+        results.append((route, collection, stages, "COLLSCAN" not in stages))
+    return results
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Manage and verify MongoDB indexes")
+    parser.add_argument("command", choices=["ensure", "explain"])
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = MongoClient(os.getenv("MONGO_URI"))["restaurant_allergy"]
+
+    for collection, models in INDEXES.items():
+        db[collection].create_indexes(models)
+    if args.command == "ensure":
+        print("Indexes are up to date")
+        return 0
+
+    failed = False
+    for route, collection, stages, ok in explain_route_queries(db):
+        print(f"{'ok  ' if ok else 'FAIL'} {route:<40} {collection:<12} {' > '.join(stages)}")
+        failed = failed or not ok
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
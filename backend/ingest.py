@@ -0,0 +1,260 @@
+# Document builders shared by the single and bulk write endpoints, plus an offline importer
+# that streams large menu/review dumps into Mongo in constant memory:
+#
+#   python ingest.py dishes menu.jsonl --batch-size 1000 --parallelism 4
+#   python ingest.py reviews reviews.csv --user-id <user ObjectId>
+#
+# JSONL lines and CSV rows use the same fields as POST /dishes/ and POST /reviews/.
+# In CSV files list fields (allergies, restrictions) are separated with ";".
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from dish_stats import review_added_update
+from jobs import JobQueue
+from search import fold
+
+
+def _string_list(value, field):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(";") if item.strip()]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"'{field}' must be a list of strings")
+    return value
+
+
+def _object_id(value, field):
+    if not value or not ObjectId.is_valid(value):
+        raise ValueError(f"'{field}' must be a valid id")
+    return ObjectId(value)
+
+
+def build_dish(dish: dict) -> dict:
+    """
+    Validates a dish payload and returns the document to insert. Raises ValueError if invalid.
+    """
+    name = dish.get("name")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("'name' is required")
+    now = datetime.utcnow()
+    return {
+        "name": name,
+        "name_key": fold(name),
+        "image_url": dish.get("image_url") or None,
+        "restaurant_id": _object_id(dish.get("restaurant_id"), "restaurant_id"),
+        "allergies": _string_list(dish.get("allergies"), "allergies"),
+        "restrictions": _string_list(dish.get("restrictions"), "restrictions"),
+        "reviews": [_object_id(review_id, "reviews") for review_id in _string_list(dish.get("reviews"), "reviews")],
+        "created_at": now,
+        "updated_at": now
+    }
+
+
+def build_review(review: dict, user_id) -> dict:
+    """
+    Validates a review payload and returns the document to insert. Raises ValueError if invalid.
+    """
+    comment = review.get("comment")
+    if comment is not None and not isinstance(comment, str):
+        raise ValueError("'comment' must be a string")
+    return {
+        "user_id": ObjectId(user_id),
+        "dish_id": _object_id(review.get("dish_id"), "dish_id"),
+        "restaurant_id": _object_id(review.get("restaurant_id"), "restaurant_id"),
+        "allergies": _string_list(review.get("allergies"), "allergies"),
+        "restrictions": _string_list(review.get("restrictions"), "restrictions"),
+        "comment": comment,
+        "created_at": datetime.utcnow()
+    }
+
+
+async def bulk_insert(collection, items, build):
+    """
+    Validates every item with `build` and writes the valid ones with one unordered insert_many.
+    Returns (inserted documents, per-item results). Each result has the item's index and
+    either its new "id" or an "error".
+    """
+    results = [{"index": i} for i in range(len(items))]
+    documents, positions = [], []
+    for i, item in enumerate(items):
+        try:
+            if isinstance(item, ValueError):
+                # A record the importer could not parse (see _read_records)
+                raise item
+            if not isinstance(item, dict):
+                raise ValueError("item must be an object")
+            documents.append(build(item))
+            positions.append(i)
+        except ValueError as e:
+            results[i]["error"] = str(e)
+
+    failed = set()
+    if documents:
+        try:
+            # insert_many assigns each document its _id before sending the batch
+            await collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed.add(write_error["index"])
+                results[positions[write_error["index"]]]["error"] = write_error.get("errmsg", "write failed")
+
+    inserted = []
+    for j, document in enumerate(documents):
+        if j not in failed:
+            inserted.append(document)
+            results[positions[j]]["id"] = str(document["_id"])
+    return inserted, results
+
+
+def dish_stats_operations(reviews):
+    """
+    One combined counter update per dish for a batch of newly inserted reviews.
+    """
+    updates = {}
+    for review in reviews:
+        single = review_added_update(review)
+        update = updates.setdefault(review["dish_id"], {"$inc": {}, "$max": {}})
+        for field, amount in single["$inc"].items():
+            update["$inc"][field] = update["$inc"].get(field, 0) + amount
+        for field, value in single.get("$max", {}).items():
+            update["$max"][field] = max(update["$max"].get(field, value), value)
+    return [
+        UpdateOne({"_id": dish_id}, {op: fields for op, fields in update.items() if fields})
+        for dish_id, update in updates.items()
+    ]
+
+
+async def bulk_insert_reviews(reviews_collection, dishes_collection, items, user_id, job_queue=None):
+    """
+    bulk_insert for reviews that also updates their dishes' counters and, given a
+    jobs.JobQueue, queues their classification with one more write. The reviews are saved
+    before the counters, so if that write fails they are still reported, each with a "warning".
+    """
+    inserted, results = await bulk_insert(reviews_collection, items, lambda item: build_review(item, user_id))
+    if inserted:
+        try:
+            await dishes_collection.bulk_write(dish_stats_operations(inserted), ordered=False)
+        except Exception as e:
+            logging.error(f"Error updating dish counters for {len(inserted)} reviews: {e}")
+            for result in results:
+                if "id" in result:
+                    result["warning"] = "saved, but its dish's review counters were not updated (run dish_stats.py rebuild)"
+    if inserted and job_queue is not None:
+        try:
+            await job_queue.enqueue_many("classify_review", [{"review_id": str(review["_id"])} for review in inserted])
+        except Exception as e:
+            # The reviews are saved either way; they just stay unclassified until requeued
+            logging.error(f"Error enqueueing classification for {len(inserted)} reviews: {e}")
+    return inserted, results
+
+
+def _read_records(path):
+    """
+    Lazily yields one dict per JSONL line or CSV row, or a ValueError for a line that is not
+    valid JSON, so bulk_insert reports it as that record's error.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as e:
+                        yield ValueError(f"line {number} is not valid JSON: {e}")
+
+
+def _batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def import_file(db, kind, path, batch_size=1000, parallelism=4, user_id=None):
+    """
+    Streams `path` into the dishes or reviews collection, with at most `parallelism` batches in
+    flight. Bad records and batches whose write fails are reported and skipped. Returns
+    (inserted, failed) counts.
+    """
+    slots = asyncio.Semaphore(parallelism)
+    # Imported reviews are classified by the server's job workers, like ones posted to the API
+    job_queue = JobQueue(db["jobs"])
+    tasks = set()
+    totals = {"inserted": 0, "failed": 0}
+
+    async def write(batch, offset):
+        try:
+            if kind == "dishes":
+                _, results = await bulk_insert(db["dishes"], batch, build_dish)
+            else:
+                _, results = await bulk_insert_reviews(db["reviews"], db["dishes"], batch, user_id, job_queue)
+            for result in results:
+                if "error" in result:
+                    totals["failed"] += 1
+                    print(f"record {offset + result['index']}: {result['error']}", file=sys.stderr)
+                else:
+                    totals["inserted"] += 1
+                    if "warning" in result:
+                        print(f"record {offset + result['index']}: {result['warning']}", file=sys.stderr)
+        except Exception as e:
+            # e.g. the connection dropped; the rest of the file is still imported
+            totals["failed"] += len(batch)
+            print(f"records {offset}-{offset + len(batch) - 1}: batch failed, some may have been written: {e}", file=sys.stderr)
+        finally:
+            slots.release()
+
+    offset = 0
+    for batch in _batches(_read_records(path), batch_size):
+        await slots.acquire()
+        task = asyncio.create_task(write(batch, offset))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        offset += len(batch)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return totals["inserted"], totals["failed"]
+
+
+def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Import dishes or reviews from JSONL/CSV dumps")
+    parser.add_argument("kind", choices=["dishes", "reviews"])
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--parallelism", type=int, default=4)
+    parser.add_argument("--user-id", help="author of imported reviews")
+    args = parser.parse_args()
+    if args.kind == "reviews" and not ObjectId.is_valid(args.user_id or ""):
+        parser.error("--user-id is required when importing reviews")
+
+    load_dotenv()
+    db = AsyncIOMotorClient(os.getenv("MONGO_URI"))["restaurant_allergy"]
+    started = time.perf_counter()
+    inserted, failed = asyncio.run(import_file(db, args.kind, args.path, args.batch_size, args.parallelism, args.user_id))
+    elapsed = time.perf_counter() - started
+    print(f"Imported {inserted} {args.kind} ({failed} failed) in {elapsed:.1f}s, {inserted / elapsed:.0f}/s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+# Durable background jobs stored in the "jobs" collection.
+#
+# A job moves queued -> running -> done, going back to queued with exponential backoff when it
+# fails and to dead once it has used up its attempts. A job turned away by a rate limit or an
+# open circuit breaker is deferred instead: requeued for when the upstream expects to take it
+# again, without using up an attempt, so an outage longer than the backoff schedule does not
+# dead-letter everything queued behind it. A running job holds a lease; if its worker
+# dies the lease expires and another worker picks the job up again. To inspect the queue or
+# retry dead jobs:
+#
+#   python jobs.py stats
+#   python jobs.py retry-dead
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+
+from logs import request_id_var
+
+QUEUED, RUNNING, DONE, DEAD = "queued", "running", "done", "dead"
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+class JobQueue:
+    """
+    Mongo-backed job queue with leasing, retries and dead-lettering.
+
+    `available_at` is when a queued job may next run, or when a running job's lease expires,
+    so claiming a job is a single find_one_and_update on the (status, available_at) index.
+    """
+
+    def __init__(self, collection, lease_seconds=120.0, max_attempts=5, backoff_base=2.0, backoff_max=600.0, retention=24 * 3600):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retention = retention
+        self._counters = {"enqueued": 0, "completed": 0, "retried": 0, "deferred": 0, "dead_lettered": 0, "lost_leases": 0}
+
+    async def ensure_indexes(self):
+        await self.collection.create_indexes([
+            IndexModel([("status", ASCENDING), ("available_at", ASCENDING)], name="status_available_at"),
+            # Finished jobs are kept for `retention` seconds, dead ones until retried or removed
+            IndexModel([("finished_at", ASCENDING)], name="finished_at_ttl", expireAfterSeconds=self.retention,
+                       partialFilterExpression={"status": DONE}),
+        ])
+
+    def _job(self, kind, payload, now, delay):
+        return {
+            "kind": kind,
+            "payload": payload,
+            "request_id": request_id_var.get(),
+            "status": QUEUED,
+            "attempts": 0,
+            "available_at": now + timedelta(seconds=delay),
+            "created_at": now,
+            "updated_at": now,
+        }
+
+    async def enqueue(self, kind, payload, delay=0.0):
+        """
+        Adds a job and returns its id. The current request id is kept with the job so its
+        logs can be correlated with the request that queued it.
+        """
+        result = await self.collection.insert_one(self._job(kind, payload, _now(), delay))
+        self._counters["enqueued"] += 1
+        return result.inserted_id
+
+    async def enqueue_many(self, kind, payloads, delay=0.0):
+        """
+        Adds one job per payload with a single unordered insert_many and returns their ids.
+        """
+        now = _now()
+        jobs = [self._job(kind, payload, now, delay) for payload in payloads]
+        if not jobs:
+            return []
+        result = await self.collection.insert_many(jobs, ordered=False)
+        self._counters["enqueued"] += len(result.inserted_ids)
+        return result.inserted_ids
+
+    async def claim(self, worker_id):
+        """
+        Leases the next due job to `worker_id`, or returns None if there is nothing to do.
+        """
+        now = _now()
+        return await self.collection.find_one_and_update(
+            {"status": {"$in": [QUEUED, RUNNING]}, "available_at": {"$lte": now}},
+            {
+                "$set": {"status": RUNNING, "worker": worker_id, "available_at": now + timedelta(seconds=self.lease_seconds), "updated_at": now},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("available_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _owned(self, job):
+        # A worker may only settle a job it still holds the lease on
+        return {"_id": job["_id"], "status": RUNNING, "worker": job["worker"], "attempts": job["attempts"]}
+
+    async def complete(self, job):
+        now = _now()
+        result = await self.collection.update_one(self._owned(job), {
+            "$set": {"status": DONE, "finished_at": now, "updated_at": now},
+            "$unset": {"worker": "", "available_at": ""},
+        })
+        self._count_settled(result, "completed")
+
+    async def fail(self, job, error):
+        """
+        Schedules a retry with exponential backoff and jitter, or dead-letters the job once it
+        has been attempted `max_attempts` times.
+        """
+        now = _now()
+        update = {"last_error": str(error)[:1000], "updated_at": now}
+        if job["attempts"] >= self.max_attempts:
+            update.update(status=DEAD, finished_at=now)
+            result = await self.collection.update_one(self._owned(job), {"$set": update, "$unset": {"worker": "", "available_at": ""}})
+            self._count_settled(result, "dead_lettered")
+            logging.error(f"Job {job['_id']} ({job['kind']}) dead-lettered after {job['attempts']} attempts: {error}")
+            return
+
+        delay = min(self.backoff_max, self.backoff_base ** job["attempts"]) * random.uniform(0.5, 1.0)
+        update.update(status=QUEUED, available_at=now + timedelta(seconds=delay))
+        result = await self.collection.update_one(self._owned(job), {"$set": update, "$unset": {"worker": ""}})
+        self._count_settled(result, "retried")
+
+    async def defer(self, job, retry_after, error=None):
+        """
+        Requeues a job for `retry_after` seconds from now (plus jitter, so deferred jobs don't
+        all return at once) and gives back the attempt its claim took.
+        """
+        now = _now()
+        delay = retry_after * random.uniform(1.0, 1.5)
+        update = {"status": QUEUED, "available_at": now + timedelta(seconds=delay), "updated_at": now}
+        if error is not None:
+            update["last_error"] = str(error)[:1000]
+        result = await self.collection.update_one(
+            self._owned(job), {"$set": update, "$inc": {"attempts": -1}, "$unset": {"worker": ""}}
+        )
+        self._count_settled(result, "deferred")
+
+    def _count_settled(self, result, counter):
+        self._counters[counter if result.modified_count else "lost_leases"] += 1
+
+    async def retry_dead(self):
+        """
+        Puts every dead job back on the queue with a fresh set of attempts. Returns how many.
+        """
+        now = _now()
+        result = await self.collection.update_many(
+            {"status": DEAD},
+            {"$set": {"status": QUEUED, "attempts": 0, "available_at": now, "updated_at": now}, "$unset": {"finished_at": ""}},
+        )
+        return result.modified_count
+
+    async def stats(self):
+        """
+        Queue depth by status, the age of the oldest due job, and this process's counters.
+        """
+        now = _now()
+        depth = {QUEUED: 0, RUNNING: 0, DONE: 0, DEAD: 0}
+        async for row in self.collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            depth[row["_id"]] = row["count"]
+        oldest = await self.collection.find_one(
+            {"status": QUEUED, "available_at": {"$lte": now}}, {"available_at": 1}, sort=[("available_at", ASCENDING)]
+        )
+        oldest_age = None
+        if oldest is not None:
+            available_at = oldest["available_at"].replace(tzinfo=timezone.utc)
+            oldest_age = round((now - available_at).total_seconds(), 3)
+        return {"depth": depth, "oldest_due_age_s": oldest_age, **self._counters}
+
+
+class JobWorkers:
+    """
+    A pool of async workers running jobs from a JobQueue. `handlers` maps a job kind to an async
+    function taking the job's payload; an exception from it fails the job, unless it is one of
+    `defer_on`, which must carry a `retry_after` in seconds and defers the job instead.
+    """
+
+    def __init__(self, queue, handlers, concurrency=4, poll_interval=1.0, defer_on=()):
+        self.queue = queue
+        self.handlers = handlers
+        self.defer_on = tuple(defer_on)
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_prefix = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._tasks = []
+        self._busy = 0
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run(f"{self.worker_prefix}-{i}")) for i in range(self.concurrency)]
+
+    async def stop(self):
+        """
+        Stops the workers. Jobs interrupted mid-run are picked up again when their lease expires.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, worker_id):
+        while True:
+            try:
+                job = await self.queue.claim(worker_id)
+            except Exception as e:
+                logging.error(f"Error claiming job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            self._busy += 1
+            try:
+                await self.run_job(job)
+            finally:
+                self._busy -= 1
+
+    async def run_job(self, job):
+        """
+        Runs one claimed job and records its outcome.
+        """
+        request_id_var.set(job.get("request_id") or f"job-{job['_id']}")
+        try:
+            handler = self.handlers.get(job["kind"])
+            if handler is None:
+                raise ValueError(f"No handler for job kind '{job['kind']}'")
+            await handler(job["payload"])
+        except asyncio.CancelledError:
+            raise
+        except self.defer_on as e:
+            logging.warning(f"Job {job['_id']} ({job['kind']}) deferred for {e.retry_after:.0f}s: {e}")
+            await self._settle(self.queue.defer(job, e.retry_after, e))
+        except Exception as e:
+            logging.error(f"Job {job['_id']} ({job['kind']}) failed on attempt {job['attempts']}: {e}")
+            await self._settle(self.queue.fail(job, e))
+        else:
+            await self._settle(self.queue.complete(job))
+
+    @staticmethod
+    async def _settle(update):
+        try:
+            await update
+        except Exception as e:
+            # The lease will expire and the job will run again
+            logging.error(f"Error recording job outcome: {e}")
+
+    def stats(self):
+        return {"workers": len(self._tasks), "busy": self._busy}
+
+
+def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Inspect and manage the background job queue")
+    parser.add_argument("command", choices=["stats", "retry-dead"])
+    args = parser.parse_args()
+
+    load_dotenv()
+    queue = JobQueue(AsyncIOMotorClient(os.getenv("MONGO_URI"))["restaurant_allergy"]["jobs"])
+    if args.command == "stats":
+        print(asyncio.run(queue.stats()))
+    else:
+        print(f"Requeued {asyncio.run(queue.retry_dead())} dead jobs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
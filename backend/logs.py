@@ -0,0 +1,230 @@
+# Structured logging that stays off the event loop.
+#
+# configure_logging() routes every record through a bounded in-memory queue. The caller only
+# stamps the record with the current request id and enqueues it; a listener thread formats it
+# as one JSON object per line and writes it to stderr. Settings:
+#
+#   LOG_LEVEL            root level (INFO)
+#   LOG_SAMPLE_RATES     per-logger sampling of records below WARNING, e.g.
+#                        "google_maps_api=0.01,access=0.1" (a logger's children inherit its rate)
+#   LOG_MAX_FIELD_CHARS  longest message or extra field written; longer ones are cut (2000)
+#   LOG_QUEUE_SIZE       records waiting to be written before new ones are dropped (10000)
+#
+# Fields passed with extra={...} are written as top-level keys, so large payloads can be logged
+# at DEBUG and are only serialized, and capped, if the record is kept:
+#
+#   logger.debug("Places response", extra={"payload": places})
+#
+# Don't mutate an object after passing it to a log call: it is formatted later, on another thread.
+import atexit
+import contextvars
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+from metrics import counter
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+LOG_RECORDS_DROPPED = counter("log_records_dropped_total", "Log records not written, by reason.", ("reason",))
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+_listener = None
+
+
+def parse_sample_rates(value):
+    """
+    "name=rate,name=rate" -> {name: rate}. Raises ValueError.
+    """
+    rates = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        name, _, rate = item.partition("=")
+        rate = float(rate)
+        if not 0 <= rate <= 1:
+            raise ValueError(f"Sample rate for {name} must be between 0 and 1")
+        rates[name.strip()] = rate
+    return rates
+
+
+def _cap(value, limit):
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}... [{len(value) - limit} more chars]"
+
+
+class JSONFormatter(logging.Formatter):
+    def __init__(self, max_field_chars=2000):
+        super().__init__()
+        self.max_field_chars = max_field_chars
+
+    def _field(self, value):
+        if isinstance(value, (bool, int, float)) or value is None:
+            return value
+        if not isinstance(value, str):
+            try:
+                value = orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+            except TypeError:
+                value = repr(value)
+        return _cap(value, self.max_field_chars)
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": _cap(record.getMessage(), self.max_field_chars),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = self._field(value)
+        if record.exc_info:
+            entry["exception"] = _cap(self.formatException(record.exc_info), self.max_field_chars * 4)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a random fraction of records below WARNING from the configured loggers. Warnings and
+    errors are always kept.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._resolved = {}
+
+    def _rate(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            lookup = name
+            while lookup and lookup not in self.rates:
+                lookup = lookup.rpartition(".")[0]
+            rate = self._resolved[name] = self.rates.get(lookup, 1.0)
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1 or random.random() < rate:
+            return True
+        LOG_RECORDS_DROPPED.inc(reason="sampled")
+        return False
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Enqueues records without formatting them (the listener does that) and drops them rather
+    than block when the writer falls behind.
+    """
+
+    def prepare(self, record):
+        record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason="queue_full")
+
+
+def configure_logging(level=None, sample_rates=None, max_field_chars=None, queue_size=None, stream=None):
+    """
+    Replaces the root logger's handlers with the queue pipeline and starts the writer thread.
+    Safe to call more than once.
+    """
+    global _listener
+    stop_logging()
+    level = level or os.getenv("LOG_LEVEL", "INFO").upper()
+    if sample_rates is None:
+        sample_rates = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES"))
+    max_field_chars = max_field_chars or int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+    queue_size = queue_size or int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(JSONFormatter(max_field_chars))
+    records = queue.Queue(maxsize=queue_size)
+    handler = _NonBlockingQueueHandler(records)
+    handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(records, writer)
+    _listener.start()
+    return handler
+
+
+def stop_logging():
+    """
+    Writes out queued records and stops the writer thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware giving each request an id, taken from a well-formed X-Request-ID header or
+    generated, which is stamped on every record logged while handling it and echoed back in
+    the response. Also writes one access record per request to the "access" logger.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.access = logging.getLogger("access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        if not request_id or not _REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if self.access.isEnabledFor(logging.INFO):
+                route = getattr(scope.get("route"), "path", None)
+                self.access.info(f"{scope['method']} {scope['path']} {status}", extra={
+                    "method": scope["method"], "route": route, "status": status,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                })
+            request_id_var.reset(token)
@@ -1,26 +1,91 @@
+import asyncio
 import logging
-import boto3
-from fastapi import FastAPI, File, HTTPException, Path, Depends, UploadFile, Body
+import math
+import re
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Path, Query, Depends, Body, BackgroundTasks, Request
 from fastapi.security import OAuth2PasswordBearer
-from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from typing import Optional, Dict, List
-from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from models import NewUser, User
 import os
 from datetime import datetime, timedelta, timezone
-import bcrypt
 from jwt import PyJWTError, decode, encode
-from openai import OpenAI
 
 # Google Maps API imports
-from google_maps_api import search_restaurants_api
-from safety import is_dish_safe
+from resources import resources, collection, DATABASE_NAME
+from google_maps_api import search_restaurants_api, search_cache_stats, search_nearby_api, place_record, on_fetched, PlacesUnavailable
+from classifier import SafetyClassifier
+from verdict_cache import VerdictCache
+from allergen_rules import AllergenRules
+from search import RestaurantSearchIndex, fold, name_key_fields
+from indexes import ensure_indexes
+from pagination import paginate, page_limit, ndjson_export
+from restaurant_detail import restaurant_detail_pipeline
+from dish_stats import review_added_update, review_changed_update
+from serializers import restaurant_serializer, review_serializer, dish_serializer, geo_location
+from places_store import place_update, save_places, is_stale, claim_refresh, refresh_place
+from geo import MAX_RADIUS_M, within_radius_pipeline, within_bbox_query, distance_m
+import fast_json
+from fast_json import FastJSONResponse
+from principal_cache import PrincipalCache
+from passwords import PasswordHasher, HasherOverloaded
+from jobs import JobQueue, JobWorkers
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, POOL, MetricsMiddleware, watch_event_loop_lag
+from uploads import ImageUploader, MultipartFileStream, MULTIPART_OVERHEAD, UploadRejected, UploadTooLarge
+from ingest import build_dish, build_review, bulk_insert, bulk_insert_reviews
+from logs import configure_logging, stop_logging, RequestContextMiddleware
+from rate_limits import limiter as rate_limiter, RateLimited, MongoBackend
+from resilience import CircuitOpen
+from http_cache import ResponseCache, VERSION_PROJECTION, document_etag, page_etag
 
-load_dotenv()
+configure_logging()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect before taking traffic; /readyz reports anything that failed
+    await resources.warm(["mongo", "openai", "places"])
+    try:
+        await verdict_cache.ensure_indexes()
+    except Exception as e:
+        logging.error(f"Error creating safety verdict cache indexes: {e}")
+    # Separately, so one failing index (e.g. a unique one over legacy duplicates) doesn't
+    # leave the job leases or rate limit buckets without theirs
+    try:
+        await ensure_indexes(db)
+    except Exception as e:
+        logging.error(f"Error creating indexes: {e}")
+    try:
+        await job_queue.ensure_indexes()
+    except Exception as e:
+        logging.error(f"Error creating job queue indexes: {e}")
+    if isinstance(rate_limiter.backend, MongoBackend):
+        try:
+            await rate_limiter.backend.ensure_indexes()
+        except Exception as e:
+            logging.error(f"Error creating rate limit indexes: {e}")
+    loop_lag = asyncio.create_task(watch_event_loop_lag())
+    search_sync = asyncio.create_task(
+        search_index.keep_in_sync(restaurants_collection, interval=float(os.getenv("SEARCH_SYNC_INTERVAL", "30")))
+    )
+    job_workers.start()
+    yield
+    resources.ready = False
+    search_sync.cancel()
+    loop_lag.cancel()
+    await job_workers.stop()
+    await safety_classifier.close()
+    password_hasher.shutdown()
+    image_uploader.shutdown()
+    await resources.close()
+    stop_logging()
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,46 +93,131 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "ETag"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestContextMiddleware)
 
-# Initialize MongoDB and OpenAI client
-MONGO_URI = os.getenv("MONGO_URI")
-if not MONGO_URI:
-    raise ValueError("MONGO_URI is not set in the environment variables")
-client = AsyncIOMotorClient(MONGO_URI)
+# MongoDB, OpenAI and S3 clients are created on first use (see resources.py)
 # db = client["sample_mflix"]
-
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if not openai_api_key:
-    raise ValueError("OPENAI_API_KEY is not set in the environment variables")
-openai_client = OpenAI(api_key=openai_api_key)
-db = client["restaurant_allergy"]
+db = resources.lazy(lambda: resources.get("mongo")[DATABASE_NAME])
 
 # movies_collection = db["movies"]
 # users_collection = db["users"]
-restaurants_collection = db["restaurants"]
-reviews_collection = db["reviews"]
-dishes_collection = db["dishes"]
-users_collection = db["users"]
+restaurants_collection = collection("restaurants")
+reviews_collection = collection("reviews")
+dishes_collection = collection("dishes")
+users_collection = collection("users")
+safety_verdicts_collection = collection("safety_verdicts")
+jobs_collection = collection("jobs")
+
+verdict_cache = VerdictCache(
+    safety_verdicts_collection,
+    maxsize=int(os.getenv("SAFETY_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("SAFETY_CACHE_TTL", "3600")),
+)
+safety_classifier = SafetyClassifier(
+    rules=AllergenRules(min_coverage=float(os.getenv("SAFETY_RULES_MIN_COVERAGE", "1.0"))),
+    cache=verdict_cache,
+    limiter=rate_limiter,
+    max_concurrency=int(os.getenv("SAFETY_MAX_CONCURRENCY", "4")),
+    batch_size=int(os.getenv("SAFETY_BATCH_SIZE", "8")),
+    batch_window=float(os.getenv("SAFETY_BATCH_WINDOW_MS", "25")) / 1000,
+)
+search_index = RestaurantSearchIndex()
+job_queue = JobQueue(
+    jobs_collection,
+    lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "120")),
+    max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "5")),
+)
 
 # AWS S3
 AWS_BUCKET_NAME = os.getenv('AWS_BUCKET_NAME')
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name=os.getenv('AWS_REGION', 'us-east-2')
+# e.g. http://localhost:9000 for a local MinIO or moto_server
+AWS_ENDPOINT_URL = os.getenv('AWS_ENDPOINT_URL')
+s3_client = resources.lazy(lambda: resources.get("s3"))
+image_uploader = ImageUploader(
+    s3_client,
+    AWS_BUCKET_NAME,
+    public_base_url=os.getenv('S3_PUBLIC_URL') or (f"{AWS_ENDPOINT_URL}/{AWS_BUCKET_NAME}" if AWS_ENDPOINT_URL else None),
+    max_bytes=int(os.getenv("UPLOAD_MAX_MB", "10")) * 1024 * 1024,
+    part_size=int(os.getenv("UPLOAD_PART_MB", "8")) * 1024 * 1024,
+    image_workers=int(os.getenv("IMAGE_WORKERS", "2")),
 )
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
+principal_cache = PrincipalCache(
+    maxsize=int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", "60")),
+)
+
+# Restaurant, dish and review reads (see http_cache.py)
+response_cache = ResponseCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "30")),
+    max_age=int(os.getenv("RESPONSE_MAX_AGE", "0")),
+)
+
+password_hasher = PasswordHasher(
+    rounds=int(os.getenv("BCRYPT_ROUNDS", "12")),
+    workers=int(os.getenv("BCRYPT_WORKERS", "2")),
+    max_waiting=int(os.getenv("BCRYPT_MAX_WAITING", "32")),
+    queue_timeout=float(os.getenv("BCRYPT_QUEUE_TIMEOUT", "2")),
+)
+
+# Limits for POST /check_safety/batch
+SAFETY_BATCH_MAX_ITEMS = int(os.getenv("SAFETY_BATCH_MAX_ITEMS", "1000"))
+SAFETY_BATCH_MAX_CONCURRENCY = int(os.getenv("SAFETY_BATCH_MAX_CONCURRENCY", "64"))
+SAFETY_ITEM_TIMEOUT = float(os.getenv("SAFETY_ITEM_TIMEOUT", "60"))
+
+# Stored Places data older than this is refreshed in the background when read
+PLACES_REFRESH_AFTER = float(os.getenv("PLACES_REFRESH_AFTER", str(7 * 24 * 3600)))
+
+# Nearby radius searches with fewer local results than this also ask Google
+NEARBY_MIN_LOCAL_RESULTS = int(os.getenv("NEARBY_MIN_LOCAL_RESULTS", "5"))
+
+# Largest batch accepted by the /bulk endpoints; use ingest.py for bigger imports
+MAX_BULK_ITEMS = int(os.getenv("MAX_BULK_ITEMS", "1000"))
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def overloaded_error():
+    return HTTPException(status_code=503, detail="Too many sign-in attempts, please try again shortly", headers={"Retry-After": "1"})
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+# Rate limit by the client IP in X-Forwarded-For; only enable behind a proxy that sets it
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, e: RateLimited):
+    return FastJSONResponse(
+        {"detail": "Too many requests, please try again shortly"},
+        status_code=429,
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+    )
+
+def client_key(request: Request):
+    """
+    Who a request is rate limited as: the user, if it carries a valid token, otherwise its IP.
+    """
+    authorization = request.headers.get("authorization", "")
+    if authorization[:7].lower() == "bearer ":
+        try:
+            payload = decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+            return f"user:{payload.get('uid') or payload.get('sub')}"
+        except PyJWTError:
+            pass
+    forwarded = request.headers.get("x-forwarded-for")
+    if TRUST_FORWARDED_FOR and forwarded:
+        return f"ip:{forwarded.split(',')[0].strip()}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+def client_rate_limit(name):
+    """
+    Dependency taking a token from the client's `name` bucket; raises RateLimited (429) if empty.
+    """
+    async def check(request: Request):
+        await rate_limiter.acquire(name, client_key(request))
+    return Depends(check)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -88,46 +238,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 #         "plot": movie.get("plot"),
 #     }
 
-def restaurant_serializer(restaurant: Dict) -> Dict:
-    google_data = restaurant.get("google_data")
-    return {
-        "id": str(restaurant["_id"]),
-        "name": restaurant.get("name"),
-        "google_data": {
-            "place_id": google_data.get("place_id"),
-            "rating": google_data.get("rating"),
-            "priceLevel": google_data.get("priceLevel"),
-            "reviews": google_data.get("reviews"),
-            "address": google_data.get("address"),
-            "nationalPhoneNumber": google_data.get("nationalPhoneNumber")
-        } if google_data else None,
-        "menu": [str(dish_id) for dish_id in restaurant.get("menu", [])]
-    }
+# restaurant_serializer, review_serializer and dish_serializer live in serializers.py
 
-def review_serializer(review: Dict) -> Dict:
-    return {
-        "id": str(review["_id"]),
-        "user_id": str(review["user_id"]),
-        "dish_id": str(review["dish_id"]),
-        "restaurant_id": str(review["restaurant_id"]),
-        "allergies": review.get("allergies", []),
-        "restrictions": review.get("restrictions", []),
-        "comment": review.get("comment"),
-        "created_at": review.get("created_at").isoformat() if review.get("created_at") else None
-    }
+def next_cursor_header(next_cursor: Optional[str]):
+    return {"X-Next-Cursor": next_cursor} if next_cursor else None
 
-def dish_serializer(dish: Dict) -> Dict:
-    return {
-        "id": str(dish["_id"]),
-        "name": dish.get("name"),
-        "image_url": dish.get("image_url"),
-        "restaurant_id": str(dish["restaurant_id"]),
-        "allergies": dish.get("allergies", []),
-        "restrictions": dish.get("restrictions", []),
-        "reviews": [str(review_id) for review_id in dish.get("reviews", [])],
-        "created_at": dish.get("created_at").isoformat() if dish.get("created_at") else None,
-        "updated_at": dish.get("updated_at").isoformat() if dish.get("updated_at") else None
-    }
+def invalidate_dish(*dish_ids):
+    """
+    Drops the cached dish and review pages of dishes whose reviews changed
+    """
+    response_cache.invalidate(*(tag for dish_id in dish_ids for tag in (("dish", str(dish_id)), ("dish_reviews", str(dish_id)))))
 
 # User authentication
 ####################################################
@@ -137,7 +257,10 @@ async def sign_up(new_user: NewUser):
     if user_exist:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = hash_password(new_user.password)
+    try:
+        hashed_password = await password_hasher.hash(new_user.password)
+    except HasherOverloaded:
+        raise overloaded_error()
 
     user_data = {
         "name": new_user.name,
@@ -145,35 +268,70 @@ async def sign_up(new_user: NewUser):
         "password": hashed_password
     }
 
-    await users_collection.insert_one(user_data)
+    try:
+        await users_collection.insert_one(user_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     return {"message": "New user created successfully"}
 
 @app.post("/login")
 async def login(user_login: User):
     user = await users_collection.find_one({"email": user_login.email})
-    if user and verify_password(user_login.password, user["password"]):
-        access_token = create_access_token(data={"sub": user["email"]})
+    try:
+        valid = user is not None and await password_hasher.verify(user_login.password, user["password"])
+    except HasherOverloaded:
+        raise overloaded_error()
+
+    if valid:
+        if password_hasher.needs_rehash(user["password"]):
+            await rehash_password(user, user_login.password)
+        access_token = create_access_token(data={"sub": user["email"], "uid": str(user["_id"])})
         return {"access_token": access_token, "token_type": "bearer"}
     
     raise HTTPException(status_code=401, detail="Invalid email or password")
 
+async def rehash_password(user: dict, plain_password: str):
+    """
+    Re-hashes a password at the configured cost after a successful login. Best effort: a busy
+    hasher or a concurrent change just leaves the old hash in place until the next login.
+    """
+    try:
+        new_hash = await password_hasher.hash(plain_password)
+        await users_collection.update_one({"_id": user["_id"], "password": user["password"]}, {"$set": {"password": new_hash}})
+        principal_cache.invalidate(user)
+    except HasherOverloaded:
+        pass
+    except Exception as e:
+        logging.error(f"Error rehashing password for user {user['_id']}: {e}")
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
-            print("Could not validate credentials - email is None")
+            logging.info("Could not validate credentials: token has no subject")
             raise HTTPException(status_code=401, detail="Could not validate credentials")
-        
-        user = await users_collection.find_one({"email": email})
+
+        # Tokens issued before "uid" was added are still looked up by email
+        user_id = payload.get("uid")
+        subject = user_id or email
+        user = principal_cache.get(subject)
+        if user is not None:
+            return user
+
+        if user_id:
+            user = await users_collection.find_one({"_id": ObjectId(user_id)}, {"password": 0})
+        else:
+            user = await users_collection.find_one({"email": email}, {"password": 0})
         if user is None:
-            print("User not found")
+            logging.info(f"Token subject {subject} is not a user")
             raise HTTPException(status_code=401, detail="User not found")
         
+        principal_cache.set(subject, user)
         return user
-    except PyJWTError:
-        print("Could not validate credentials")
+    except (PyJWTError, InvalidId):
+        logging.info("Could not validate credentials")
         raise HTTPException(status_code=401, detail="Could not validate credentials")
 
 @app.get("/protected-route/")
@@ -217,42 +375,177 @@ async def protected_route(current_user: dict = Depends(get_current_user)):
 
 # Restaurants
 ####################################################
+async def persist_places(places):
+    """
+    Stores results fresh from Google, so /restaurants/{place_id} can serve them locally.
+    """
+    try:
+        created = await save_places(restaurants_collection, places)
+        for restaurant_id, name in created.items():
+            search_index.add(restaurant_id, name)
+        response_cache.invalidate(*(("place", place_record(place)["google_data"]["place_id"]) for place in places or []))
+    except Exception as e:
+        logging.error(f"Error storing Places results: {e}")
+
+on_fetched(persist_places)
+
+async def schedule_place_refresh(place_id):
+    try:
+        if await claim_refresh(restaurants_collection, place_id):
+            await job_queue.enqueue("refresh_place", {"place_id": place_id})
+    except Exception as e:
+        logging.error(f"Error scheduling refresh of place {place_id}: {e}")
+
+async def refresh_place_job(payload):
+    await refresh_place(restaurants_collection, payload["place_id"])
+    response_cache.invalidate(("place", payload["place_id"]))
+
+@app.get("/restaurants/nearby/")
+async def nearby_restaurants(request: Request, lat: Optional[float] = Query(None, ge=-90, le=90), lng: Optional[float] = Query(None, ge=-180, le=180), radius: float = Query(1500, gt=0, le=MAX_RADIUS_M), bbox: Optional[str] = None, limit: int = 20):
+    """
+    Restaurants within `radius` metres of lat/lng (nearest first) or inside a bbox, from our own
+    database. Radius searches with fewer than NEARBY_MIN_LOCAL_RESULTS local hits are topped up
+    from Google.
+    """
+    limit = max(1, min(limit, 100))
+    try:
+        if bbox is not None:
+            cursor = restaurants_collection.find(within_bbox_query(bbox), restaurant_serializer.projection).limit(limit)
+            return FastJSONResponse([{**restaurant_serializer(restaurant), "source": "local"} async for restaurant in cursor])
+        if lat is None or lng is None:
+            raise HTTPException(status_code=400, detail="Pass lat and lng, or bbox")
+        pipeline = within_radius_pipeline(lat, lng, radius, limit, restaurant_serializer.projection)
+        nearby = [
+            {**restaurant_serializer(restaurant), "distance_m": round(restaurant["distance_m"]), "source": "local"}
+            async for restaurant in restaurants_collection.aggregate(pipeline)
+        ]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error finding restaurants near ({lat}, {lng}): {e}")
+        raise HTTPException(status_code=500, detail="Error finding nearby restaurants")
+
+    if len(nearby) < min(limit, NEARBY_MIN_LOCAL_RESULTS):
+        try:
+            await rate_limiter.acquire("client_places", client_key(request))
+            places = await search_nearby_api(lat, lng, radius, limit) or []
+        except (RateLimited, PlacesUnavailable):
+            # Over the Places limits or Google is down: answer from our own data alone
+            places = []
+        except Exception as e:
+            logging.error(f"Error searching Google near ({lat}, {lng}): {e}")
+            places = []
+        known = {restaurant["google_data"]["place_id"] for restaurant in nearby if restaurant["google_data"]}
+        for place in places:
+            record = place_record(place)
+            if record["google_data"]["place_id"] in known or record["location"] is None:
+                continue
+            nearby.append({
+                "id": None,
+                "name": record["name"],
+                "google_data": {**record["google_data"], "reviews": None},
+                "location": geo_location(record["location"]),
+                "menu": [],
+                "distance_m": round(distance_m(record["location"], lat, lng)),
+                "source": "google",
+            })
+        nearby.sort(key=lambda restaurant: restaurant["distance_m"])
+    return FastJSONResponse(nearby[:limit])
+
 # place_id not the id in mongodb, corresponds to place id got from google maps API
 @app.get("/restaurants/{place_id}")
-async def get_restaurant(place_id: str = Path(..., regex=r"^[a-zA-Z0-9_-]+$")):
+async def get_restaurant(request: Request, background_tasks: BackgroundTasks, place_id: str = Path(..., regex=r"^[a-zA-Z0-9_-]+$")):
+    tag = response_cache.resolve(("place", place_id))
+    cached = response_cache.get(tag, "place") if tag is not None else None
+    if cached is not None:
+        # Staleness was checked, and a refresh scheduled, when the response was cached
+        return response_cache.respond(request, cached)
     try:
-        restaurant = await restaurants_collection.find_one({"google_data.place_id": place_id})
+        since = response_cache.writes
+        restaurant = await restaurants_collection.find_one(
+            {"google_data.place_id": place_id}, {**restaurant_serializer.projection, **VERSION_PROJECTION, "google_fetched_at": 1}
+        )
         if not restaurant:
             raise HTTPException(status_code=404, detail="Restaurant not found")
-        return restaurant_serializer(restaurant)
+        if is_stale(restaurant, PLACES_REFRESH_AFTER):
+            background_tasks.add_task(schedule_place_refresh, place_id)
+        entry = response_cache.store(
+            ("restaurant", str(restaurant["_id"])), restaurant_serializer(restaurant), document_etag("restaurant", restaurant), since,
+            variant="place", aliases=[("place", place_id)],
+        )
+        return response_cache.respond(request, entry)
     except Exception as e:
         logging.error(f"Error fetching restaurant by place_id {place_id}: {e}")
         raise HTTPException(status_code=400, detail="Invalid restaurant place_id")
 
 @app.get("/restaurants/id/{restaurant_id}")
-async def get_restaurant_by_id(restaurant_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$")):
+async def get_restaurant_by_id(request: Request, restaurant_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$")):
+    tag = ("restaurant", restaurant_id.lower())
+    cached = response_cache.get(tag)
+    if cached is not None:
+        return response_cache.respond(request, cached)
     try:
-        restaurant = await restaurants_collection.find_one({"_id": ObjectId(restaurant_id)})
+        since = response_cache.writes
+        restaurant = await restaurants_collection.find_one({"_id": ObjectId(restaurant_id)}, {**restaurant_serializer.projection, **VERSION_PROJECTION})
         if not restaurant:
             raise HTTPException(status_code=404, detail="Restaurant not found")
-        return restaurant_serializer(restaurant)
+        entry = response_cache.store(tag, restaurant_serializer(restaurant), document_etag("restaurant", restaurant), since)
+        return response_cache.respond(request, entry)
     except Exception as e:
         logging.error(f"Error fetching restaurant by ID {restaurant_id}: {e}")
         raise HTTPException(status_code=400, detail="Invalid restaurant ID")
 
+async def get_restaurant_detail(match: Dict, fields: Optional[str], dish_limit: int, review_limit: int):
+    try:
+        pipeline = restaurant_detail_pipeline(
+            match, fields, dish_limit=max(1, min(dish_limit, 200)), review_limit=max(0, min(review_limit, 20))
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        results = await restaurants_collection.aggregate(pipeline).to_list(length=1)
+    except Exception as e:
+        logging.error(f"Error fetching restaurant detail for {match}: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching restaurant")
+    if not results:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    return FastJSONResponse(results[0])
+
+# Restaurant, dishes and per-dish review summaries in one response, e.g.
+# /restaurants/id/{id}/detail?fields=name,dishes.name,dishes.reviews.count&review_limit=3
+@app.get("/restaurants/id/{restaurant_id}/detail")
+async def get_restaurant_detail_by_id(restaurant_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$"), fields: Optional[str] = None, dish_limit: int = 50, review_limit: int = 3):
+    return await get_restaurant_detail({"_id": ObjectId(restaurant_id)}, fields, dish_limit, review_limit)
+
+@app.get("/restaurants/{place_id}/detail")
+async def get_restaurant_detail_by_place_id(place_id: str = Path(..., regex=r"^[a-zA-Z0-9_-]+$"), fields: Optional[str] = None, dish_limit: int = 50, review_limit: int = 3):
+    return await get_restaurant_detail({"google_data.place_id": place_id}, fields, dish_limit, review_limit)
+
 @app.get("/restaurants/search-db/")
-async def search_restaurants_db(name: str, limit: int = 10):
+async def search_restaurants_db(name: str, limit: int = 10, offset: int = 0):
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
     try:
-        cursor = restaurants_collection.find({"name": {"$regex": name, "$options": "i"}}).limit(limit)
-        restaurants = await cursor.to_list(length=limit)
-        print("restaurants", restaurants)
-        print([restaurant_serializer(restaurant) for restaurant in restaurants])
-        return [restaurant_serializer(restaurant) for restaurant in restaurants]
+        if search_index.loaded:
+            ids, total = search_index.search(name, limit, offset)
+            cursor = restaurants_collection.find({"_id": {"$in": [ObjectId(doc_id) for doc_id in ids]}}, restaurant_serializer.projection)
+            found = {str(restaurant["_id"]): restaurant for restaurant in await cursor.to_list(length=len(ids))}
+            restaurants = [found[doc_id] for doc_id in ids if doc_id in found]
+            headers = {"X-Total-Count": str(total)}
+        else:
+            # Index still loading: anchored prefix match on the indexed, folded name
+            cursor = restaurants_collection.find({"name_key": {"$regex": f"^{re.escape(fold(name))}"}}, restaurant_serializer.projection).skip(offset).limit(limit)
+            restaurants = await cursor.to_list(length=limit)
+            headers = None
+        logging.debug(f"search-db '{name}' matched {len(restaurants)} restaurants")
+        return FastJSONResponse([restaurant_serializer(restaurant) for restaurant in restaurants], headers=headers)
     except Exception as e:
         logging.error(f"Error searching restaurants with name '{name}': {e}")
         raise HTTPException(status_code=500, detail="Error searching restaurants")
     
-@app.get("/restaurants/search/")
+@app.get("/restaurants/search/", dependencies=[client_rate_limit("client_places")])
 async def search_restaurants(town: str, name: str, limit: int = 10):
     # results = [
     #     {
@@ -303,8 +596,11 @@ async def search_restaurants(town: str, name: str, limit: int = 10):
     # ]
     # return results[:limit]
     try:
-        results = await search_restaurants_api(town, name)
-        return results
+        return await search_restaurants_api(town, name)
+    except RateLimited:
+        raise
+    except PlacesUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after or 30))})
     except Exception as e:
         logging.error(f"Error searching restaurants with name '{name}' in town '{town}': {e}")
         raise HTTPException(status_code=500, detail="Error searching restaurants") 
@@ -317,30 +613,29 @@ async def create_restaurant(restaurant: Dict, current_user: dict = Depends(get_c
     """
     try:
         google_data = restaurant.get("google_data", {})
-        restaurant_data = {
-            "name": google_data.get("displayName", {}).get("text"),
-            "google_data": {
-                "id": google_data.get("id"),
-                "address": google_data.get("formattedAddress"),
-                "rating": google_data.get("rating"),
-                "priceLevel": google_data.get("priceLevel"),
-                "nationalPhoneNumber": google_data.get("nationalPhoneNumber")
-            },
-            "menu": []
-        }
-        
-        result = await restaurants_collection.insert_one(restaurant_data)
-        return {"message": "Restaurant created successfully", "id": str(result.inserted_id)}
+        filter_update = place_update(google_data)
+        if filter_update is None:
+            raise HTTPException(status_code=400, detail="google_data.id is required")
+        # Upsert by place id: the restaurant may already be stored from a search
+        created = await restaurants_collection.find_one_and_update(
+            *filter_update, upsert=True, return_document=ReturnDocument.AFTER, projection={"name": 1}
+        )
+        search_index.add(created["_id"], created.get("name"))
+        response_cache.invalidate(("restaurant", str(created["_id"])))
+        return {"message": "Restaurant created successfully", "id": str(created["_id"])}
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error creating restaurant: {e}")
         raise HTTPException(status_code=500, detail="Could not create restaurant")
 
 @app.get("/restaurants/")
-async def list_restaurants(limit: int = 10):
+async def list_restaurants(limit: int = 10, after: Optional[str] = None):
     try:
-        cursor = restaurants_collection.find().limit(limit)
-        restaurants = await cursor.to_list(length=limit)
-        return [restaurant_serializer(restaurant) for restaurant in restaurants]
+        restaurants, next_cursor = await paginate(restaurants_collection, {}, limit, after, restaurant_serializer.projection)
+        return FastJSONResponse([restaurant_serializer(restaurant) for restaurant in restaurants], headers=next_cursor_header(next_cursor))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception as e:
         logging.error(f"Error listing restaurants: {e}")
         raise HTTPException(status_code=500, detail="Error listing restaurants")
@@ -348,9 +643,16 @@ async def list_restaurants(limit: int = 10):
 @app.put("/restaurants/{restaurant_id}")
 async def update_restaurant(restaurant: Dict, restaurant_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$")):
     try:
-        result = await restaurants_collection.update_one({"_id": ObjectId(restaurant_id)}, {"$set": restaurant})
+        update = dict(restaurant, updated_at=datetime.utcnow())
+        update.pop("version", None)
+        if "name" in update:
+            update.update(name_key_fields(update["name"]))
+        result = await restaurants_collection.update_one({"_id": ObjectId(restaurant_id)}, {"$set": update, "$inc": {"version": 1}})
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Restaurant not found")
+        response_cache.invalidate(("restaurant", restaurant_id.lower()))
+        if "name" in update:
+            search_index.add(restaurant_id, update["name"])
         return {"message": "Restaurant updated successfully"}
     except Exception as e:
         logging.error(f"Error updating restaurant by ID {restaurant_id}: {e}")
@@ -359,87 +661,152 @@ async def update_restaurant(restaurant: Dict, restaurant_id: str = Path(..., reg
 # Reviews
 ####################################################
 @app.get("/reviews/{review_id}")
-async def get_review(review_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$")):
+async def get_review(request: Request, review_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$")):
+    tag = ("review", review_id.lower())
+    cached = response_cache.get(tag)
+    if cached is not None:
+        return response_cache.respond(request, cached)
     try:
-        review = await reviews_collection.find_one({"_id": ObjectId(review_id)})
+        since = response_cache.writes
+        review = await reviews_collection.find_one({"_id": ObjectId(review_id)}, {**review_serializer.projection, **VERSION_PROJECTION})
         if not review:
             raise HTTPException(status_code=404, detail="Review not found")
-        return review_serializer(review)
+        entry = response_cache.store(tag, review_serializer(review), document_etag("review", review), since)
+        return response_cache.respond(request, entry)
     except Exception as e:
         logging.error(f"Error fetching review by ID {review_id}: {e}")
         raise HTTPException(status_code=400, detail="Invalid review ID")
 
 @app.get("/reviews/")
-async def list_reviews(limit: int = 10):
+async def list_reviews(limit: int = 10, after: Optional[str] = None):
     try:
-        cursor = reviews_collection.find().limit(limit)
-        reviews = await cursor.to_list(length=limit)
-        return [review_serializer(review) for review in reviews]
+        reviews, next_cursor = await paginate(reviews_collection, {}, limit, after, review_serializer.projection)
+        return FastJSONResponse([review_serializer(review) for review in reviews], headers=next_cursor_header(next_cursor))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception as e:
         logging.error(f"Error listing reviews: {e}")
         raise HTTPException(status_code=500, detail="Error listing reviews")
     
 @app.post("/reviews/")
 async def create_review(review: Dict, current_user: dict = Depends(get_current_user)):
-    review_data = {
-        "user_id": ObjectId(current_user["_id"]),
-        "dish_id": ObjectId(review["dish_id"]),
-        "restaurant_id": ObjectId(review["restaurant_id"]),
-        "allergies": review.get("allergies", []),
-        "restrictions": review.get("restrictions", []),
-        "comment": review.get("comment"),
-        "created_at": datetime.utcnow()
-    }
+    try:
+        review_data = build_review(review, current_user["_id"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     result = await reviews_collection.insert_one(review_data)
+    # Per-dish counters; the $inc is atomic, and dish_stats.py rebuild repairs any drift
+    await dishes_collection.update_one({"_id": review_data["dish_id"]}, review_added_update(review_data))
+    invalidate_dish(review_data["dish_id"])
+    await enqueue_review_classification(result.inserted_id)
     return {"message": "Review created successfully", "id": str(result.inserted_id)}
 
+@app.post("/reviews/bulk")
+async def create_reviews_bulk(reviews: List = Body(...), current_user: dict = Depends(get_current_user)):
+    """
+    Creates up to MAX_BULK_ITEMS reviews in one unordered write and reports the outcome per item
+    """
+    if len(reviews) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} reviews per request")
+    try:
+        inserted, results = await bulk_insert_reviews(reviews_collection, dishes_collection, reviews, current_user["_id"], job_queue)
+        invalidate_dish(*{review_data["dish_id"] for review_data in inserted})
+        return {"inserted": len(inserted), "results": results}
+    except Exception as e:
+        logging.error(f"Error creating reviews in bulk: {e}")
+        raise HTTPException(status_code=500, detail="Error creating reviews")
+
 @app.put("/reviews/{review_id}")
 async def update_review(review: Dict, review_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$")):
     try:
-        result = await reviews_collection.update_one({"_id": ObjectId(review_id)}, {"$set": review})
-        if result.modified_count == 0:
+        update = dict(review, updated_at=datetime.utcnow())
+        update.pop("version", None)
+        old_review = await reviews_collection.find_one_and_update(
+            {"_id": ObjectId(review_id)}, {"$set": update, "$inc": {"version": 1}}, return_document=ReturnDocument.BEFORE
+        )
+        if old_review is None:
             raise HTTPException(status_code=404, detail="Review not found")
+        stats_update = review_changed_update(old_review, {**old_review, **review})
+        if stats_update:
+            await dishes_collection.update_one({"_id": old_review["dish_id"]}, stats_update)
+        response_cache.invalidate(("review", review_id.lower()))
+        invalidate_dish(old_review["dish_id"])
+        if CLASSIFIED_FIELDS & review.keys():
+            await enqueue_review_classification(old_review["_id"])
         return {"message": "Review updated successfully"}
     except Exception as e:
         logging.error(f"Error updating review by ID {review_id}: {e}")
         raise HTTPException(status_code=400, detail="Invalid review ID")
     
-# @app.post("/upload")
-# async def upload_image(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
-#     """
-#     Upload an image to S3 and return the URL
-#     """
-#     try:
-#         # Read file content
-#         file_content = await file.read()
-        
-#         # Generate unique filename with original extension
-#         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-#         original_extension = os.path.splitext(file.filename)[1]
-#         filename = f"dish-uploads/{timestamp}{original_extension}"
-
-#         # Upload to S3
-#         s3_client.put_object(
-#             Bucket=AWS_BUCKET_NAME,
-#             Key=filename,
-#             Body=file_content,
-#             ContentType=file.content_type
-#         )
+@app.post("/upload")
+async def upload_image(request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Stream the image in the multipart "file" field to S3 as it arrives and return its URL and
+    the URLs its resized variants will have
+    """
+    try:
+        file = MultipartFileStream(request, "file", max_body=image_uploader.max_bytes + MULTIPART_OVERHEAD)
+        key = await image_uploader.upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadRejected as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error uploading file to S3: {e}")
+        raise HTTPException(status_code=500, detail="Could not upload file")
+    await enqueue_image_variants(key)
+    return image_uploader.describe(key)
 
-#         # Generate public URL
-#         image_url = f"https://{AWS_BUCKET_NAME}.s3.amazonaws.com/{filename}"
-        
-#         return {"url": image_url}
-#     except Exception as e:
-#         logging.error(f"Error uploading file to S3: {e}")
-#         raise HTTPException(status_code=500, detail="Could not upload file")
+@app.post("/upload/presign")
+async def presign_upload(content_type: str = Body(..., embed=True), current_user: dict = Depends(get_current_user)):
+    """
+    Let the browser POST an image straight to S3; call /upload/complete with the key afterwards
+    """
+    try:
+        return await image_uploader.presigned_post(content_type)
+    except UploadRejected as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error presigning S3 upload: {e}")
+        raise HTTPException(status_code=500, detail="Could not prepare upload")
+
+@app.post("/upload/complete")
+async def complete_upload(key: str = Body(..., embed=True), current_user: dict = Depends(get_current_user)):
+    try:
+        await image_uploader.verify_uploaded(key)
+    except UploadRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await enqueue_image_variants(key)
+    return image_uploader.describe(key)
+
+async def enqueue_image_variants(key):
+    try:
+        await job_queue.enqueue("image_variants", {"key": key})
+    except Exception as e:
+        # The original is stored either way; it just has no resized variants
+        logging.error(f"Error enqueueing image variants for {key}: {e}")
+
+async def image_variants_job(payload):
+    await image_uploader.create_variants(payload["key"])
 
 @app.get("/reviews/dish/{dish_id}")
-async def get_reviews_by_dish(dish_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$"), limit: int = 10):
+async def get_reviews_by_dish(request: Request, dish_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$"), limit: int = 10, after: Optional[str] = None):
+    tag, variant = ("dish_reviews", dish_id.lower()), (page_limit(limit), after)
+    cached = response_cache.get(tag, variant)
+    if cached is not None:
+        return response_cache.respond(request, cached)
     try:
-        cursor = reviews_collection.find({"dish_id": ObjectId(dish_id)}).limit(limit)
-        reviews = await cursor.to_list(length=limit)
-        return [review_serializer(review) for review in reviews]
+        since = response_cache.writes
+        reviews, next_cursor = await paginate(
+            reviews_collection, {"dish_id": ObjectId(dish_id)}, limit, after, {**review_serializer.projection, **VERSION_PROJECTION}
+        )
+        entry = response_cache.store(
+            tag, [review_serializer(review) for review in reviews], page_etag("dish_reviews", reviews, next_cursor), since,
+            variant=variant, headers=next_cursor_header(next_cursor),
+        )
+        return response_cache.respond(request, entry)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception as e:
         logging.error(f"Error fetching reviews for dish ID {dish_id}: {e}")
         raise HTTPException(status_code=500, detail="Error fetching reviews")
@@ -458,26 +825,40 @@ async def list_dishes():
     
 @app.post("/dishes/")
 async def create_dish(dish: Dict):
-    dish_data = {
-        "name": dish.get("name"),
-        "image_url": dish.get("image_url"),
-        "restaurant_id": ObjectId(dish["restaurant_id"]),
-        "allergies": dish.get("allergies", []),
-        "restrictions": dish.get("restrictions", []),
-        "reviews": [ObjectId(review_id) for review_id in dish.get("reviews", [])],
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow()
-    }
+    try:
+        dish_data = build_dish(dish)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     result = await dishes_collection.insert_one(dish_data)
     return {"message": "Dish created successfully", "id": str(result.inserted_id)}
 
+@app.post("/dishes/bulk")
+async def create_dishes_bulk(dishes: List = Body(...)):
+    """
+    Creates up to MAX_BULK_ITEMS dishes in one unordered write and reports the outcome per item
+    """
+    if len(dishes) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} dishes per request")
+    try:
+        inserted, results = await bulk_insert(dishes_collection, dishes, build_dish)
+        return {"inserted": len(inserted), "results": results}
+    except Exception as e:
+        logging.error(f"Error creating dishes in bulk: {e}")
+        raise HTTPException(status_code=500, detail="Error creating dishes")
+
 @app.get("/dishes/{dish_id}")
-async def get_dish(dish_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$")):
+async def get_dish(request: Request, dish_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$")):
+    tag = ("dish", dish_id.lower())
+    cached = response_cache.get(tag)
+    if cached is not None:
+        return response_cache.respond(request, cached)
     try:
-        dish = await dishes_collection.find_one({"_id": ObjectId(dish_id)})
+        since = response_cache.writes
+        dish = await dishes_collection.find_one({"_id": ObjectId(dish_id)}, {**dish_serializer.projection, **VERSION_PROJECTION})
         if not dish:
             raise HTTPException(status_code=404, detail="Dish not found")
-        return dish_serializer(dish)
+        entry = response_cache.store(tag, dish_serializer(dish), document_etag("dish", dish), since)
+        return response_cache.respond(request, entry)
     except Exception as e:
         logging.error(f"Error fetching dish by ID {dish_id}: {e}")
         raise HTTPException(status_code=400, detail="Invalid dish ID")
@@ -485,10 +866,14 @@ async def get_dish(dish_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$")):
 @app.put("/dishes/{dish_id}")
 async def update_dish(dish: Dict, dish_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$")):
     try:
-        result = await dishes_collection.update_one({"_id": ObjectId(dish_id)}, {"$set": dish})
-        print("dishres", result)
+        update = dict(dish, updated_at=datetime.utcnow())
+        update.pop("version", None)
+        if "name" in update:
+            update["name_key"] = fold(update["name"])
+        result = await dishes_collection.update_one({"_id": ObjectId(dish_id)}, {"$set": update, "$inc": {"version": 1}})
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Dish not found")
+        response_cache.invalidate(("dish", dish_id.lower()))
         return {"message": "Dish updated successfully"}
     except Exception as e:
         logging.error(f"Error updating dish by ID {dish_id}: {e}")
@@ -516,9 +901,9 @@ async def search_dish_by_name_and_restaurant(name: str, restaurant_id: str):
     """
     try:
         dish = await dishes_collection.find_one({
-            "name": {"$regex": f"^{name}$", "$options": "i"},
-            "restaurant_id": ObjectId(restaurant_id)
-        })
+            "restaurant_id": ObjectId(restaurant_id),
+            "name_key": fold(name)
+        }, dish_serializer.projection)
         return dish_serializer(dish) if dish else None
     except Exception as e:
         logging.error(f"Error searching dish: {e}")
@@ -526,26 +911,47 @@ async def search_dish_by_name_and_restaurant(name: str, restaurant_id: str):
     
 # Get all dishes for a restaurant given the restaurant_id
 @app.get("/dishes/restaurant/{restaurant_id}")
-async def get_dishes_by_restaurant(restaurant_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$")):
-    try:
-        cursor = dishes_collection.find({"restaurant_id": ObjectId(restaurant_id)}).limit(10)
-        dishes = await cursor.to_list(length=10)
-        return [dish_serializer(dish) for dish in dishes]
-    except Exception as e:
-        logging.error(f"Error fetching dishes by restaurant ID {restaurant_id}: {e}")
-        raise HTTPException(status_code=400, detail="Invalid restaurant ID")
-    
-    
-@app.get("/dishes/restaurant/{restaurant_id}")
-async def get_dishes_by_restaurant(restaurant_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$"), limit: int = 10):
+async def get_dishes_by_restaurant(restaurant_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$"), limit: int = 10, after: Optional[str] = None):
     try:
-        cursor = dishes_collection.find({"restaurant_id": ObjectId(restaurant_id)}).limit(limit)
-        dishes = await cursor.to_list(length=limit)
-        return [dish_serializer(dish) for dish in dishes]
+        dishes, next_cursor = await paginate(dishes_collection, {"restaurant_id": ObjectId(restaurant_id)}, limit, after, dish_serializer.projection)
+        return FastJSONResponse([dish_serializer(dish) for dish in dishes], headers=next_cursor_header(next_cursor))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception as e:
         logging.error(f"Error fetching dishes for restaurant ID {restaurant_id}: {e}")
         raise HTTPException(status_code=500, detail="Error fetching dishes")
 
+# Export
+####################################################
+# Stream full datasets as newline-delimited JSON, resuming after an optional cursor
+@app.get("/export/restaurants")
+async def export_restaurants(after: Optional[str] = None):
+    try:
+        return ndjson_export(restaurants_collection, {}, restaurant_serializer, after, restaurant_serializer.projection)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/export/reviews")
+async def export_reviews(after: Optional[str] = None):
+    try:
+        return ndjson_export(reviews_collection, {}, review_serializer, after, review_serializer.projection)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/export/reviews/dish/{dish_id}")
+async def export_reviews_by_dish(dish_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$"), after: Optional[str] = None):
+    try:
+        return ndjson_export(reviews_collection, {"dish_id": ObjectId(dish_id)}, review_serializer, after, review_serializer.projection)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/export/dishes/restaurant/{restaurant_id}")
+async def export_dishes_by_restaurant(restaurant_id: str = Path(..., regex=r"^[0-9a-fA-F]{24}$"), after: Optional[str] = None):
+    try:
+        return ndjson_export(dishes_collection, {"restaurant_id": ObjectId(restaurant_id)}, dish_serializer, after, dish_serializer.projection)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 # @app.post("/check_safety/")
 # async def check_safe(comments: List[str] = Body(...), criteria: str = Body(...)):
 #     try:
@@ -582,11 +988,11 @@ async def get_dishes_by_restaurant(restaurant_id: str = Path(..., regex=r"^[0-9a
 #         raise HTTPException(status_code=500, detail="Error searching restaurants") 
 
 
-@app.post("/check_safety/")
+@app.post("/check_safety/", dependencies=[client_rate_limit("client_safety")])
 async def check_safe(comment: str = Body(...), tag_list: List[str] = Body(...)):
     try:
         # result = is_dish_safe(comment, tag_list)
-        safe_categories = is_dish_safe(comment, tag_list)
+        safe_categories = await safety_classifier.classify(comment, tag_list)
         if safe_categories is not None:  # Check if we got a valid response
             return {"safe_categories": safe_categories}
         else:
@@ -601,12 +1007,151 @@ async def check_safe(comment: str = Body(...), tag_list: List[str] = Body(...)):
     # except Exception as e:
     #     logging.error(f"Error determining if dish is '{tag_list}'-friendly: {e}")
     #     raise HTTPException(status_code=500, detail="Error processing '{tag_list}' check")
+    except (HTTPException, RateLimited):
+        raise
+    except CircuitOpen:
+        # OpenAI is failing: nothing is confirmed safe until it is back
+        return {"safe_categories": [], "degraded": True}
     except Exception as e:
         logging.error(f"Error determining safe dietary categories: {e}")
         raise HTTPException(
             status_code=500, 
             detail="Error processing dietary safety check"
         )
+
+@app.post("/check_safety/batch")
+async def check_safe_batch(request: Request, items: List[Dict] = Body(..., embed=True), concurrency: int = Body(16, embed=True)):
+    """
+    Classifies many {"comment", "tag_list"} items and streams one NDJSON line per item, in
+    completion order, with its index, safe_categories or error, and elapsed_ms
+    """
+    if len(items) > SAFETY_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {SAFETY_BATCH_MAX_ITEMS} items per request")
+    # Every item is charged; a full batch empties the client's bucket until it has refilled
+    await rate_limiter.acquire("client_safety_batch", client_key(request), cost=max(1, len(items)))
+
+    valid, invalid = [], []
+    for index, item in enumerate(items):
+        comment, tag_list = item.get("comment"), item.get("tag_list")
+        if isinstance(comment, str) and isinstance(tag_list, list) and all(isinstance(tag, str) for tag in tag_list):
+            valid.append((index, comment, tag_list))
+        else:
+            invalid.append({"index": index, "error": "Each item needs a 'comment' string and a 'tag_list' of strings", "elapsed_ms": 0.0})
+
+    async def lines():
+        for result in invalid:
+            yield fast_json.dumps(result) + b"\n"
+        results = safety_classifier.classify_each(
+            [(comment, tag_list) for _, comment, tag_list in valid],
+            concurrency=max(1, min(concurrency, SAFETY_BATCH_MAX_CONCURRENCY)),
+            timeout=SAFETY_ITEM_TIMEOUT,
+        )
+        async for result in results:
+            # Map back from the position among valid items to the caller's index
+            result["index"] = valid[result["index"]][0]
+            yield fast_json.dumps(result) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/check_safety/stats")
+async def check_safe_stats():
+    return safety_classifier.stats()
+
+# Background review classification
+####################################################
+# Fields whose change makes a review's safe_categories stale
+CLASSIFIED_FIELDS = {"comment", "allergies", "restrictions"}
+
+async def enqueue_review_classification(review_id):
+    try:
+        await job_queue.enqueue("classify_review", {"review_id": str(review_id)})
+    except Exception as e:
+        # The review is saved either way; it just stays unclassified
+        logging.error(f"Error enqueueing classification for review {review_id}: {e}")
+
+async def classify_review_job(payload):
+    """
+    Classifies a review and writes its safe categories onto it and into its dish's counters
+    """
+    review = await reviews_collection.find_one({"_id": ObjectId(payload["review_id"])}, {"comment": 1, "allergies": 1, "restrictions": 1})
+    if review is None:
+        return
+    tag_list = [*(review.get("allergies") or []), *(review.get("restrictions") or [])]
+    safe_categories = await safety_classifier.classify(review.get("comment") or "", tag_list)
+    old_review = await reviews_collection.find_one_and_update(
+        {"_id": review["_id"]},
+        {"$set": {"safe_categories": safe_categories, "classified_at": datetime.utcnow()}, "$inc": {"version": 1}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if old_review is None:
+        return
+    stats_update = review_changed_update(old_review, {**old_review, "safe_categories": safe_categories})
+    if stats_update:
+        await dishes_collection.update_one({"_id": old_review["dish_id"]}, stats_update)
+    response_cache.invalidate(("review", str(old_review["_id"])))
+    invalidate_dish(old_review["dish_id"])
+
+job_workers = JobWorkers(
+    job_queue,
+    {"classify_review": classify_review_job, "image_variants": image_variants_job, "refresh_place": refresh_place_job},
+    concurrency=int(os.getenv("JOB_WORKERS", "4")),
+    poll_interval=float(os.getenv("JOB_POLL_INTERVAL", "1")),
+    # Upstream outages and rate limits postpone classification rather than use up its attempts
+    defer_on=(RateLimited, CircuitOpen),
+)
+
+# Pool saturation, read whenever /metrics is scraped
+POOL.set_function(lambda: password_hasher.stats()["running"], pool="bcrypt", state="running")
+POOL.set_function(lambda: password_hasher.stats()["waiting"], pool="bcrypt", state="waiting")
+POOL.set_function(lambda: safety_classifier.stats()["in_flight"], pool="openai", state="running")
+POOL.set_function(lambda: safety_classifier.stats()["pending"], pool="openai", state="waiting")
+POOL.set_function(lambda: job_workers.stats()["busy"], pool="jobs", state="running")
+POOL.set_function(lambda: search_cache_stats()["in_flight"], pool="places", state="running")
+
+# Settings without which the app cannot serve most requests, and ones only some features need
+REQUIRED_SETTINGS = ("MONGO_URI", "SECRET_KEY", "ALGORITHM")
+OPTIONAL_SETTINGS = ("OPENAI_API_KEY", "GOOGLE_MAPS_API_KEY", "AWS_BUCKET_NAME")
+READY_CHECK_TIMEOUT = float(os.getenv("READY_CHECK_TIMEOUT", "2"))
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness: the process is up and its event loop is responsive.
+    """
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: startup has finished, Mongo answers a ping and required settings are present.
+    Returns 503 otherwise, including while the app is shutting down.
+    """
+    checks = {"started": resources.ready}
+    try:
+        await asyncio.wait_for(resources.get("mongo").admin.command("ping"), READY_CHECK_TIMEOUT)
+        checks["mongo"] = "ok"
+    except Exception as e:
+        checks["mongo"] = str(e) or type(e).__name__
+    missing = [name for name in REQUIRED_SETTINGS if not os.getenv(name)]
+    ready = resources.ready and checks["mongo"] == "ok" and not missing
+    return FastJSONResponse({
+        "ready": ready,
+        "checks": checks,
+        "missing_settings": missing,
+        "missing_optional_settings": [name for name in OPTIONAL_SETTINGS if not os.getenv(name)],
+    }, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/jobs/stats")
+async def job_stats():
+    try:
+        return {**await job_queue.stats(), **job_workers.stats()}
+    except Exception as e:
+        logging.error(f"Error reading job queue stats: {e}")
+        raise HTTPException(status_code=500, detail="Error reading job queue stats")
     
 # @app.post("/check_safety_from_title/")
 # async def check_safe_from_title(title: str = Body(..., embed=True), tag_list: List[str] = Body(..., embed = True)):
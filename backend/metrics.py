@@ -0,0 +1,311 @@
+# In-process metrics rendered in the Prometheus text format at GET /metrics.
+#
+# Metrics are module-level singletons created with counter(), gauge() and histogram() and
+# updated with keyword labels:
+#
+#   HTTP_REQUESTS.inc(method="GET", route="/dishes/{dish_id}", status="200")
+#   with INDEX_BUILD_LATENCY.time(collection="restaurants"):
+#       ...
+#
+# Values live in this process only; with several workers, scrape each one.
+import asyncio
+import math
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, value in list(self._values.items()):
+            yield from self._samples(key, value)
+
+    def _samples(self, key, value):
+        yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._callbacks = []
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        """
+        Reads the value from `fn()` each time metrics are rendered.
+        """
+        self._callbacks.append((self._key(labels), fn))
+
+    def render(self):
+        for key, fn in self._callbacks:
+            try:
+                self._values[key] = fn()
+            except Exception:
+                self._values.pop(key, None)
+        yield from super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = state[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self, key, state):
+        counts, total, count = state
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}"
+        yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+        yield f"{self.name}_count{_labels(self.labelnames, key)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+HTTP_REQUESTS = counter("http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status"))
+HTTP_LATENCY = histogram("http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route"))
+HTTP_IN_PROGRESS = gauge("http_requests_in_progress", "HTTP requests currently being handled.")
+
+MONGO_LATENCY = histogram("mongo_command_duration_seconds", "MongoDB command latency.", ("collection", "command"))
+MONGO_FAILURES = counter("mongo_command_failures_total", "Failed MongoDB commands.", ("collection", "command"))
+
+OPENAI_LATENCY = histogram("openai_request_duration_seconds", "OpenAI chat completion latency.", ("model", "call", "outcome"))
+OPENAI_TOKENS = counter("openai_tokens_total", "OpenAI tokens used.", ("model", "type"))
+
+PLACES_LATENCY = histogram("places_request_duration_seconds", "Google Places API latency.", ("endpoint", "outcome"))
+
+LOOP_LAG = gauge("event_loop_lag_seconds", "Most recent delay in running a scheduled event loop callback.")
+LOOP_LAG_HISTOGRAM = histogram("event_loop_lag_distribution_seconds", "Event loop scheduling delay.",
+                               buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+POOL = gauge("pool_usage", "Work pool usage: items running or waiting in each pool.", ("pool", "state"))
+
+
+def record_token_usage(model, usage):
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, model=model, type="prompt")
+    OPENAI_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, model=model, type="completion")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request, labelled by route template (e.g.
+    "/dishes/{dish_id}") rather than raw path so label cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "<unmatched>"
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=scope["method"], route=path)
+            HTTP_REQUESTS.inc(method=scope["method"], route=path, status=status)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    PyMongo command listener timing each command by collection. Pass it to the client with
+    event_listeners=[MongoCommandMetrics()].
+    """
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else "-"
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _finished(self, event):
+        return self._collections.pop((event.connection_id, event.request_id), "-")
+
+    def succeeded(self, event):
+        collection = self._finished(event)
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+
+    def failed(self, event):
+        collection = self._finished(event)
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+        MONGO_FAILURES.inc(collection=collection, command=event.command_name)
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    PyMongo pool listener tracking checked-out connections and checkout waits per server.
+    """
+
+    def connection_check_out_started(self, event):
+        POOL.inc(pool=f"mongo {event.address[0]}:{event.address[1]}", state="waiting")
+
+    def connection_check_out_failed(self, event):
+        POOL.dec(pool=f"mongo {event.address[0]}:{event.address[1]}", state="waiting")
+
+    def connection_checked_out(self, event):
+        pool = f"mongo {event.address[0]}:{event.address[1]}"
+        POOL.dec(pool=pool, state="waiting")
+        POOL.inc(pool=pool, state="running")
+
+    def connection_checked_in(self, event):
+        POOL.dec(pool=f"mongo {event.address[0]}:{event.address[1]}", state="running")
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+async def watch_event_loop_lag(interval=0.5):
+    """
+    Measures how late a sleep wakes up, i.e. how long callbacks wait behind blocking work.
+    Run as a background task.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        LOOP_LAG.set(lag)
+        LOOP_LAG_HISTOGRAM.observe(lag)
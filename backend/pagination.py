@@ -0,0 +1,74 @@
+import base64
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi.responses import StreamingResponse
+
+from fast_json import dumps
+
+CURSOR_VERSION = "v1"
+# Largest page a client can ask for
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(last_id):
+    """
+    Opaque continuation token for the page after the document with `_id` == last_id.
+    """
+    raw = f"{CURSOR_VERSION}:{last_id}".encode("ascii")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """
+    Returns the ObjectId encoded in a continuation token. Raises ValueError for malformed tokens.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode("ascii")
+        version, _, last_id = raw.partition(":")
+        if version != CURSOR_VERSION:
+            raise ValueError(f"Unsupported cursor version '{version}'")
+        return ObjectId(last_id)
+    except (UnicodeDecodeError, InvalidId, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _after(query, after):
+    if not after:
+        return query
+    return {"$and": [query, {"_id": {"$gt": decode_cursor(after)}}]} if query else {"_id": {"$gt": decode_cursor(after)}}
+
+
+def page_limit(limit):
+    """
+    Clamps a requested page size to 1..MAX_PAGE_SIZE. An empty page would hand out a cursor that
+    skips a document, and Mongo treats .limit(0) as no limit at all.
+    """
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+async def paginate(collection, query, limit, after=None, projection=None):
+    """
+    Keyset pagination on `_id`, at most MAX_PAGE_SIZE documents per page. Returns (documents,
+    continuation token or None on the last page).
+    """
+    limit = page_limit(limit)
+    cursor = collection.find(_after(query, after), projection).sort("_id", 1).limit(limit + 1)
+    documents = await cursor.to_list(length=limit + 1)
+    if len(documents) > limit:
+        return documents[:limit], encode_cursor(documents[limit - 1]["_id"])
+    return documents, None
+
+
+async def _ndjson_lines(cursor, serializer):
+    async for document in cursor:
+        yield dumps(serializer(document)) + b"\n"
+
+
+def ndjson_export(collection, query, serializer, after=None, projection=None, batch_size=500):
+    """
+    Streams every matching document, in `_id` order, as newline-delimited JSON.
+    Documents are serialized one at a time as the cursor yields them, so memory stays flat.
+    """
+    cursor = collection.find(_after(query, after), projection).sort("_id", 1).batch_size(batch_size)
+    return StreamingResponse(_ndjson_lines(cursor, serializer), media_type="application/x-ndjson")
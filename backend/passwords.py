@@ -0,0 +1,92 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+
+class HasherOverloaded(Exception):
+    """Raised when a password operation is shed instead of queued."""
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def hash_rounds(hashed_password: str) -> int:
+    # bcrypt hashes look like $2b$12$<salt+hash>
+    return int(hashed_password.split("$")[2])
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated, size-limited thread pool so hashing never blocks the event loop.
+
+    At most `workers` operations run at once. Up to `max_waiting` more may wait for a worker,
+    for at most `queue_timeout` seconds; anything beyond that is shed with HasherOverloaded.
+    """
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=2, max_waiting=32, queue_timeout=2.0):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = asyncio.Semaphore(workers)
+        self._waiting = 0
+        self._running = 0
+        self.completed = 0
+        self.shed = 0
+
+    async def _run(self, fn, *args):
+        if self._waiting >= self.max_waiting:
+            self.shed += 1
+            raise HasherOverloaded()
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            raise HasherOverloaded()
+        finally:
+            self._waiting -= 1
+
+        self._running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._running -= 1
+            self.completed += 1
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password, self.rounds)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        """
+        True when a stored hash was made with a different cost factor than the configured one.
+        """
+        return hash_rounds(hashed_password) != self.rounds
+
+    def stats(self):
+        return {
+            "rounds": self.rounds,
+            "workers": self.workers,
+            "running": self._running,
+            "waiting": self._waiting,
+            "completed": self.completed,
+            "shed": self.shed,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,109 @@
+# Write-through storage of Google Places results in the restaurants collection.
+#
+# Every place we see is upserted by its canonical key, google_data.place_id, with the time it
+# was fetched in google_fetched_at. Records older than PLACES_REFRESH_AFTER are refreshed by a
+# background job when they are read, never on the request path.
+import logging
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne
+
+from google_maps_api import fetch_place_api, place_record
+from search import name_key_fields
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def place_update(place, now=None):
+    """
+    (filter, update pipeline) that creates or refreshes the restaurant for a Places result, or
+    None if the result has no id. Names are only set on insert so local edits are kept, and
+    `version` only changes when a stored field does, so re-fetching an unchanged place keeps
+    its ETag (see http_cache.py).
+    """
+    record = place_record(place)
+    place_id = record["google_data"]["place_id"]
+    if not place_id:
+        return None
+    now = now or _now()
+    fields = {f"google_data.{key}": value for key, value in record["google_data"].items()}
+    if record["location"] is not None:
+        fields["location"] = record["location"]
+    changed = {"$or": [{"$ne": [f"${path}", {"$literal": value}]} for path, value in fields.items()]}
+    version = {"$ifNull": ["$version", 0]}
+    on_insert = {"name": record["name"], **name_key_fields(record["name"]), "menu": [], "created_at": now}
+    return (
+        {"google_data.place_id": place_id},
+        [
+            {"$set": {"version": {"$cond": [changed, {"$add": [version, 1]}, version]}}},
+            {"$set": {
+                # $literal so values such as a name starting with "$" are not read as field paths
+                **{path: {"$literal": value} for path, value in fields.items()},
+                "google_fetched_at": now,
+                **{field: {"$ifNull": [f"${field}", {"$literal": value}]} for field, value in on_insert.items()},
+            }},
+        ],
+    )
+
+
+def place_upsert(place, now=None):
+    filter_update = place_update(place, now)
+    return UpdateOne(*filter_update, upsert=True) if filter_update else None
+
+
+async def save_places(collection, places):
+    """
+    Upserts a batch of Places results with one unordered bulk_write. Returns
+    {new restaurant _id: name} for the places that were not stored before.
+    """
+    operations, names = [], []
+    for place in places or []:
+        operation = place_upsert(place)
+        if operation is not None:
+            operations.append(operation)
+            names.append(place_record(place)["name"])
+    if not operations:
+        return {}
+    result = await collection.bulk_write(operations, ordered=False)
+    return {restaurant_id: names[index] for index, restaurant_id in result.upserted_ids.items()}
+
+
+def is_stale(restaurant, max_age):
+    fetched_at = restaurant.get("google_fetched_at")
+    if fetched_at is None:
+        return True
+    return _now() - fetched_at.replace(tzinfo=timezone.utc) > timedelta(seconds=max_age)
+
+
+async def claim_refresh(collection, place_id, retry_after=3600):
+    """
+    Marks a place as being refreshed. Returns False if a refresh was already requested within
+    `retry_after` seconds, so concurrent readers schedule it only once.
+    """
+    now = _now()
+    result = await collection.update_one(
+        {
+            "google_data.place_id": place_id,
+            "$or": [
+                {"google_refresh_requested_at": {"$exists": False}},
+                {"google_refresh_requested_at": {"$lt": now - timedelta(seconds=retry_after)}},
+            ],
+        },
+        {"$set": {"google_refresh_requested_at": now}},
+    )
+    return result.modified_count == 1
+
+
+async def refresh_place(collection, place_id):
+    """
+    Re-fetches one place from Google and stores the result. Places Google no longer returns are
+    kept but flagged with google_missing_at.
+    """
+    place = await fetch_place_api(place_id)
+    if place is None:
+        logging.error(f"Place {place_id} was not found when refreshing it")
+        await collection.update_one({"google_data.place_id": place_id}, {"$set": {"google_missing_at": _now()}})
+        return
+    await collection.bulk_write([place_upsert(place)])
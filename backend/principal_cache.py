@@ -0,0 +1,34 @@
+from ttl_cache import TTLCache
+
+
+class PrincipalCache:
+    """
+    Caches the authenticated user document per token subject so get_current_user can skip the
+    users lookup. Cached documents never include the password hash.
+
+    Entries are keyed on both the user id and the email the tokens carry. Call invalidate()
+    whenever a user record changes; other workers pick the change up when their entry expires.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60.0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, subject):
+        user = self._cache.get(subject)
+        return dict(user) if user is not None else None
+
+    def set(self, subject, user):
+        user = {key: value for key, value in user.items() if key != "password"}
+        self._cache.set(subject, user)
+
+    def invalidate(self, user):
+        """
+        Drops every cached entry for a user document (or anything with "_id"/"email").
+        """
+        if user.get("_id") is not None:
+            self._cache.pop(str(user["_id"]))
+        if user.get("email") is not None:
+            self._cache.pop(user["email"])
+
+    def stats(self):
+        return self._cache.stats()
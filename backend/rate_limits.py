@@ -0,0 +1,188 @@
+# Token-bucket admission control for calls that cost us upstream quota (OpenAI, Google Places).
+#
+# Each named limit is a bucket of `burst` tokens refilled at `rate` per second, kept per key:
+# "global" for the upstream-wide limits, a user or IP for the per-client ones. A caller that finds
+# the bucket empty may wait for its token, but only up to the limit's `max_wait` (or its own
+# deadline, if sooner) and only while fewer than `max_waiting` callers are already waiting.
+# Otherwise it is shed at once with RateLimited, which the API turns into a 429 with Retry-After.
+#
+# Limits are configured per name with RATE_LIMIT_<NAME>_RATE, _BURST, _MAX_WAIT and _MAX_WAITING;
+# a rate of 0 disables the limit. Bucket state lives in this process unless
+# RATE_LIMIT_BACKEND=mongo, which shares it between workers through the rate_limits collection
+# at the cost of one round trip per admission.
+import asyncio
+import logging
+import os
+import time
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from metrics import counter, gauge
+from resources import collection
+
+RATE_LIMITED = counter("rate_limited_total", "Requests shed by a rate limit.", ("limit",))
+RATE_LIMIT_WAITING = gauge("rate_limit_waiting", "Callers waiting for a rate limit token.", ("limit",))
+
+
+class RateLimited(Exception):
+    """Raised when a call is shed; `retry_after` is when a token should be available, in seconds."""
+
+    def __init__(self, limit, retry_after):
+        super().__init__(f"Rate limit '{limit}' exceeded, retry after {retry_after:.1f}s")
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+class Limit:
+    def __init__(self, rate, burst, max_wait=0.0, max_waiting=100):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_wait = max_wait
+        self.max_waiting = max_waiting
+
+    @classmethod
+    def from_env(cls, name, rate, burst, max_wait=0.0, max_waiting=100):
+        prefix = f"RATE_LIMIT_{name.upper()}"
+        return cls(
+            rate=float(os.getenv(f"{prefix}_RATE", str(rate))),
+            burst=int(os.getenv(f"{prefix}_BURST", str(burst))),
+            max_wait=float(os.getenv(f"{prefix}_MAX_WAIT", str(max_wait))),
+            max_waiting=int(os.getenv(f"{prefix}_MAX_WAITING", str(max_waiting))),
+        )
+
+
+# The backends store a bucket as the time it will next be full (the "theoretical arrival time"),
+# which is a token bucket that needs a single number per key and no refill timer. A call of
+# `cost` tokens needs to wait tat + cost / rate - burst / rate - now seconds; if that is within
+# max_wait the tokens are reserved, even if the caller still has to sleep for them.
+# A call costing more than `burst` is let through only when the bucket is full, and is still
+# charged in full: the bucket stays empty until the whole cost has been refilled.
+
+class MemoryBackend:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._tat = {}
+
+    async def reserve(self, key, rate, burst, cost, max_wait):
+        """
+        (granted, wait): whether `cost` tokens were reserved and how long until they are
+        available (the Retry-After if not granted).
+        """
+        now = time.time()
+        tat = max(self._tat.get(key, now), now)
+        new_tat = tat + cost / rate
+        wait = tat + min(cost, burst) / rate - burst / rate - now
+        if wait > max_wait:
+            return False, wait
+        self._tat[key] = new_tat
+        if len(self._tat) > self.max_keys:
+            self._prune(now)
+        return True, max(0.0, wait)
+
+    def _prune(self, now):
+        # Buckets whose time has passed are full again, the same as not being stored at all
+        for key in [key for key, tat in self._tat.items() if tat <= now]:
+            del self._tat[key]
+
+
+class MongoBackend:
+    """
+    Buckets shared by every worker: one document per key, updated atomically with a pipeline.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def reserve(self, key, rate, burst, cost, max_wait):
+        now = time.time()
+        tat = {"$max": [{"$ifNull": ["$tat", now]}, now]}
+        wait = {"$subtract": [{"$add": [tat, min(cost, burst) / rate]}, burst / rate + now]}
+        update = [
+            {"$set": {"wait": wait}},
+            {"$set": {
+                "granted": {"$lte": ["$wait", max_wait]},
+                "tat": {"$cond": [{"$lte": ["$wait", max_wait]}, {"$add": [tat, cost / rate]}, {"$ifNull": ["$tat", now]}]},
+            }},
+            # Once the bucket is full again the document carries no information
+            {"$set": {"expires_at": {"$toDate": {"$multiply": [{"$max": ["$tat", now]}, 1000]}}}},
+        ]
+        for attempt in range(2):
+            try:
+                bucket = await self.collection.find_one_and_update(
+                    {"_id": key}, update, upsert=True, return_document=ReturnDocument.AFTER, projection={"granted": 1, "wait": 1}
+                )
+                if bucket["granted"]:
+                    return True, max(0.0, bucket["wait"])
+                return False, bucket["wait"]
+            except DuplicateKeyError:
+                # Another worker created the bucket at the same moment; the retry updates it
+                if attempt:
+                    raise
+
+
+class RateLimiter:
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.limits = limits
+        self._waiting = {name: 0 for name in limits}
+        for name in limits:
+            RATE_LIMIT_WAITING.set_function(lambda name=name: self._waiting[name], limit=name)
+
+    async def acquire(self, name, key="global", cost=1, deadline=None):
+        """
+        Takes `cost` tokens from the `name` bucket for `key`, sleeping until they are available
+        if that is allowed. `deadline` (a time.monotonic() value) caps the wait. Raises
+        RateLimited if the call should be shed.
+        """
+        limit = self.limits[name]
+        if limit.rate <= 0:
+            return
+        max_wait = limit.max_wait
+        if deadline is not None:
+            max_wait = min(max_wait, deadline - time.monotonic())
+        if self._waiting[name] >= limit.max_waiting:
+            max_wait = 0.0
+
+        try:
+            granted, wait = await self.backend.reserve(f"{name}:{key}", limit.rate, limit.burst, cost, max(0.0, max_wait))
+        except Exception as e:
+            # Fail open: a limiter outage should not take the API down with it
+            logging.error(f"Error checking rate limit '{name}': {e}")
+            return
+        if not granted:
+            RATE_LIMITED.inc(limit=name)
+            raise RateLimited(name, wait)
+        if wait > 0:
+            self._waiting[name] += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._waiting[name] -= 1
+
+    def stats(self):
+        return {
+            name: {"rate": limit.rate, "burst": limit.burst, "max_wait": limit.max_wait, "waiting": self._waiting[name]}
+            for name, limit in self.limits.items()
+        }
+
+
+def _backend():
+    if os.getenv("RATE_LIMIT_BACKEND", "memory") == "mongo":
+        return MongoBackend(collection("rate_limits"))
+    return MemoryBackend()
+
+
+# Upstream-wide limits queue briefly; per-client limits shed at once. Safety checks are counted
+# per item: single checks in client_safety, sized for a dish page's worth at once, and batch
+# items in client_safety_batch, whose burst is a full batch (SAFETY_BATCH_MAX_ITEMS)
+limiter = RateLimiter(_backend(), {
+    "openai": Limit.from_env("openai", rate=10, burst=20, max_wait=2.0),
+    "places": Limit.from_env("places", rate=10, burst=20, max_wait=2.0),
+    "client_safety": Limit.from_env("client_safety", rate=2, burst=50),
+    "client_safety_batch": Limit.from_env("client_safety_batch", rate=2, burst=1000),
+    "client_places": Limit.from_env("client_places", rate=1, burst=10),
+})
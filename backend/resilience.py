@@ -0,0 +1,215 @@
+# Deadlines, retries, hedging and circuit breakers for calls to upstream services.
+#
+#   policy = Policy("places", timeout=8, retries=2, breaker=CircuitBreaker("places"))
+#   response = await policy.run(lambda: client.get(url))
+#
+# `timeout` is the budget for the whole call, retries included. Only transient failures (timeouts,
+# connection errors, 429 and 5xx responses) are retried, and they are what trips the breaker:
+# a 404 means the upstream is working. While a breaker is open, calls fail at once with
+# CircuitOpen so callers can serve a cached or degraded answer instead of queueing.
+import asyncio
+import logging
+import math
+import random
+import time
+from collections import deque
+
+from metrics import counter, gauge
+
+UPSTREAM_RETRIES = counter("upstream_retries_total", "Upstream calls retried after a transient failure.", ("upstream",))
+UPSTREAM_HEDGES = counter("upstream_hedged_requests_total", "Second requests sent because the first was slow, by which one answered.", ("upstream", "winner"))
+BREAKER_OPEN = gauge("circuit_breaker_open", "1 while an upstream's circuit breaker is open or half-open.", ("upstream",))
+BREAKER_REJECTIONS = counter("circuit_breaker_rejections_total", "Calls failed fast by an open circuit breaker.", ("upstream",))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"{upstream} is unavailable, retry after {retry_after:.0f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def is_transient(error, extra=None):
+    """
+    Whether `error` is worth retrying and counts against the upstream's health. `extra` is an
+    optional predicate for client-specific errors such as connection failures.
+    """
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return bool(extra and extra(error))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive transient failures and fails calls fast for
+    `reset_timeout` seconds. Then one trial call is let through: success closes the breaker,
+    failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+        BREAKER_OPEN.set_function(lambda: 0 if self.state == CLOSED else 1, upstream=name)
+
+    def allow(self):
+        """
+        Returns if a call may go ahead, otherwise raises CircuitOpen.
+        """
+        if self.state == CLOSED:
+            return
+        now = time.monotonic()
+        if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._trial:
+            self._trial = True
+            return
+        BREAKER_REJECTIONS.inc(upstream=self.name)
+        raise CircuitOpen(self.name, max(1.0, self._opened_at + self.reset_timeout - now))
+
+    def success(self):
+        if self.state != CLOSED:
+            logging.warning(f"Circuit breaker for {self.name} closed")
+        self.state = CLOSED
+        self._failures = 0
+        self._trial = False
+
+    def failure(self):
+        self._failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+            logging.error(f"Circuit breaker for {self.name} opened after {self._failures} failures")
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self):
+        """
+        Gives back a trial call that ended without an outcome, e.g. because it was cancelled.
+        """
+        self._trial = False
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self._failures}
+
+
+class Policy:
+    """
+    How to call one upstream: overall deadline, retries with full-jitter exponential backoff,
+    an optional breaker and, with `hedge_percentile`, a second request sent when the first has
+    been running longer than that percentile of recent latencies. Only hedge idempotent calls.
+    """
+
+    def __init__(self, name, timeout, retries=0, backoff_base=0.2, backoff_max=2.0, breaker=None,
+                 hedge_percentile=None, hedge_min_samples=20, transient=None):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.transient = transient
+        self._latencies = deque(maxlen=200)
+        self._samples = 0
+        self._hedge_delay = None
+
+    def deadline(self):
+        """
+        The time.monotonic() by which a call starting now must finish. Take it before anything
+        that may wait, such as a rate limit, and pass it on so the wait comes out of the budget.
+        """
+        return time.monotonic() + self.timeout
+
+    async def run(self, attempt, deadline=None):
+        """
+        Awaits `attempt()`, a function returning a new awaitable per call, under the policy.
+        `deadline` (a time.monotonic() value) can shorten the budget. Raises the last error,
+        asyncio.TimeoutError when out of time, or CircuitOpen.
+        """
+        deadline = min(time.monotonic() + self.timeout, deadline or math.inf)
+        for retry in range(self.retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"{self.name} call ran out of time")
+            if self.breaker is not None:
+                self.breaker.allow()
+            try:
+                result = await asyncio.wait_for(self._attempt(attempt), remaining)
+            except asyncio.CancelledError:
+                if self.breaker is not None:
+                    self.breaker.release()
+                raise
+            except Exception as e:
+                transient = is_transient(e, self.transient)
+                if self.breaker is not None and transient:
+                    self.breaker.failure()
+                elif self.breaker is not None:
+                    self.breaker.success()
+                if not transient or retry == self.retries:
+                    raise
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                UPSTREAM_RETRIES.inc(upstream=self.name)
+                await asyncio.sleep(delay)
+            else:
+                if self.breaker is not None:
+                    self.breaker.success()
+                return result
+
+    async def _attempt(self, attempt):
+        started = time.perf_counter()
+        delay = self._hedge_delay if self.hedge_percentile is not None else None
+        if delay is None:
+            result = await attempt()
+        else:
+            result = await self._hedged(attempt, delay)
+        self._record(time.perf_counter() - started)
+        return result
+
+    async def _hedged(self, attempt, delay):
+        started = [asyncio.ensure_future(attempt())]
+        try:
+            done, _ = await asyncio.wait(started, timeout=delay)
+            if not done:
+                started.append(asyncio.ensure_future(attempt()))
+            pending, error = set(started), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(started) > 1:
+                            UPSTREAM_HEDGES.inc(upstream=self.name, winner="first" if task is started[0] else "hedge")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in started:
+                task.cancel()
+
+    def _record(self, elapsed):
+        self._latencies.append(elapsed)
+        self._samples += 1
+        # Re-derive the hedge delay every few samples rather than sorting on every call
+        if self.hedge_percentile is not None and len(self._latencies) >= self.hedge_min_samples and self._samples % 10 == 0:
+            latencies = sorted(self._latencies)
+            self._hedge_delay = latencies[min(len(latencies) - 1, int(self.hedge_percentile * len(latencies)))]
+
+    def stats(self):
+        return {
+            "breaker": self.breaker.stats() if self.breaker is not None else None,
+            "hedge_delay_ms": round(self._hedge_delay * 1000, 1) if self._hedge_delay is not None else None,
+        }
@@ -0,0 +1,199 @@
+# Shared upstream clients, created once per process on first use and closed by the app lifespan.
+#
+# Modules register a factory under a name and read the client with resources.get(name), or hold
+# a resources.lazy(...) proxy that resolves on first attribute access. Nothing connects, and no
+# setting is required, until a client is used, so importing main.py is cheap and a missing
+# setting only fails the requests that need it (and shows up on GET /readyz).
+#
+#   MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE            Mongo connections per server (100, 0)
+#   MONGO_CONNECT_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS   (5000, 5000)
+#   OPENAI_TIMEOUT, OPENAI_MAX_CONNECTIONS, OPENAI_MAX_RETRIES    (30, 20, 0)
+#   S3_MAX_POOL_CONNECTIONS, S3_CONNECT_TIMEOUT, S3_READ_TIMEOUT  (10, 5, 60)
+import asyncio
+import inspect
+import logging
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_NAME = "restaurant_allergy"
+
+
+class MissingSetting(RuntimeError):
+    """Raised when a client is needed but the environment variable it requires is not set."""
+
+
+def require(name):
+    value = os.getenv(name)
+    if not value:
+        raise MissingSetting(f"{name} is not set in the environment variables")
+    return value
+
+
+class Resources:
+    """
+    Registry of lazily created clients. `factory()` builds a client, `close(client)` (sync or
+    async) releases it and `warm(client)` (async) opens connections before the app is ready.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._clients = {}
+        self.generation = 0
+        self.ready = False
+
+    def register(self, name, factory, close=None, warm=None):
+        self._factories[name] = (factory, close, warm)
+
+    def get(self, name):
+        client = self._clients.get(name)
+        if client is None:
+            factory = self._factories[name][0]
+            client = self._clients[name] = factory()
+        return client
+
+    def created(self, name):
+        return name in self._clients
+
+    def lazy(self, resolve):
+        """
+        Proxy for `resolve()`, e.g. lambda: resources.get("mongo")["db"]["users"], evaluated on
+        first use and again after the registry is closed and reopened.
+        """
+        return LazyProxy(self, resolve)
+
+    async def warm(self, names, timeout=10.0):
+        """
+        Creates the named clients and runs their warmers. Failures are logged and returned as
+        {name: error} rather than raised, so the app still starts and reports itself not ready.
+        """
+        errors = {}
+        for name in names:
+            try:
+                client = self.get(name)
+                warm = self._factories[name][2]
+                if warm is not None:
+                    await asyncio.wait_for(warm(client), timeout)
+            except Exception as e:
+                logging.error(f"Error warming {name}: {e}")
+                errors[name] = str(e) or type(e).__name__
+        self.ready = True
+        return errors
+
+    async def close(self):
+        """
+        Closes every created client, newest first.
+        """
+        self.ready = False
+        for name in reversed(list(self._clients)):
+            client = self._clients.pop(name)
+            close = self._factories[name][1]
+            if close is None:
+                continue
+            try:
+                result = close(client)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logging.error(f"Error closing {name}: {e}")
+        self.generation += 1
+
+
+class LazyProxy:
+    __slots__ = ("_resources", "_resolve", "_target", "_generation")
+
+    def __init__(self, resources, resolve):
+        self._resources = resources
+        self._resolve = resolve
+        self._target = None
+        self._generation = None
+
+    def _get(self):
+        if self._target is None or self._generation != self._resources.generation:
+            self._target = self._resolve()
+            self._generation = self._resources.generation
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+
+resources = Resources()
+
+
+def _mongo_client():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from metrics import MongoCommandMetrics, MongoPoolMetrics
+
+    return AsyncIOMotorClient(
+        require("MONGO_URI"),
+        maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        connectTimeoutMS=int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        serverSelectionTimeoutMS=int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        event_listeners=[MongoCommandMetrics(), MongoPoolMetrics()],
+    )
+
+
+async def _ping_mongo(client):
+    await client.admin.command("ping")
+
+
+def _openai_http_limits():
+    import httpx
+
+    connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+    return httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+
+
+def _openai_options():
+    return {
+        "api_key": require("OPENAI_API_KEY"),
+        "base_url": os.getenv("OPENAI_BASE_URL"),
+        "timeout": float(os.getenv("OPENAI_TIMEOUT", "30")),
+        # Retries are left to the callers' resilience.Policy
+        "max_retries": int(os.getenv("OPENAI_MAX_RETRIES", "0")),
+    }
+
+
+def _openai_client():
+    import httpx
+    import openai
+
+    return openai.AsyncOpenAI(**_openai_options(), http_client=httpx.AsyncClient(limits=_openai_http_limits()))
+
+
+def _s3_client():
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        "s3",
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=os.getenv("AWS_REGION", "us-east-2"),
+        # e.g. http://localhost:9000 for a local MinIO or moto_server
+        endpoint_url=os.getenv("AWS_ENDPOINT_URL"),
+        config=Config(
+            max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", "10")),
+            connect_timeout=float(os.getenv("S3_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("S3_READ_TIMEOUT", "60")),
+        ),
+    )
+
+
+resources.register("mongo", _mongo_client, close=lambda client: client.close(), warm=_ping_mongo)
+resources.register("openai", _openai_client, close=lambda client: client.close())
+resources.register("s3", _s3_client, close=lambda client: client.close())
+
+
+def collection(name):
+    """
+    Lazy handle on a collection of the app database, usable anywhere a Motor collection is.
+    """
+    return resources.lazy(lambda: resources.get("mongo")[DATABASE_NAME][name])
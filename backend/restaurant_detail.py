@@ -0,0 +1,158 @@
+def _id_string(path):
+    return {"$toString": path}
+
+
+def _or_null(path):
+    # null when missing, as the serializers' dict.get() gives; dates are left for fast_json to
+    # encode, exactly as the serializers' datetimes are
+    return {"$ifNull": [path, None]}
+
+
+def _list(path):
+    return {"$ifNull": [path, []]}
+
+
+# Output fields at each level, computed inside the pipeline so documents come back JSON-ready.
+# They mirror restaurant_serializer, dish_serializer and review_serializer in serializers.py.
+REVIEW_FIELDS = {
+    "id": _id_string("$_id"),
+    "user_id": _id_string("$user_id"),
+    "allergies": _list("$allergies"),
+    "restrictions": _list("$restrictions"),
+    "comment": _or_null("$comment"),
+    "safe_categories": _or_null("$safe_categories"),
+    "created_at": _or_null("$created_at"),
+}
+
+DISH_FIELDS = {
+    "id": _id_string("$_id"),
+    "name": _or_null("$name"),
+    "image_url": _or_null("$image_url"),
+    "allergies": _list("$allergies"),
+    "restrictions": _list("$restrictions"),
+    "created_at": _or_null("$created_at"),
+    "updated_at": _or_null("$updated_at"),
+    # Maintained on write by dish_stats.py, mirrors dish_stats.safety_summary
+    "safety_summary": {
+        "review_count": {"$ifNull": ["$stats.review_count", 0]},
+        "allergies": {"$ifNull": ["$stats.allergies", {}]},
+        "restrictions": {"$ifNull": ["$stats.restrictions", {}]},
+        "safe_categories": {"$ifNull": ["$stats.safe_categories", {}]},
+        "last_reviewed_at": _or_null("$stats.last_reviewed_at"),
+    },
+    # "reviews" is filled in from the nested lookup
+}
+
+RESTAURANT_FIELDS = {
+    "id": _id_string("$_id"),
+    "name": _or_null("$name"),
+    "google_data": {
+        "$cond": [
+            {"$ifNull": ["$google_data", False]},
+            {
+                "place_id": _or_null("$google_data.place_id"),
+                "rating": _or_null("$google_data.rating"),
+                "priceLevel": _or_null("$google_data.priceLevel"),
+                "reviews": _or_null("$google_data.reviews"),
+                "address": _or_null("$google_data.address"),
+                "nationalPhoneNumber": _or_null("$google_data.nationalPhoneNumber"),
+            },
+            None,
+        ]
+    },
+    "location": {
+        "$cond": [
+            {"$ifNull": ["$location", False]},
+            {
+                "latitude": {"$arrayElemAt": ["$location.coordinates", 1]},
+                "longitude": {"$arrayElemAt": ["$location.coordinates", 0]},
+            },
+            None,
+        ]
+    },
+    "menu": {"$map": {"input": _list("$menu"), "in": {"$toString": "$$this"}}},
+    # "dishes" is filled in from the dishes lookup
+}
+
+
+def parse_fields(fields):
+    """
+    Parses a comma-separated field selection such as "name,dishes.name,dishes.reviews.recent.comment"
+    into a nested dict. An empty dict at any level means "every field".
+    """
+    selection = {}
+    for path in (fields or "").split(","):
+        node = selection
+        for part in filter(None, path.strip().split(".")):
+            node = node.setdefault(part, {})
+    return selection
+
+
+def _chosen(selection, available):
+    unknown = set(selection) - set(available)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [name for name in available if not selection or name in selection]
+
+
+def _review_lookups(selection, review_limit):
+    chosen = _chosen(selection, ["count", "recent"])
+    review_fields = _chosen(selection.get("recent", {}), REVIEW_FIELDS)
+    stages = []
+    if "recent" in chosen:
+        # Bounded: only the newest `review_limit` reviews per dish
+        stages.append({"$lookup": {
+            "from": "reviews",
+            "localField": "_id",
+            "foreignField": "dish_id",
+            "pipeline": [
+                {"$sort": {"_id": -1}},
+                {"$limit": review_limit},
+                {"$project": {"_id": 0, **{name: REVIEW_FIELDS[name] for name in review_fields}}},
+            ],
+            "as": "_recent_reviews",
+        }})
+
+    summary = {}
+    if "count" in chosen:
+        summary["count"] = {"$ifNull": ["$stats.review_count", 0]}
+    if "recent" in chosen:
+        summary["recent"] = "$_recent_reviews"
+    return stages, summary
+
+
+def restaurant_detail_pipeline(match, fields=None, dish_limit=50, review_limit=3):
+    """
+    One aggregation returning a restaurant, its dishes and a bounded review summary per dish.
+    Only the lookups needed for the selected fields are run. The lookups combine localField with
+    a sub-pipeline so they use the restaurant_id/dish_id indexes (MongoDB 5.0+).
+    Raises ValueError for unknown field names.
+    """
+    selection = parse_fields(fields)
+    restaurant_fields = _chosen(selection, [*RESTAURANT_FIELDS, "dishes"])
+    projection = {"_id": 0, **{name: RESTAURANT_FIELDS[name] for name in restaurant_fields if name != "dishes"}}
+    pipeline = [{"$match": match}, {"$limit": 1}]
+
+    if "dishes" in restaurant_fields:
+        dish_selection = selection.get("dishes", {})
+        dish_fields = _chosen(dish_selection, [*DISH_FIELDS, "reviews"])
+        dish_pipeline = [{"$sort": {"_id": 1}}, {"$limit": dish_limit}]
+        dish_projection = {"_id": 0, **{name: DISH_FIELDS[name] for name in dish_fields if name != "reviews"}}
+
+        if "reviews" in dish_fields:
+            stages, summary = _review_lookups(dish_selection.get("reviews", {}), review_limit)
+            dish_pipeline.extend(stages)
+            dish_projection["reviews"] = summary
+
+        dish_pipeline.append({"$project": dish_projection})
+        pipeline.append({"$lookup": {
+            "from": "dishes",
+            "localField": "_id",
+            "foreignField": "restaurant_id",
+            "pipeline": dish_pipeline,
+            "as": "dishes",
+        }})
+        projection["dishes"] = "$dishes"
+
+    pipeline.append({"$project": projection})
+    return pipeline
@@ -1,32 +1,29 @@
-import openai
+import hashlib
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from resilience import CircuitBreaker
 
-def is_dish_safe(comment, tag_list):
-    """
-    Determines safe dietary categories for a dish based on user comment and unsafe tags.
-    
-    Args:
-        comment (str): A comment about the dish.
-        tag_list (list of str): List of tags indicating what allergies/restrictions the dish contains.
-    
-    Returns:
-        list: List of dietary categories that are safe for this dish.
-    """
+MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")  # Use 'gpt-4' if you have access
+# Budget for one model call, retries included, and the breaker shared by every OpenAI caller
+OPENAI_DEADLINE = float(os.getenv("OPENAI_DEADLINE", "20"))
+OPENAI_RETRIES = int(os.getenv("OPENAI_RETRIES", "1"))
+OPENAI_HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE")) if os.getenv("OPENAI_HEDGE_PERCENTILE") else None
+openai_breaker = CircuitBreaker(
+    "openai",
+    failure_threshold=int(os.getenv("OPENAI_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("OPENAI_BREAKER_RESET", "30")),
+)
 
-    # Combine comments into a single string
-    # combined_comments = "\n".join(comments)
-    all_categories = ["vegan", "vegetarian", "kosher", "nut allergy", "halal", "dairy", "gluten"]
 
-    # Prepare the messages for the chat completion
-    messages = [
-        {
-            "role": "system",
-            "content": (
-                f"""You are an assistant that analyzes comments about a particular dish and dietary restrictions that we know this dish violates,
+def is_connection_error(error):
+    import openai
+
+    return isinstance(error, openai.APIConnectionError)
+
+
+all_categories = ["vegan", "vegetarian", "kosher", "nut allergy", "halal", "dairy", "gluten"]
+
+SYSTEM_PROMPT = f"""You are an assistant that analyzes comments about a particular dish and dietary restrictions that we know this dish violates,
                 then outputs a list of dietary restrictions that this dish is friendly to by following the steps listed below.
                 
                 P: {', '.join(all_categories)}
@@ -40,8 +37,15 @@ def is_dish_safe(comment, tag_list):
                 Step 5: Return the safe categories (the result of Step 4) as a Pythonic, comma-separated list of strings.
                 """
 
-            )
-        },
+# Part of every cached verdict's key, so editing the prompt invalidates previously cached answers
+PROMPT_VERSION = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+def build_messages(comment, tag_list):
+    """
+    Builds the chat messages for classifying a single (comment, tag_list) pair.
+    """
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
         {
             "role": "user",
             "content": (
@@ -52,30 +56,51 @@ def is_dish_safe(comment, tag_list):
         }
     ]
 
-    try:
-        # Call the OpenAI Chat Completion API
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",  # Use 'gpt-4' if you have access
-            messages=messages,
-            max_tokens=150,
-            temperature=0,
-            n=1,
-        )
-
-        # Extract the assistant's reply
-        ai_response = response.choices[0].message.content.strip()
-        safe_categories = [cat.strip().lower() for cat in ai_response.split(',')]
-        valid_categories = [cat for cat in safe_categories if cat in all_categories]
-        return valid_categories
-
-        # return ai_response 
-
-    except Exception as e:
-        # Enhanced error handling
-        print("An error occurred while calling the OpenAI API.")
-        print(f"Exception details: {e}")
-        return []
-    
+def build_batch_messages(items):
+    """
+    Builds the chat messages for classifying several (comment, tag_list) pairs in one call.
+    The model is asked to answer with one numbered line per dish so the answers can be split back out.
+    """
+    dishes = "\n".join(
+        f"{i}. Comment about the dish: {comment} | Known restrictions/allergens in the dish: {', '.join(tag_list)}"
+        for i, (comment, tag_list) in enumerate(items, start=1)
+    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": (
+                f"Apply the steps to each of the following {len(items)} dishes independently.\n\n"
+                f"{dishes}\n\n"
+                "Please respond ONLY with one line per dish, in the same order, formatted as "
+                "'<number>: <comma-separated list of safe categories>'. Leave the list empty if no category is safe."
+            )
+        }
+    ]
+
+def parse_safe_categories(ai_response):
+    """
+    Parses a comma-separated model answer into the list of valid safe categories.
+    """
+    safe_categories = [cat.strip().strip("[]'\"").lower() for cat in ai_response.strip().split(',')]
+    return [cat for cat in safe_categories if cat in all_categories]
+
+def parse_batch_response(ai_response, count):
+    """
+    Splits a numbered, one-line-per-dish model answer back into per-dish category lists.
+    Dishes the model did not answer for are returned as None.
+    """
+    results = [None] * count
+    for line in ai_response.strip().splitlines():
+        number, sep, answer = line.partition(':')
+        number = number.strip().rstrip('.')
+        if not sep or not number.isdigit():
+            continue
+        index = int(number) - 1
+        if 0 <= index < count:
+            results[index] = parse_safe_categories(answer)
+    return results
+
 # def is_dish_safe_from_title(title, tag_list):
 #     """
 #     Determines safe dietary categories for a dish based on its title.
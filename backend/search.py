@@ -0,0 +1,191 @@
+import asyncio
+import bisect
+import heapq
+import logging
+import re
+import unicodedata
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def fold(text):
+    """
+    Normalizes a name for matching: strips accents, case-folds and collapses punctuation to spaces.
+    "Café  Très-Bon!" -> "cafe tres bon"
+    """
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(NON_ALNUM.sub(" ", stripped.casefold()).split())
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def name_key_fields(name):
+    """
+    Fields to $set on a restaurant whenever its name is written, so other workers pick it up.
+    """
+    return {"name_key": fold(name), "search_updated_at": datetime.now(timezone.utc)}
+
+
+class RestaurantSearchIndex:
+    """
+    In-process name index over the restaurants collection.
+
+    Prefix/autocomplete queries are answered from sorted lists of folded names and words with
+    bisect; longer queries also match by substring and trigram similarity. Results are ranked:
+    exact name, name prefix, word prefix, substring, then fuzzy trigram matches.
+    """
+
+    def __init__(self, min_similarity=0.3):
+        self.min_similarity = min_similarity
+        self.loaded = False
+        self._keys = {}
+        self._sorted_keys = []
+        self._sorted_words = []
+        self._postings = defaultdict(set)
+        self._last_sync = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, doc_id, name):
+        doc_id = str(doc_id)
+        self.remove(doc_id)
+        key = fold(name)
+        if not key:
+            return
+        self._keys[doc_id] = key
+        bisect.insort(self._sorted_keys, (key, doc_id))
+        for word in set(key.split()):
+            bisect.insort(self._sorted_words, (word, doc_id))
+        for gram in trigrams(key):
+            self._postings[gram].add(doc_id)
+
+    def remove(self, doc_id):
+        doc_id = str(doc_id)
+        key = self._keys.pop(doc_id, None)
+        if key is None:
+            return
+        self._discard(self._sorted_keys, (key, doc_id))
+        for word in set(key.split()):
+            self._discard(self._sorted_words, (word, doc_id))
+        for gram in trigrams(key):
+            self._postings[gram].discard(doc_id)
+
+    @staticmethod
+    def _discard(entries, entry):
+        i = bisect.bisect_left(entries, entry)
+        if i < len(entries) and entries[i] == entry:
+            del entries[i]
+
+    @staticmethod
+    def _prefix_range(entries, prefix):
+        start = bisect.bisect_left(entries, (prefix,))
+        end = bisect.bisect_left(entries, (prefix + "\uffff",))
+        return entries[start:end]
+
+    def search(self, query, limit=10, offset=0):
+        """
+        Returns (ranked restaurant ids for the requested page, total number of matches).
+        """
+        q = fold(query)
+        if not q:
+            return [], 0
+
+        scores = {}
+        for key, doc_id in self._prefix_range(self._sorted_keys, q):
+            scores[doc_id] = 4.0 if key == q else 3.0
+
+        query_words = q.split()
+        for word, doc_id in self._prefix_range(self._sorted_words, query_words[0]):
+            if doc_id in scores:
+                continue
+            if len(query_words) == 1:
+                scores[doc_id] = 2.0
+                continue
+            words = self._keys[doc_id].split()
+            if all(any(w.startswith(qw) for w in words) for qw in query_words):
+                scores[doc_id] = 2.0
+
+        if len(q) >= 3:
+            query_grams = trigrams(q)
+            counts = defaultdict(int)
+            for gram in query_grams:
+                for doc_id in self._postings.get(gram, ()):
+                    counts[doc_id] += 1
+            threshold = len(query_grams) * self.min_similarity
+            for doc_id, count in counts.items():
+                if doc_id in scores or count < threshold:
+                    continue
+                key = self._keys[doc_id]
+                if q in key:
+                    scores[doc_id] = 1.5
+                    continue
+                similarity = count / (len(query_grams) + len(trigrams(key)) - count)
+                if similarity >= self.min_similarity:
+                    scores[doc_id] = similarity
+
+        ranked = heapq.nsmallest(
+            offset + limit, scores,
+            key=lambda doc_id: (-scores[doc_id], len(self._keys[doc_id]), self._keys[doc_id]),
+        )
+        return ranked[offset:], len(scores)
+
+    async def load(self, collection):
+        """
+        Builds the index from the collection, backfilling `name_key` on documents that lack it.
+        """
+        keys, words, postings, backfill = {}, [], defaultdict(set), []
+        started = datetime.now(timezone.utc)
+        async for restaurant in collection.find({}, {"name": 1, "name_key": 1}):
+            doc_id = str(restaurant["_id"])
+            key = fold(restaurant.get("name"))
+            if restaurant.get("name_key") != key:
+                backfill.append(UpdateOne({"_id": restaurant["_id"]}, {"$set": {"name_key": key}}))
+            if not key:
+                continue
+            keys[doc_id] = key
+            words.extend((word, doc_id) for word in set(key.split()))
+            for gram in trigrams(key):
+                postings[gram].add(doc_id)
+
+        self._keys = keys
+        self._sorted_keys = sorted((key, doc_id) for doc_id, key in keys.items())
+        self._sorted_words = sorted(words)
+        self._postings = postings
+        self._last_sync = started
+        self.loaded = True
+
+        if backfill:
+            await collection.bulk_write(backfill, ordered=False)
+
+    async def refresh(self, collection):
+        """
+        Picks up restaurants named or renamed (by any worker) since the last sync.
+        """
+        since = self._last_sync
+        self._last_sync = datetime.now(timezone.utc)
+        async for restaurant in collection.find({"search_updated_at": {"$gte": since}}, {"name": 1}):
+            self.add(restaurant["_id"], restaurant.get("name"))
+
+    async def keep_in_sync(self, collection, interval=30.0):
+        """
+        Loads the index, then refreshes it every `interval` seconds. Run as a background task.
+        """
+        while True:
+            try:
+                if self.loaded:
+                    await self.refresh(collection)
+                else:
+                    await self.load(collection)
+                    logging.info(f"Restaurant search index loaded with {len(self)} names")
+            except Exception as e:
+                logging.error(f"Error syncing restaurant search index: {e}")
+            await asyncio.sleep(interval)
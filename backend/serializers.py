@@ -0,0 +1,67 @@
+from typing import Dict
+
+from dish_stats import safety_summary
+from fast_json import reads
+
+# Each serializer's projection lists exactly the fields it reads; keep them in sync.
+# Datetimes are left as datetime objects for the JSON encoder to format.
+
+
+@reads("name", "google_data.place_id", "google_data.rating", "google_data.priceLevel", "google_data.reviews",
+       "google_data.address", "google_data.nationalPhoneNumber", "location", "menu")
+def restaurant_serializer(restaurant: Dict) -> Dict:
+    google_data = restaurant.get("google_data")
+    return {
+        "id": str(restaurant["_id"]),
+        "name": restaurant.get("name"),
+        "google_data": {
+            "place_id": google_data.get("place_id"),
+            "rating": google_data.get("rating"),
+            "priceLevel": google_data.get("priceLevel"),
+            "reviews": google_data.get("reviews"),
+            "address": google_data.get("address"),
+            "nationalPhoneNumber": google_data.get("nationalPhoneNumber")
+        } if google_data else None,
+        "location": geo_location(restaurant.get("location")),
+        "menu": [str(dish_id) for dish_id in restaurant.get("menu", [])]
+    }
+
+
+def geo_location(location):
+    # GeoJSON [longitude, latitude] back to the {"latitude", "longitude"} shape Places uses
+    if not location:
+        return None
+    longitude, latitude = location["coordinates"]
+    return {"latitude": latitude, "longitude": longitude}
+
+
+@reads("user_id", "dish_id", "restaurant_id", "allergies", "restrictions", "comment", "safe_categories", "created_at")
+def review_serializer(review: Dict) -> Dict:
+    return {
+        "id": str(review["_id"]),
+        "user_id": str(review["user_id"]),
+        "dish_id": str(review["dish_id"]),
+        "restaurant_id": str(review["restaurant_id"]),
+        "allergies": review.get("allergies", []),
+        "restrictions": review.get("restrictions", []),
+        "comment": review.get("comment"),
+        # None until the background classification job has run
+        "safe_categories": review.get("safe_categories"),
+        "created_at": review.get("created_at")
+    }
+
+
+@reads("name", "image_url", "restaurant_id", "allergies", "restrictions", "reviews", "created_at", "updated_at", "stats")
+def dish_serializer(dish: Dict) -> Dict:
+    return {
+        "id": str(dish["_id"]),
+        "name": dish.get("name"),
+        "image_url": dish.get("image_url"),
+        "restaurant_id": str(dish["restaurant_id"]),
+        "allergies": dish.get("allergies", []),
+        "restrictions": dish.get("restrictions", []),
+        "reviews": [str(review_id) for review_id in dish.get("reviews", [])],
+        "created_at": dish.get("created_at"),
+        "updated_at": dish.get("updated_at"),
+        "safety_summary": safety_summary(dish)
+    }
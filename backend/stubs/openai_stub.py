@@ -0,0 +1,51 @@
+# Minimal stand-in for the OpenAI chat completions API, for running the backend offline.
+#
+#   OPENAI_API_KEY=stub uvicorn stubs.openai_stub:app --port 8100
+#   OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:8100/v1 uvicorn main:app
+#
+# Every dish is answered with all categories minus its known restrictions/allergens.
+# Set STUB_LATENCY_MS to simulate model latency.
+import asyncio
+import os
+import re
+import time
+from typing import Dict
+
+from fastapi import FastAPI, Body
+
+from safety import all_categories
+
+app = FastAPI()
+
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "0"))
+
+KNOWN_TAGS = re.compile(r"Known restrictions/allergens in the dish: ([^\n|]*)")
+BATCH_LINE = re.compile(r"^(\d+)\. .*$", re.MULTILINE)
+
+
+def safe_categories_for(text):
+    match = KNOWN_TAGS.search(text)
+    tags = {tag.strip().lower() for tag in match.group(1).split(",")} if match else set()
+    return ", ".join(cat for cat in all_categories if cat not in tags)
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Dict = Body(...)):
+    if STUB_LATENCY_MS:
+        await asyncio.sleep(STUB_LATENCY_MS / 1000)
+
+    prompt = request["messages"][-1]["content"]
+    dishes = [m.group(0) for m in BATCH_LINE.finditer(prompt)]
+    if dishes:
+        content = "\n".join(f"{i}: {safe_categories_for(dish)}" for i, dish in enumerate(dishes, start=1))
+    else:
+        content = safe_categories_for(prompt)
+
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4, "total_tokens": (len(prompt) + len(content)) // 4},
+    }
@@ -0,0 +1,73 @@
+# Minimal stand-in for the Google Places API (v1), for running the backend offline.
+#
+#   uvicorn stubs.places_stub:app --port 8200
+#   GOOGLE_MAPS_API_KEY=stub GOOGLE_PLACES_BASE_URL=http://127.0.0.1:8200/v1 uvicorn main:app
+#
+# Results are generated deterministically from the query, so repeated searches return the same
+# places. Set STUB_LATENCY_MS to simulate network latency.
+import asyncio
+import hashlib
+import math
+import os
+from typing import Dict
+
+from fastapi import Body, FastAPI, HTTPException
+
+app = FastAPI()
+
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "0"))
+PRICE_LEVELS = ["PRICE_LEVEL_INEXPENSIVE", "PRICE_LEVEL_MODERATE", "PRICE_LEVEL_EXPENSIVE"]
+
+
+def make_place(seed, name, latitude=40.4406, longitude=-79.9959):
+    digest = hashlib.sha256(seed.encode("utf-8")).hexdigest()
+    n = int(digest[:8], 16)
+    return {
+        "id": f"ChIJstub{digest[:19]}",
+        "displayName": {"text": name, "languageCode": "en"},
+        "formattedAddress": f"{n % 9000 + 100} Forbes Ave, Pittsburgh, PA 15213, USA",
+        "nationalPhoneNumber": f"(412) 555-{n % 10000:04d}",
+        "servesVegetarianFood": n % 2 == 0,
+        "priceLevel": PRICE_LEVELS[n % len(PRICE_LEVELS)],
+        "rating": round(3 + (n % 20) / 10, 1),
+        "location": {"latitude": latitude, "longitude": longitude},
+    }
+
+
+async def _delay():
+    if STUB_LATENCY_MS:
+        await asyncio.sleep(STUB_LATENCY_MS / 1000)
+
+
+@app.post("/v1/places:searchText")
+async def search_text(request: Dict = Body(...)):
+    await _delay()
+    query = request.get("textQuery", "")
+    name = query.split(" in ")[0].strip() or "Restaurant"
+    return {"places": [make_place(f"{query}:{i}", f"{name.title()} #{i + 1}") for i in range(request.get("pageSize", 5))]}
+
+
+@app.post("/v1/places:searchNearby")
+async def search_nearby(request: Dict = Body(...)):
+    await _delay()
+    circle = request["locationRestriction"]["circle"]
+    latitude, longitude = circle["center"]["latitude"], circle["center"]["longitude"]
+    radius = circle.get("radius", 1000)
+    places = []
+    for i in range(request.get("maxResultCount", 20)):
+        # Spread results around the centre, inside the radius
+        angle, distance = i * 2.4, radius * (i + 1) / (request.get("maxResultCount", 20) + 1)
+        places.append(make_place(
+            f"{latitude:.3f},{longitude:.3f}:{i}", f"Nearby Restaurant {i + 1}",
+            latitude + distance * math.cos(angle) / 111320,
+            longitude + distance * math.sin(angle) / (111320 * math.cos(math.radians(latitude))),
+        ))
+    return {"places": places}
+
+
+@app.get("/v1/places/{place_id}")
+async def place_details(place_id: str):
+    await _delay()
+    if not place_id.startswith("ChIJstub"):
+        raise HTTPException(status_code=404, detail="Place not found")
+    return {**make_place(place_id, "Refreshed Restaurant"), "id": place_id}
@@ -0,0 +1,63 @@
+# The backend is a flat set of modules run from backend/, so make them importable from here
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class BulkWriteCollection:
+    """
+    A mongomock_motor collection whose bulk_write applies the operations one by one:
+    mongomock's own bulk_write does not accept current pymongo UpdateOne operations.
+    Everything else is passed through.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._pending = []
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    # The builder interface each pymongo operation's _add_to_bulk() reports itself through
+    def add_insert(self, document):
+        self._pending.append(("insert_one", (document,), {}))
+
+    def add_update(self, selector, update, multi, upsert, **kwargs):
+        self._pending.append(("update_many" if multi else "update_one", (selector, update), {"upsert": upsert}))
+
+    def add_replace(self, selector, replacement, upsert, **kwargs):
+        self._pending.append(("replace_one", (selector, replacement), {"upsert": upsert}))
+
+    def add_delete(self, selector, limit, **kwargs):
+        self._pending.append(("delete_one" if limit else "delete_many", (selector,), {}))
+
+    async def bulk_write(self, operations, ordered=True):
+        upserted_ids = {}
+        for index, operation in enumerate(operations):
+            operation._add_to_bulk(self)
+            method, args, kwargs = self._pending.pop()
+            result = await getattr(self._collection, method)(*args, **kwargs)
+            if getattr(result, "upserted_id", None) is not None:
+                upserted_ids[index] = result.upserted_id
+        return SimpleNamespace(upserted_ids=upserted_ids)
+
+
+class MockDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return BulkWriteCollection(self._database[name])
+
+
+@pytest.fixture
+def mongo_db():
+    """
+    A fresh in-memory database whose collections support bulk_write.
+    """
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return MockDatabase(mongomock_motor.AsyncMongoMockClient()["test"])
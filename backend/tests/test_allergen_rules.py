@@ -0,0 +1,89 @@
+import pytest
+
+from allergen_rules import LEXICON, NEUTRAL, AllergenRules
+from safety import all_categories
+
+
+@pytest.fixture
+def rules():
+    return AllergenRules(min_coverage=1.0)
+
+
+@pytest.mark.parametrize("comment", [
+    "the kimchi and curry were great",
+    "fries",
+    "chips and salsa",
+    "salad with dressing",
+    "rice with sauce",
+    "oat milk latte",
+    "corn tortilla with beans",
+])
+def test_ambiguous_ingredients_go_to_the_model(rules, comment):
+    assert not rules.classify(comment, []).settled
+
+
+@pytest.mark.parametrize("word", ["kimchi", "curry", "sauce", "dressing", "oat", "chips", "fries", "salad", "beans"])
+def test_ambiguous_words_are_not_neutral(word):
+    assert LEXICON.get(word) != NEUTRAL
+
+
+def test_plain_ingredients_are_settled_as_safe(rules):
+    verdict = rules.classify("rice and tomato, very fresh", [])
+    assert verdict.settled
+    assert verdict.safe_categories == all_categories
+
+
+def test_known_violations_are_settled(rules):
+    verdict = rules.classify("chicken and rice", [])
+    assert verdict.settled
+    assert verdict.safe_categories == ["nut allergy", "dairy", "gluten"]
+
+
+def test_hedged_comments_are_not_settled(rules):
+    assert not rules.classify("rice with no cheese", []).settled
+
+
+def _settled_safe(rules, comment, category):
+    verdict = rules.classify(comment, [])
+    return verdict.settled and category in verdict.safe_categories
+
+
+@pytest.mark.parametrize("comment, category", [
+    ("cheeseburger", "dairy"),
+    ("cheeseburger", "gluten"),
+    ("the burger was amazing", "gluten"),
+    ("gyro", "gluten"),
+    ("croissant", "vegan"),
+    ("croissant", "vegetarian"),
+    ("sandwich", "vegan"),
+    ("sandwich", "vegetarian"),
+    ("dumplings", "vegan"),
+    ("dumplings", "vegetarian"),
+    ("tempura", "vegan"),
+    ("tempura", "vegetarian"),
+    ("teriyaki bowl", "vegan"),
+    ("teriyaki bowl", "vegetarian"),
+    ("the ramen was great", "vegan"),
+    ("the ramen was great", "vegetarian"),
+    ("satay", "vegan"),
+    ("satay", "vegetarian"),
+    ("satay", "halal"),
+    ("satay", "gluten"),
+    ("eel", "kosher"),
+    ("pizza", "vegetarian"),
+    ("coconut", "nut allergy"),
+    ("wine", "kosher"),
+    ("fried chicken", "gluten"),
+])
+def test_composite_and_ambiguous_words_are_not_settled_as_safe(rules, comment, category):
+    assert not _settled_safe(rules, comment, category)
+
+
+def test_composite_dishes_go_to_the_model(rules):
+    assert not rules.classify("bacon cheeseburger", []).settled
+
+
+def test_composite_dishes_still_settle_when_everything_is_violated(rules):
+    verdict = rules.classify("bacon cheeseburger", ["nut allergy", "dairy", "gluten"])
+    assert verdict.settled
+    assert verdict.safe_categories == []
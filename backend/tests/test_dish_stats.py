@@ -0,0 +1,62 @@
+import asyncio
+from collections import Counter
+from datetime import datetime
+
+from bson import ObjectId
+
+from dish_stats import TAG_FIELDS, rebuild_dish_stats, review_added_update, review_changed_update
+
+
+def _incremental(updates):
+    """
+    Applies a dish's $inc/$max updates the way Mongo would, returning its stats.
+    """
+    counters, last = Counter(), None
+    for update in updates:
+        for field, amount in update.get("$inc", {}).items():
+            if field.startswith("stats."):
+                counters[field] += amount
+        for value in update.get("$max", {}).values():
+            last = value if last is None else max(last, value)
+    stats = {"review_count": counters.pop("stats.review_count", 0), **{field: {} for field in TAG_FIELDS}, "last_reviewed_at": last}
+    for path, count in counters.items():
+        _, field, key = path.split(".", 2)
+        if count:
+            stats[field][key] = count
+    return stats
+
+
+REVIEWS = [
+    {"allergies": ["Peanut", "peanut ", "PEANUT"], "restrictions": ["Vegan"], "safe_categories": ["gluten"]},
+    {"allergies": ["peanut", "Tree.Nut"], "restrictions": ["vegan", " Vegan"]},
+    {"allergies": ["  ", "Shellfish"], "restrictions": [], "safe_categories": ["gluten", "Gluten", "dairy"]},
+    {"comment": "no tags at all"},
+]
+
+
+def test_rebuild_matches_the_incremental_counters(mongo_db):
+    async def scenario():
+        reviews, dishes = mongo_db["reviews"], mongo_db["dishes"]
+        dish_id = ObjectId()
+        await dishes.insert_one({"_id": dish_id, "name": "Pad thai", "version": 3})
+        updates = []
+        for i, review in enumerate(REVIEWS):
+            document = {"dish_id": dish_id, "created_at": datetime(2024, 1, i + 1), **review}
+            await reviews.insert_one(document)
+            updates.append(review_added_update(document))
+
+        # A later edit, applied incrementally and present in the reviews collection
+        old = await reviews.find_one({"comment": "no tags at all"})
+        new = {**old, "allergies": ["Sesame", "sesame"]}
+        updates.append(review_changed_update(old, new))
+        await reviews.replace_one({"_id": old["_id"]}, new)
+
+        await rebuild_dish_stats(mongo_db)
+        return await dishes.find_one({"_id": dish_id}), _incremental(updates)
+
+    dish, incremental = asyncio.run(scenario())
+    rebuilt = dish["stats"]
+    assert rebuilt == incremental
+    assert dish["version"] == 4
+    assert rebuilt["allergies"] == {"peanut": 2, "tree_nut": 1, "shellfish": 1, "sesame": 1}
+    assert rebuilt["restrictions"] == {"vegan": 2}
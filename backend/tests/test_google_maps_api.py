@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+import google_maps_api
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    batches = []
+
+    async def listener(places):
+        batches.append(places)
+
+    monkeypatch.setattr(google_maps_api, "_fetched_listeners", [listener])
+    monkeypatch.setattr(google_maps_api, "_search_cache", google_maps_api.TTLCache(maxsize=16, ttl=600))
+    monkeypatch.setattr(google_maps_api, "_stale_results", google_maps_api.TTLCache(maxsize=16, ttl=600))
+    return batches
+
+
+def test_only_results_fetched_from_google_are_passed_on(fetched):
+    places = [{"id": "p1"}]
+    calls = 0
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        return places
+
+    async def scenario():
+        for _ in range(3):
+            assert await google_maps_api._cached(("text", "a", "b"), upstream) == places
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert calls == 1
+    assert fetched == [places]
+
+
+def test_stale_fallbacks_are_not_passed_on(fetched):
+    places = [{"id": "p1"}]
+    google_maps_api._stale_results.set(("text", "a", "b"), places)
+
+    async def failing():
+        raise RuntimeError("Places is down")
+
+    async def scenario():
+        assert await google_maps_api._cached(("text", "a", "b"), failing) == places
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert fetched == []
@@ -0,0 +1,93 @@
+import asyncio
+
+from bson import ObjectId
+
+from ingest import bulk_insert_reviews, import_file
+from jobs import JobQueue
+
+
+class CountingJobQueue(JobQueue):
+    def __init__(self, collection):
+        super().__init__(collection)
+        self.calls = 0
+
+    async def enqueue_many(self, kind, payloads, delay=0.0):
+        self.calls += 1
+        return await super().enqueue_many(kind, payloads, delay)
+
+
+def _review(dish_id, comment="great"):
+    return {"dish_id": str(dish_id), "restaurant_id": str(ObjectId()), "comment": comment}
+
+
+def test_bulk_reviews_queue_classification_in_one_write(mongo_db):
+    async def scenario():
+        dish_id = ObjectId()
+        await mongo_db["dishes"].insert_one({"_id": dish_id, "name": "Pad thai"})
+        queue = CountingJobQueue(mongo_db["jobs"])
+        items = [_review(dish_id) for _ in range(5)] + [{"comment": "no dish"}]
+
+        inserted, results = await bulk_insert_reviews(mongo_db["reviews"], mongo_db["dishes"], items, ObjectId(), queue)
+
+        assert len(inserted) == 5 and "error" in results[-1]
+        assert queue.calls == 1
+        jobs = await mongo_db["jobs"].find({}).to_list(None)
+        assert sorted(job["payload"]["review_id"] for job in jobs) == sorted(str(review["_id"]) for review in inserted)
+        assert all(job["kind"] == "classify_review" for job in jobs)
+        dish = await mongo_db["dishes"].find_one({"_id": dish_id})
+        assert dish["stats"]["review_count"] == 5
+
+    asyncio.run(scenario())
+
+
+def test_enqueue_failure_does_not_fail_the_insert(mongo_db):
+    class BrokenQueue:
+        async def enqueue_many(self, kind, payloads, delay=0.0):
+            raise ConnectionError("jobs collection unavailable")
+
+    async def scenario():
+        inserted, _ = await bulk_insert_reviews(mongo_db["reviews"], mongo_db["dishes"], [_review(ObjectId())], ObjectId(), BrokenQueue())
+        assert len(inserted) == 1
+
+    asyncio.run(scenario())
+
+
+def test_counter_failure_still_reports_the_saved_reviews(mongo_db):
+    class BrokenDishes:
+        async def bulk_write(self, operations, ordered=True):
+            raise ConnectionError("dishes collection unavailable")
+
+    async def scenario():
+        items = [_review(ObjectId()), {"comment": "no dish"}]
+        inserted, results = await bulk_insert_reviews(mongo_db["reviews"], BrokenDishes(), items, ObjectId())
+        assert len(inserted) == 1
+        assert results[0]["id"] == str(inserted[0]["_id"]) and "warning" in results[0]
+        assert "error" in results[1]
+        assert await mongo_db["reviews"].count_documents({}) == 1
+
+    asyncio.run(scenario())
+
+
+def test_imported_reviews_are_queued_for_classification(mongo_db, tmp_path):
+    async def scenario():
+        dish_ids = [ObjectId() for _ in range(3)]
+        await mongo_db["dishes"].insert_many([{"_id": dish_id, "name": "Dish"} for dish_id in dish_ids])
+        path = tmp_path / "reviews.jsonl"
+        path.write_text("\n".join(f'{{"dish_id": "{dish_id}", "restaurant_id": "{ObjectId()}", "comment": "ok"}}' for dish_id in dish_ids))
+        inserted, failed = await import_file(mongo_db, "reviews", str(path), batch_size=2, user_id=str(ObjectId()))
+        assert (inserted, failed) == (3, 0)
+        assert await mongo_db["jobs"].count_documents({"kind": "classify_review"}) == 3
+        assert await mongo_db["dishes"].count_documents({"stats.review_count": 1}) == 3
+
+    asyncio.run(scenario())
+
+
+def test_malformed_lines_are_skipped(mongo_db, tmp_path, capsys):
+    async def scenario():
+        path = tmp_path / "dishes.jsonl"
+        restaurant_id = ObjectId()
+        path.write_text(f'{{"name": "Soup", "restaurant_id": "{restaurant_id}"}}\n{{"name": "Broken\n{{"name": "Salad", "restaurant_id": "{restaurant_id}"}}\n')
+        return await import_file(mongo_db, "dishes", str(path), batch_size=2)
+
+    assert asyncio.run(scenario()) == (2, 1)
+    assert "record 1: line 2 is not valid JSON" in capsys.readouterr().err
@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from jobs import DEAD, DONE, QUEUED, JobQueue, JobWorkers
+from resilience import CircuitBreaker, CircuitOpen
+
+
+def _naive(value):
+    return value.replace(tzinfo=None)
+
+
+async def _make_due(collection, job_id):
+    # Stand in for the clock moving past available_at
+    await collection.update_one({"_id": job_id}, {"$set": {"available_at": datetime.utcnow() - timedelta(seconds=1)}})
+
+
+def test_open_breaker_defers_jobs_without_using_attempts():
+    async def scenario():
+        collection = mongomock_motor.AsyncMongoMockClient()["test"]["jobs"]
+        queue = JobQueue(collection, max_attempts=5, backoff_base=2.0)
+        # Open for far longer than the 2 + 4 + 8 + 16 s the retries would take
+        breaker = CircuitBreaker("openai", failure_threshold=1, reset_timeout=600)
+        breaker.failure()
+        calls = []
+
+        async def classify(payload):
+            calls.append(payload)
+            breaker.allow()
+
+        workers = JobWorkers(queue, {"classify_review": classify}, defer_on=(CircuitOpen,))
+        job_id = await queue.enqueue("classify_review", {"review_id": "r1"})
+
+        for _ in range(3 * queue.max_attempts):
+            await _make_due(collection, job_id)
+            job = await queue.claim("worker-1")
+            before = datetime.utcnow()
+            await workers.run_job(job)
+            stored = await collection.find_one({"_id": job_id})
+            assert stored["status"] == QUEUED
+            assert stored["attempts"] == 0
+            # Requeued for when the breaker expects to let a call through again
+            assert _naive(stored["available_at"]) >= before + timedelta(seconds=590)
+
+        breaker.success()
+        await _make_due(collection, job_id)
+        await workers.run_job(await queue.claim("worker-1"))
+        stored = await collection.find_one({"_id": job_id})
+        assert stored["status"] == DONE
+        assert len(calls) == 3 * queue.max_attempts + 1
+        assert (await queue.stats())["deferred"] == 3 * queue.max_attempts
+
+    asyncio.run(scenario())
+
+
+def test_other_errors_still_dead_letter():
+    async def scenario():
+        collection = mongomock_motor.AsyncMongoMockClient()["test"]["jobs"]
+        queue = JobQueue(collection, max_attempts=2)
+
+        async def broken(payload):
+            raise ValueError("bad payload")
+
+        workers = JobWorkers(queue, {"classify_review": broken}, defer_on=(CircuitOpen,))
+        job_id = await queue.enqueue("classify_review", {})
+        for _ in range(2):
+            await _make_due(collection, job_id)
+            await workers.run_job(await queue.claim("worker-1"))
+        stored = await collection.find_one({"_id": job_id})
+        assert stored["status"] == DEAD
+        assert stored["attempts"] == 2
+
+    asyncio.run(scenario())
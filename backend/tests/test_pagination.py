@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from pagination import MAX_PAGE_SIZE, paginate
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock_motor.AsyncMongoMockClient()["test"]["items"]
+    asyncio.run(collection.insert_many([{"n": n} for n in range(MAX_PAGE_SIZE + 20)]))
+    return collection
+
+
+def _walk(collection, limit):
+    async def walk():
+        seen, after = [], None
+        while True:
+            documents, after = await paginate(collection, {}, limit, after)
+            seen.extend(document["n"] for document in documents)
+            if after is None:
+                return seen
+    return asyncio.run(walk())
+
+
+@pytest.mark.parametrize("limit", [0, -1, -100])
+def test_non_positive_limits_return_one_document_and_skip_nothing(collection, limit):
+    documents, after = asyncio.run(paginate(collection, {}, limit))
+    assert [document["n"] for document in documents] == [0]
+    assert after is not None
+    assert _walk(collection, limit) == list(range(MAX_PAGE_SIZE + 20))
+
+
+def test_oversized_limits_are_capped(collection):
+    documents, after = asyncio.run(paginate(collection, {}, 10 ** 9))
+    assert len(documents) == MAX_PAGE_SIZE
+    assert after is not None
+    assert _walk(collection, 10 ** 9) == list(range(MAX_PAGE_SIZE + 20))
+
+
+def test_pages_follow_on_without_gaps(collection):
+    assert _walk(collection, 7) == list(range(MAX_PAGE_SIZE + 20))
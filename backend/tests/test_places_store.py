@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from http_cache import document_etag
+from places_store import place_update
+
+
+def _place(rating=4.1):
+    return {
+        "id": "ChIJ-test",
+        "displayName": {"text": "$5 Pizza"},
+        "formattedAddress": "1 Main St",
+        "rating": rating,
+        "location": {"latitude": 40.4, "longitude": -79.9},
+    }
+
+
+async def _store(collection, place):
+    await collection.update_one(*place_update(place), upsert=True)
+    return await collection.find_one({"google_data.place_id": place["id"]})
+
+
+def test_repeated_search_with_the_same_data_keeps_the_etag():
+    async def scenario():
+        restaurants = mongomock_motor.AsyncMongoMockClient()["test"]["restaurants"]
+        first = await _store(restaurants, _place())
+        again = await _store(restaurants, _place())
+        changed = await _store(restaurants, _place(rating=4.5))
+        return first, again, changed
+
+    first, again, changed = asyncio.run(scenario())
+    assert document_etag("restaurant", again) == document_etag("restaurant", first)
+    assert again["google_fetched_at"] >= first["google_fetched_at"]
+    assert document_etag("restaurant", changed) != document_etag("restaurant", first)
+    assert changed["name"] == "$5 Pizza" and changed["menu"] == []
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+from classifier import SafetyClassifier
+from rate_limits import Limit, MemoryBackend, RateLimited, RateLimiter
+from resilience import Policy
+
+
+def _limiter(**limit):
+    return RateLimiter(MemoryBackend(), {"openai": Limit(**limit)})
+
+
+def test_waits_for_a_token_within_max_wait():
+    async def scenario():
+        limiter = _limiter(rate=20, burst=1, max_wait=1.0)
+        await limiter.acquire("openai")
+        started = time.monotonic()
+        await limiter.acquire("openai")
+        return time.monotonic() - started
+
+    assert 0.02 < asyncio.run(scenario()) < 0.5
+
+
+def test_sheds_when_the_deadline_is_sooner_than_the_token():
+    async def scenario():
+        limiter = _limiter(rate=1, burst=1, max_wait=2.0)
+        await limiter.acquire("openai")
+        started = time.monotonic()
+        with pytest.raises(RateLimited) as shed:
+            await limiter.acquire("openai", deadline=time.monotonic() + 0.1)
+        return time.monotonic() - started, shed.value
+
+    elapsed, error = asyncio.run(scenario())
+    # Shed at once rather than sleeping past the caller's deadline
+    assert elapsed < 0.05
+    assert error.retry_after > 0.5
+
+
+def test_expired_deadline_still_takes_an_available_token():
+    async def scenario():
+        limiter = _limiter(rate=1, burst=1, max_wait=2.0)
+        await limiter.acquire("openai", deadline=time.monotonic() - 1)
+
+    asyncio.run(scenario())
+
+
+class _UnusedClient:
+    class chat:
+        class completions:
+            @staticmethod
+            async def create(**kwargs):
+                raise AssertionError("a shed call must not reach the model")
+
+
+def test_classifier_rate_limit_wait_counts_against_its_deadline():
+    async def scenario():
+        limiter = _limiter(rate=0.5, burst=1, max_wait=2.0)
+        await limiter.acquire("openai")
+        classifier = SafetyClassifier(client=_UnusedClient(), limiter=limiter, policy=Policy("openai", timeout=0.2))
+        started = time.monotonic()
+        with pytest.raises(RateLimited):
+            await classifier._complete([], max_tokens=10, call="single")
+        return time.monotonic() - started
+
+    # The token is 2 s away, well past the 0.2 s budget: no point waiting for it
+    assert asyncio.run(scenario()) < 0.1
+
+
+def test_batches_are_charged_per_item_beyond_the_burst():
+    async def scenario():
+        limiter = RateLimiter(MemoryBackend(), {"client_safety_batch": Limit(rate=10, burst=100)})
+        # A full bucket lets one oversized batch through...
+        await limiter.acquire("client_safety_batch", "user:1", cost=1000)
+        # ...but every item is owed: nothing more until ~90 s of refill has paid it off
+        with pytest.raises(RateLimited) as shed:
+            await limiter.acquire("client_safety_batch", "user:1", cost=1)
+        assert shed.value.retry_after > 85
+        # Other clients have their own buckets
+        await limiter.acquire("client_safety_batch", "user:2", cost=100)
+
+    asyncio.run(scenario())
+
+
+def test_a_dish_page_of_single_checks_fits_the_client_limit():
+    from rate_limits import limiter as app_limiter
+
+    async def scenario():
+        limiter = RateLimiter(MemoryBackend(), {"client_safety": app_limiter.limits["client_safety"]})
+        await asyncio.gather(*(limiter.acquire("client_safety", "ip:1") for _ in range(30)))
+
+    asyncio.run(scenario())
@@ -0,0 +1,49 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from bson import ObjectId
+
+from fast_json import dumps
+from restaurant_detail import DISH_FIELDS, REVIEW_FIELDS
+from serializers import dish_serializer, review_serializer
+
+
+def _project(document, fields):
+    async def run():
+        collection = mongomock_motor.AsyncMongoMockClient()["test"]["documents"]
+        await collection.insert_one(document)
+        return await collection.aggregate([{"$project": {"_id": 0, **fields}}]).to_list(None)
+    return asyncio.run(run())[0]
+
+
+def test_detail_dates_match_the_serializers():
+    review = {
+        "_id": ObjectId(), "user_id": ObjectId(), "dish_id": ObjectId(), "restaurant_id": ObjectId(),
+        "comment": "good", "created_at": datetime(2024, 5, 1, 12, 30, 15, 250000),
+    }
+    detail = _project(review, {"created_at": REVIEW_FIELDS["created_at"]})
+    assert dumps(detail["created_at"]) == dumps(review_serializer(review)["created_at"])
+
+
+def test_missing_dates_are_null_like_the_serializers():
+    dish = {"_id": ObjectId(), "restaurant_id": ObjectId(), "name": "Tacos", "created_at": datetime(2024, 5, 1)}
+    detail = _project(dish, {"created_at": DISH_FIELDS["created_at"], "updated_at": DISH_FIELDS["updated_at"]})
+    serialized = dish_serializer(dish)
+    assert dumps(detail["created_at"]) == dumps(serialized["created_at"])
+    assert detail["updated_at"] is None and serialized["updated_at"] is None
+
+
+def test_missing_fields_are_null_like_the_serializers():
+    review = {"_id": ObjectId(), "user_id": ObjectId(), "dish_id": ObjectId(), "restaurant_id": ObjectId()}
+    detail = _project(review, {key: REVIEW_FIELDS[key] for key in ("comment", "safe_categories")})
+    assert detail == {"comment": None, "safe_categories": None}
+    assert review_serializer(review)["comment"] is None
+
+    dish = {"_id": ObjectId(), "restaurant_id": ObjectId()}
+    detail = _project(dish, {key: DISH_FIELDS[key] for key in ("name", "image_url")})
+    assert detail == {"name": None, "image_url": None}
+    assert dish_serializer(dish)["name"] is None
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from uploads import MB, ImageUploader, MultipartFileStream, UploadRejected, UploadTooLarge
+
+BOUNDARY = "----boundary"
+PNG = b"\x89PNG\r\n\x1a\n" + b"x" * 100
+
+
+def _body(data, name="file"):
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="note"\r\n\r\nhello\r\n'
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="{name}"; filename="dish.png"\r\n'
+        f"Content-Type: image/png\r\n\r\n"
+    ).encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+class StreamedRequest:
+    def __init__(self, body, chunk_size=1024, content_length=True):
+        self.headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+        if content_length:
+            self.headers["content-length"] = str(len(body))
+        self.chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+        self.sent = 0
+
+    async def stream(self):
+        for chunk in self.chunks:
+            self.sent += 1
+            yield chunk
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[Key] = Body
+
+
+def test_reads_the_file_field():
+    async def scenario():
+        file = MultipartFileStream(StreamedRequest(_body(PNG), chunk_size=7))
+        return await file.read(10) + await file.read()
+
+    assert asyncio.run(scenario()) == PNG
+
+
+def test_missing_file_field_is_rejected():
+    with pytest.raises(UploadRejected):
+        asyncio.run(MultipartFileStream(StreamedRequest(_body(PNG, name="image"))).read(10))
+
+
+def test_declared_oversized_body_is_refused_before_reading():
+    request = StreamedRequest(_body(PNG + b"x" * 4096))
+    with pytest.raises(UploadTooLarge):
+        MultipartFileStream(request, max_body=1024)
+    assert request.sent == 0
+
+
+def test_oversized_body_is_refused_as_it_arrives():
+    request = StreamedRequest(_body(PNG + b"x" * 64 * 1024), content_length=False)
+
+    async def scenario():
+        file = MultipartFileStream(request, max_body=4096)
+        while await file.read(1024):
+            pass
+
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(scenario())
+    assert request.sent < len(request.chunks)
+
+
+def test_upload_stores_a_streamed_image():
+    s3 = FakeS3()
+    uploader = ImageUploader(s3, "bucket", max_bytes=MB)
+
+    async def scenario():
+        try:
+            return await uploader.upload(MultipartFileStream(StreamedRequest(_body(PNG))))
+        finally:
+            uploader.shutdown()
+
+    key = asyncio.run(scenario())
+    assert s3.objects[key] == PNG
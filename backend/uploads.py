@@ -0,0 +1,309 @@
+import asyncio
+import io
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+MB = 1024 * 1024
+# Room for the multipart boundaries and part headers around the file in a request body
+MULTIPART_OVERHEAD = 64 * 1024
+# S3 rejects multipart parts smaller than 5 MB (except the last one)
+MIN_PART_SIZE = 5 * MB
+
+# Leading bytes of each accepted image format
+SIGNATURES = {
+    "image/jpeg": (b"\xff\xd8\xff",),
+    "image/png": (b"\x89PNG\r\n\x1a\n",),
+    "image/gif": (b"GIF87a", b"GIF89a"),
+    "image/webp": (b"RIFF",),
+}
+EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/gif": ".gif", "image/webp": ".webp"}
+
+
+class UploadRejected(Exception):
+    """Raised when an upload is not an accepted image."""
+
+
+class UploadTooLarge(UploadRejected):
+    """Raised as soon as an upload goes over the size limit."""
+
+
+class MultipartFileStream:
+    """
+    One file field of a multipart/form-data request, parsed from request.stream() as the body
+    arrives, with the async read(size) of an UploadFile. Unlike File(...), which lets Starlette
+    spool the whole body before the handler runs, an oversized body is refused from its
+    Content-Length, or once more than `max_body` bytes have arrived, without reading the rest.
+    """
+
+    def __init__(self, request, field="file", max_body=None):
+        self.field = field
+        self.max_body = max_body
+        content_length = request.headers.get("content-length")
+        if max_body is not None and content_length is not None and content_length.isdigit() and int(content_length) > max_body:
+            raise UploadTooLarge(f"Uploads must be at most {max_body // MB} MB")
+        content_type, options = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in options:
+            raise UploadRejected("Send the image as multipart/form-data")
+        self._chunks = request.stream().__aiter__()
+        self._received = 0
+        self._buffer = bytearray()
+        self._headers = {}
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._in_file = False
+        self._found = False
+        self._finished = False
+        self._parser = MultipartParser(options[b"boundary"], {
+            "on_part_begin": self._part_begin,
+            "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        })
+
+    def _part_begin(self):
+        self._headers = {}
+
+    def _header_end(self):
+        self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._in_file = not self._found and options.get(b"name") == self.field.encode() and b"filename" in options
+        self._found = self._found or self._in_file
+
+    def _part_data(self, data, start, end):
+        if self._in_file:
+            self._buffer.extend(data[start:end])
+
+    def _part_end(self):
+        if self._in_file:
+            self._in_file = False
+            # Nothing after the file is needed
+            self._finished = True
+
+    async def read(self, size=-1):
+        while not self._finished and (size < 0 or len(self._buffer) < size):
+            try:
+                chunk = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self._parser.finalize()
+                self._finished = True
+                break
+            self._received += len(chunk)
+            if self.max_body is not None and self._received > self.max_body:
+                raise UploadTooLarge(f"Uploads must be at most {self.max_body // MB} MB")
+            self._parser.write(chunk)
+        if not self._found and self._finished:
+            raise UploadRejected(f"No {self.field!r} file in the upload")
+        size = len(self._buffer) if size < 0 else min(size, len(self._buffer))
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def sniff_content_type(head: bytes):
+    for content_type, signatures in SIGNATURES.items():
+        if head.startswith(signatures):
+            if content_type == "image/webp" and head[8:12] != b"WEBP":
+                continue
+            return content_type
+    return None
+
+
+def variant_key(key, width):
+    """
+    "dish-uploads/20240101_ab12.png", 200 -> "dish-uploads/20240101_ab12_w200.jpg"
+    """
+    return f"{os.path.splitext(key)[0]}_w{width}.jpg"
+
+
+def render_variants(data: bytes, widths):
+    """
+    Resizes an image to each width (never upscaling) and returns {width: JPEG bytes}.
+    CPU-bound; runs on the uploader's image pool.
+    """
+    from PIL import Image, ImageOps
+
+    variants = {}
+    with Image.open(io.BytesIO(data)) as image:
+        # Lets the JPEG decoder skip detail the largest variant doesn't need
+        image.draft("RGB", (max(widths), max(widths)))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for width in widths:
+            variant = image.copy()
+            variant.thumbnail((width, width * 4))
+            buffer = io.BytesIO()
+            variant.save(buffer, "JPEG", quality=82, optimize=True, progressive=True)
+            variants[width] = buffer.getvalue()
+    return variants
+
+
+class ImageUploader:
+    """
+    Dish photo uploads to S3 that never block the event loop.
+
+    Files are read in chunks and sent as a multipart upload, one part at a time, and refused once
+    they pass max_bytes. Given a MultipartFileStream the limit is checked as the request body
+    arrives; an UploadFile has already been received in full. boto3 calls run on a small I/O
+    thread pool. Browsers can also
+    upload straight to S3 with a presigned POST. Resized variants are rendered on a separate
+    image pool from the stored original (see create_variants).
+
+    Set AWS_ENDPOINT_URL to use a local S3 stand-in such as MinIO or moto_server.
+    """
+
+    def __init__(self, s3_client, bucket, public_base_url=None, prefix="dish-uploads", max_bytes=10 * MB,
+                 part_size=8 * MB, variant_widths=(200, 800), io_workers=4, image_workers=2):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.public_base_url = (public_base_url or f"https://{bucket}.s3.amazonaws.com").rstrip("/")
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.part_size = max(MIN_PART_SIZE, part_size)
+        self.variant_widths = tuple(variant_widths)
+        self._io = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="s3")
+        self._images = ThreadPoolExecutor(max_workers=image_workers, thread_name_prefix="images")
+        self._counters = {"uploaded": 0, "multipart": 0, "rejected": 0, "bytes": 0, "variants": 0}
+
+    async def _call(self, fn, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._io, lambda: fn(**kwargs))
+
+    def new_key(self, content_type):
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return f"{self.prefix}/{timestamp}_{uuid.uuid4().hex[:12]}{EXTENSIONS[content_type]}"
+
+    def url(self, key):
+        return f"{self.public_base_url}/{key}"
+
+    def describe(self, key):
+        return {
+            "key": key,
+            "url": self.url(key),
+            "variants": {str(width): self.url(variant_key(key, width)) for width in self.variant_widths},
+        }
+
+    async def upload(self, file):
+        """
+        Streams a MultipartFileStream, UploadFile or anything else with an async read(size) to S3
+        and returns the key.
+        Raises UploadRejected if it is not an accepted image, UploadTooLarge once it exceeds max_bytes.
+        """
+        buffer = await file.read(self.part_size)
+        content_type = sniff_content_type(buffer[:16])
+        if content_type is None:
+            self._counters["rejected"] += 1
+            raise UploadRejected("Only JPEG, PNG, GIF and WebP images can be uploaded")
+        key = self.new_key(content_type)
+
+        chunk = await file.read(self.part_size)
+        if not chunk:
+            # Small enough for a single request
+            self._check_size(len(buffer))
+            await self._call(self.s3.put_object, Bucket=self.bucket, Key=key, Body=buffer, ContentType=content_type)
+            self._uploaded(len(buffer))
+            return key
+
+        upload = await self._call(self.s3.create_multipart_upload, Bucket=self.bucket, Key=key, ContentType=content_type)
+        upload_id, parts, total = upload["UploadId"], [], 0
+        try:
+            while buffer:
+                total += len(buffer)
+                self._check_size(total)
+                part = await self._call(
+                    self.s3.upload_part,
+                    Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1, Body=buffer,
+                )
+                parts.append({"ETag": part["ETag"], "PartNumber": len(parts) + 1})
+                buffer, chunk = chunk, (await file.read(self.part_size) if chunk else b"")
+            await self._call(
+                self.s3.complete_multipart_upload,
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            await self._call(self.s3.abort_multipart_upload, Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+        self._counters["multipart"] += 1
+        self._uploaded(total)
+        return key
+
+    def _check_size(self, size):
+        if size > self.max_bytes:
+            self._counters["rejected"] += 1
+            raise UploadTooLarge(f"Images must be at most {self.max_bytes // MB} MB")
+
+    def _uploaded(self, size):
+        self._counters["uploaded"] += 1
+        self._counters["bytes"] += size
+
+    async def presigned_post(self, content_type, expires_in=300):
+        """
+        Returns a presigned POST ({"url", "fields"}) under "upload", for the browser to send the
+        file straight to S3, plus the key and final URLs. S3 enforces the size and content type.
+        """
+        if content_type not in EXTENSIONS:
+            raise UploadRejected("Only JPEG, PNG, GIF and WebP images can be uploaded")
+        key = self.new_key(content_type)
+        post = await self._call(
+            self.s3.generate_presigned_post,
+            Bucket=self.bucket,
+            Key=key,
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, self.max_bytes]],
+            ExpiresIn=expires_in,
+        )
+        return {"upload": post, **self.describe(key)}
+
+    async def verify_uploaded(self, key):
+        """
+        Checks that a presigned upload landed under our prefix. Raises UploadRejected otherwise.
+        """
+        if not key.startswith(f"{self.prefix}/") or ".." in key:
+            raise UploadRejected("Unknown upload")
+        try:
+            head = await self._call(self.s3.head_object, Bucket=self.bucket, Key=key)
+        except Exception:
+            raise UploadRejected("Upload not found")
+        self._check_size(head["ContentLength"])
+        self._uploaded(head["ContentLength"])
+
+    async def create_variants(self, key):
+        """
+        Downloads an original, renders its resized variants on the image pool and stores them.
+        Run from the background job queue so uploads return without waiting for it.
+        """
+        def download():
+            return self.s3.get_object(Bucket=self.bucket, Key=key)["Body"].read(self.max_bytes + 1)
+
+        data = await asyncio.get_running_loop().run_in_executor(self._io, download)
+        try:
+            variants = await asyncio.get_running_loop().run_in_executor(self._images, render_variants, data, self.variant_widths)
+        except ImportError:
+            logging.error("Pillow is not installed; skipping image variants")
+            return
+        for width, body in variants.items():
+            await self._call(
+                self.s3.put_object,
+                Bucket=self.bucket, Key=variant_key(key, width), Body=body, ContentType="image/jpeg",
+                CacheControl="public, max-age=31536000, immutable",
+            )
+            self._counters["variants"] += 1
+
+    def stats(self):
+        return {**self._counters, "max_bytes": self.max_bytes, "part_size": self.part_size}
+
+    def shutdown(self):
+        self._io.shutdown(wait=False)
+        self._images.shutdown(wait=False)
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+
+from safety import MODEL, PROMPT_VERSION
+from ttl_cache import TTLCache
+
+
+def verdict_key(comment, tag_list, model=MODEL, prompt_version=PROMPT_VERSION):
+    """
+    Content-addressed key for a safety verdict: the normalized comment, the sorted tag list,
+    the model name and the prompt version. Changing the model or prompt yields new keys.
+    """
+    normalized_comment = " ".join((comment or "").casefold().split())
+    normalized_tags = sorted({tag.strip().lower() for tag in tag_list if tag.strip()})
+    payload = json.dumps([normalized_comment, normalized_tags, model, prompt_version], separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    """
+    Two-tier cache for dish safety verdicts: an in-process LRU in front of a Mongo collection.
+
+    Entries in the collection are removed by a TTL index on `created_at`. Mongo failures are
+    logged and treated as misses so the cache can never fail a safety check.
+    """
+
+    def __init__(self, collection=None, maxsize=10000, ttl=3600.0, persistent_ttl=30 * 24 * 3600):
+        self.collection = collection
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.persistent_ttl = persistent_ttl
+        self.persistent_hits = 0
+        self.persistent_misses = 0
+        self.writes = 0
+
+    async def ensure_indexes(self):
+        if self.collection is not None:
+            await self.collection.create_index("created_at", expireAfterSeconds=self.persistent_ttl)
+
+    async def get(self, comment, tag_list, model=MODEL):
+        """
+        Returns the cached safe categories, or None on a miss.
+        """
+        key = verdict_key(comment, tag_list, model)
+        verdict = self.memory.get(key)
+        if verdict is not None or self.collection is None:
+            return verdict
+
+        try:
+            document = await self.collection.find_one({"_id": key}, {"safe_categories": 1})
+        except Exception as e:
+            logging.error(f"Error reading safety verdict cache: {e}")
+            return None
+
+        if document is None:
+            self.persistent_misses += 1
+            return None
+
+        self.persistent_hits += 1
+        verdict = document["safe_categories"]
+        self.memory.set(key, verdict)
+        return verdict
+
+    async def set(self, comment, tag_list, safe_categories, model=MODEL):
+        key = verdict_key(comment, tag_list, model)
+        self.memory.set(key, list(safe_categories))
+        self.writes += 1
+        if self.collection is None:
+            return
+
+        try:
+            await self.collection.update_one(
+                {"_id": key},
+                {"$set": {
+                    "safe_categories": list(safe_categories),
+                    "model": model,
+                    "prompt_version": PROMPT_VERSION,
+                    "created_at": datetime.now(timezone.utc),
+                }},
+                upsert=True,
+            )
+        except Exception as e:
+            logging.error(f"Error writing safety verdict cache: {e}")
+
+    def stats(self):
+        memory = self.memory.stats()
+        hits = memory["hits"] + self.persistent_hits
+        lookups = memory["hits"] + memory["misses"]
+        return {
+            "hits": hits,
+            "misses": lookups - hits,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0,
+            "memory": memory,
+            "persistent": {"hits": self.persistent_hits, "misses": self.persistent_misses},
+            "writes": self.writes,
+        }
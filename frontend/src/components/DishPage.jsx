@@ -35,31 +35,32 @@ const DishPage = () => {
         const response = await axios.get(`${API_BASE_URL}/reviews/dish/${id}`);
         const reviewsData = response.data;
 
-        // For each review, call /check_safety/ endpoint
-        const reviewsWithSafety = await Promise.all(reviewsData.map(async (review) => {
-          const comment = review.comment;
-          const tag_list = [...(review.allergies || []), ...(review.restrictions || [])];
-
+        // Reviews are classified in the background; only check the ones still waiting for it,
+        // all in one batch request
+        const unclassified = reviewsData.filter((review) => review.safe_categories == null);
+        const checked = {};
+        if (unclassified.length > 0) {
           try {
-            const safetyResponse = await axios.post(`${API_BASE_URL}/check_safety/`, {
-              comment: comment,
-              tag_list: tag_list
-            });
-
-            const safe_categories = safetyResponse.data.safe_categories;
-
-            return {
-              ...review,
-              safe_categories: safe_categories
-            };
+            const safetyResponse = await axios.post(`${API_BASE_URL}/check_safety/batch`, {
+              items: unclassified.map((review) => ({
+                comment: review.comment || '',
+                tag_list: [...(review.allergies || []), ...(review.restrictions || [])]
+              }))
+            }, { responseType: 'text' });
 
+            // One JSON object per line: {index, safe_categories} or {index, error}
+            safetyResponse.data.split('\n').filter((line) => line.trim()).forEach((line) => {
+              const result = JSON.parse(line);
+              checked[unclassified[result.index].id] = result.safe_categories || [];
+            });
           } catch (error) {
-            console.error('Error checking safety for review:', error);
-            return {
-              ...review,
-              safe_categories: []
-            };
+            console.error('Error checking safety for reviews:', error);
           }
+        }
+
+        const reviewsWithSafety = reviewsData.map((review) => ({
+          ...review,
+          safe_categories: review.safe_categories ?? checked[review.id] ?? []
         }));
 
         setReviews(reviewsWithSafety);